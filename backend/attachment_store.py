@@ -0,0 +1,158 @@
+"""Content-addressed on-disk store for attachment data.
+
+Attachments are streamed out of the OST file in chunks and stored once per
+distinct content, as ``blobs/ab/cd/<sha256>`` under the store's root, so the
+same attachment forwarded dozens of times takes the space of one copy and a
+large attachment never has to fit in memory.
+
+Telling that an attachment is a copy takes its full hash, so every attachment
+is still read once, but copies are not written. An attachment that fits in one
+chunk is hashed before anything is written. For larger ones a small probe
+file, keyed by the size and the hash of the first chunk, records the digest of
+content stored with that start. When the probe matches, the rest is only
+hashed, and nothing is written unless the digest turns out to be new.
+Files are written to a temporary name and renamed into place, so concurrent
+writers (parse worker processes) and interrupted ingests never leave a
+partial blob behind.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+# Bytes read from pypff per call
+CHUNK_SIZE = 1024 * 1024
+
+
+class AttachmentStore:
+    """Attachment blobs under ``root``, by the SHA-256 of their content"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        for directory in ("blobs", "probes", "tmp"):
+            (self.root / directory).mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / digest[2:4] / digest
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).is_file()
+
+    def remove(self, digest: str):
+        try:
+            self.path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _probe_path(self, size: int, head_digest: str) -> Path:
+        return self.root / "probes" / head_digest[:2] / f"{size}-{head_digest}"
+
+    def _probe(self, size: int, head_digest: str) -> Optional[str]:
+        """Digest of a stored blob with this size and first chunk, if there is one"""
+        try:
+            digest = self._probe_path(size, head_digest).read_text().strip()
+        except OSError:
+            return None
+        return digest if self.exists(digest) else None
+
+    def put(self, read: Callable[[int], bytes], size: Optional[int] = None,
+            rewind: Optional[Callable[[], None]] = None) -> Tuple[str, int, bool]:
+        """Store the data returned by successive ``read(CHUNK_SIZE)`` calls (until b"").
+
+        ``size``, when known up front, enables the probe; ``rewind`` (seek the
+        source back to its start) lets data that was only hashed be read again
+        if it was not stored after all. Returns (digest, size, whether a new
+        blob was written).
+        """
+        head = read(CHUNK_SIZE) or b""
+        head_digest = hashlib.sha256(head).hexdigest()
+        if size is not None and len(head) >= size:
+            # All of it fits in the first chunk, so its hash is known already
+            if self.exists(head_digest):
+                return head_digest, len(head), False
+            return self._write(head, lambda length: b"")
+
+        known = self._probe(size, head_digest) if size is not None and rewind is not None else None
+        if known is not None:
+            hasher = hashlib.sha256(head)
+            total = len(head)
+            while True:
+                chunk = read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                total += len(chunk)
+            digest = hasher.hexdigest()
+            if digest == known or self.exists(digest):
+                return digest, total, False
+            # Same size and start, different content: read it again to store it
+            rewind()
+            head = read(CHUNK_SIZE) or b""
+
+        digest, total, written = self._write(head, read)
+        if size is None or total == size:
+            self._record_probe(total, head_digest, digest)
+        return digest, total, written
+
+    def _write(self, head: bytes, read: Callable[[int], bytes]) -> Tuple[str, int, bool]:
+        hasher = hashlib.sha256()
+        total = 0
+        descriptor, temp_path = tempfile.mkstemp(dir=self.root / "tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                chunk = head
+                while chunk:
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    total += len(chunk)
+                    chunk = read(CHUNK_SIZE)
+            digest = hasher.hexdigest()
+            path = self.path(digest)
+            if path.is_file():
+                os.unlink(temp_path)
+                return digest, total, False
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temp_path, path)
+            return digest, total, True
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def _record_probe(self, size: int, head_digest: str, digest: str):
+        probe = self._probe_path(size, head_digest)
+        try:
+            probe.parent.mkdir(parents=True, exist_ok=True)
+            probe.write_text(digest)
+        except OSError:
+            # Only an optimisation - the blob itself is stored
+            pass
+
+    def put_attachment(self, attachment) -> Tuple[str, int, bool]:
+        """Stream a pypff attachment into the store (see put)"""
+        size = attachment.get_size() if hasattr(attachment, 'get_size') else None
+        offset = 0
+
+        def read(length: int) -> bytes:
+            nonlocal offset
+            if size is not None:
+                # pypff raises rather than returning b"" when reading past the end
+                length = min(length, size - offset)
+                if length <= 0:
+                    return b""
+            data = attachment.read_buffer(length)
+            offset += len(data)
+            return data
+
+        def rewind():
+            nonlocal offset
+            attachment.seek_offset(0, os.SEEK_SET)
+            offset = 0
+
+        can_rewind = hasattr(attachment, 'seek_offset')
+        if can_rewind:
+            rewind()
+        return self.put(read, size, rewind if can_rewind else None)
@@ -0,0 +1,255 @@
+"""Text extraction from stored attachments, in a pool of worker processes.
+
+Supported formats, recognised by their leading bytes or file extension:
+
+  - PDF: through ``pypdf`` when it is installed, else a built-in reader of the
+    text operators in the (Flate-compressed or plain) content streams, which
+    covers most generated documents but not fonts with custom encodings
+  - Office Open XML (.docx, .xlsx, .pptx) and OpenDocument (.odt, .ods, .odp):
+    the text runs of their XML parts, read from the zip archive
+  - HTML (converted like message bodies) and plain text formats (.txt, .csv,
+    .md, .json, .xml, .log, .ics, .vcf)
+
+Extraction is CPU-bound and runs in worker processes. Each result is handed
+to a callback, together with its status: "done", "unsupported" (a format
+that has no extractor or a file that is too large) or "failed".
+"""
+import logging
+import multiprocessing
+import re
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple
+
+from html_to_text import html_to_text
+
+try:
+    import pypdf
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+# Text kept per attachment; the rest is not indexed
+MAX_TEXT_CHARS = 1_000_000
+# Larger files are not read at all
+MAX_FILE_BYTES = 64 * 1024 * 1024
+# Bytes read from one part of an Office archive (guards against zip bombs)
+MAX_PART_BYTES = 32 * 1024 * 1024
+
+TEXT_EXTENSIONS = {".txt", ".csv", ".tsv", ".md", ".json", ".xml", ".log", ".ics", ".vcf"}
+HTML_EXTENSIONS = {".html", ".htm"}
+# Archive members holding the text of Office Open XML and OpenDocument files
+OFFICE_PARTS = (
+    re.compile(r"word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml"),
+    re.compile(r"xl/sharedStrings\.xml"),
+    re.compile(r"ppt/(slides|notesSlides)/\w+\.xml"),
+    re.compile(r"content\.xml"),
+)
+
+# Text runs, and the ends of paragraphs, shared strings and rows (which become line breaks)
+_XML_TEXT_RE = re.compile(rb"<(?:w:t|a:t|t|text:[a-z-]+)(?:\s[^>]*)?>([^<]*)|(</(?:w:p|a:p|text:p|text:h|si|row)>)")
+_XML_ENTITIES = {b"&lt;": b"<", b"&gt;": b">", b"&quot;": b'"', b"&apos;": b"'", b"&amp;": b"&"}
+_XML_ENTITY_RE = re.compile(rb"&(?:lt|gt|quot|apos|amp);")
+
+_PDF_STREAM_RE = re.compile(rb"<<(.*?)>>\s*stream\r?\n(.*?)\r?\n?endstream", re.S)
+_PDF_TEXT_RE = re.compile(rb"\[((?:\\.|[^\]\\])*)\]\s*TJ|\(((?:\\.|[^\\)])*)\)\s*(?:Tj|'|\")|(T\*|ET|Td|TD)")
+_PDF_STRING_RE = re.compile(rb"\(((?:\\.|[^\\)])*)\)")
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+def sniff_format(path: Path, name: Optional[str]) -> Optional[str]:
+    """'pdf', 'office', 'html' or 'text' from a file's leading bytes and name, None if unsupported"""
+    with open(path, "rb") as f:
+        head = f.read(8)
+    extension = Path(name or "").suffix.lower()
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04") and extension not in (".zip", ".jar", ".apk"):
+        return "office"
+    if extension in HTML_EXTENSIONS:
+        return "html"
+    if extension in TEXT_EXTENSIONS:
+        return "text"
+    return None
+
+
+def extract_text(path: str, name: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """(status, text) of a stored attachment; text is None unless status is "done" """
+    path = Path(path)
+    try:
+        if path.stat().st_size > MAX_FILE_BYTES:
+            return "unsupported", None
+        kind = sniff_format(path, name)
+        if kind is None:
+            return "unsupported", None
+        if kind == "pdf":
+            text = pdf_text(path)
+        elif kind == "office":
+            text = office_text(path)
+            if text is None:
+                return "unsupported", None
+        else:
+            data = path.read_bytes()[:4 * MAX_TEXT_CHARS]
+            text = data.decode("utf-8", errors="replace")
+            if kind == "html":
+                text = html_to_text(text)
+    except Exception as e:
+        logging.debug(f"Text extraction failed for {path.name}: {str(e)}")
+        return "failed", None
+    return "done", re.sub(r"[ \t]+", " ", text or "").strip()[:MAX_TEXT_CHARS]
+
+
+def office_text(path: Path) -> Optional[str]:
+    """Text runs of an Office Open XML or OpenDocument file, None if the archive is neither"""
+    with zipfile.ZipFile(path) as archive:
+        parts = [name for name in archive.namelist() if any(pattern.fullmatch(name) for pattern in OFFICE_PARTS)]
+        if not parts:
+            return None
+        texts = []
+        for part in sorted(parts, key=_natural_key):
+            with archive.open(part) as f:
+                xml = f.read(MAX_PART_BYTES)
+            runs = b"".join(b"\n" if end else run for run, end in _XML_TEXT_RE.findall(xml))
+            texts.append(_XML_ENTITY_RE.sub(lambda m: _XML_ENTITIES[m.group(0)], runs).decode("utf-8", "replace"))
+            if sum(len(text) for text in texts) >= MAX_TEXT_CHARS:
+                break
+    return "\n".join(texts)
+
+
+def _natural_key(name: str) -> list:
+    # slide2.xml before slide10.xml
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def pdf_text(path: Path) -> str:
+    if PYPDF_AVAILABLE:
+        reader = pypdf.PdfReader(str(path))
+        texts = []
+        for page in reader.pages:
+            texts.append(page.extract_text() or "")
+            if sum(len(text) for text in texts) >= MAX_TEXT_CHARS:
+                break
+        return "\n".join(texts)
+    return _pdf_text_builtin(path.read_bytes())
+
+
+def _pdf_string(raw: bytes) -> bytes:
+    """Decode the escapes of a PDF literal string"""
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        byte = raw[i:i + 1]
+        if byte == b"\\" and i + 1 < len(raw):
+            following = raw[i + 1:i + 2]
+            if following in _PDF_ESCAPES:
+                out += _PDF_ESCAPES[following]
+                i += 2
+            elif following.isdigit():
+                octal = re.match(rb"[0-7]{1,3}", raw[i + 1:i + 4]).group(0)
+                out.append(int(octal, 8) & 0xFF)
+                i += 1 + len(octal)
+            elif following in b"\r\n":
+                i += 2
+            else:
+                out += following
+                i += 2
+        else:
+            out += byte
+            i += 1
+    return bytes(out)
+
+
+def _pdf_text_builtin(data: bytes) -> str:
+    """Text shown by the Tj/TJ operators of a PDF's content streams"""
+    texts = []
+    for dictionary, stream in _PDF_STREAM_RE.findall(data):
+        if b"/FlateDecode" in dictionary:
+            try:
+                # Tolerates the trailing bytes some writers leave before endstream
+                stream = zlib.decompressobj().decompress(stream)
+            except zlib.error:
+                continue
+        elif b"/Filter" in dictionary:
+            # Images and other encodings hold no text operators we can read
+            continue
+        if b"BT" not in stream:
+            continue
+        line = []
+        for array, string, operator in _PDF_TEXT_RE.findall(stream):
+            if operator:
+                if line:
+                    texts.append(b"".join(line))
+                    line = []
+            elif array:
+                line.append(b"".join(_pdf_string(item) for item in _PDF_STRING_RE.findall(array)))
+            else:
+                line.append(_pdf_string(string))
+        if line:
+            texts.append(b"".join(line))
+    return "\n".join(text.decode("latin-1") for text in texts)
+
+
+class AttachmentTextExtractor:
+    """Extracts attachment text in worker processes, reporting each result to ``on_result``.
+
+    ``on_result(digest, status, text)`` is called from a pool thread; a digest
+    submitted again while it is queued or running is ignored.
+    """
+
+    def __init__(self, workers: int, on_result: Callable[[str, str, Optional[str]], None]):
+        self.workers = max(1, workers)
+        self._on_result = on_result
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.completed = 0
+
+    def submit(self, items: Iterable[Tuple[str, str, Optional[str]]]) -> int:
+        """Queue (digest, path, name) items for extraction; returns how many were queued"""
+        queued = 0
+        with self._lock:
+            if self._pool is None:
+                # spawn (not fork) so workers never inherit the server's threads and locks
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            for digest, path, name in items:
+                if digest in self._pending:
+                    continue
+                self._pending.add(digest)
+                future = self._pool.submit(extract_text, path, name)
+                future.add_done_callback(lambda done, digest=digest: self._finish(digest, done))
+                queued += 1
+        return queued
+
+    def _finish(self, digest: str, future):
+        if future.cancelled():
+            # Cancelled by shutdown: the blob stays pending, to be extracted after a restart
+            with self._lock:
+                self._pending.discard(digest)
+            return
+        try:
+            status, text = future.result()
+        except Exception as e:
+            logging.error(f"Attachment text extraction for {digest} failed: {str(e)}")
+            status, text = "failed", None
+        try:
+            self._on_result(digest, status, text)
+        except Exception as e:
+            logging.error(f"Error saving text of attachment {digest}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+                self.completed += 1
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
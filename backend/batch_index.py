@@ -0,0 +1,366 @@
+"""Index every OST file under a directory, without the UI.
+
+OST files are found recursively and parsed in parallel, one file per worker
+process (at most --workers at once), with the server's own parser
+(ost_parser; workers never import the server). A worker spools the rows it
+parses to a temporary file as it goes, and this process - the index's single
+writer - streams them into the persistent mail index (OST_INDEX_PATH, or
+--index), so neither holds a whole mailbox in memory. The server loads
+mailboxes from that index by fingerprint, so opening a batch-indexed file -
+before or after a server restart - skips parsing. Files already indexed with
+the same fingerprint are skipped unless --force is given, so an interrupted
+run can simply be started again.
+
+Per-file results are printed as they finish, followed by a throughput and
+error summary. Attachment text extraction queued by the run (with
+OST_EXTRACT_ATTACHMENTS) is waited for, up to --attachment-timeout seconds;
+what is left is extracted after a later ingest. Exits with status 1 if any file failed.
+
+Run from the backend directory:
+
+    python batch_index.py /data/ost [--workers 4] [--metadata-only] [--index ost_index.sqlite3] [--json summary.json]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import ost_parser
+from attachment_store import AttachmentStore
+from date_index import parse_email_date
+
+# Rows pickled to a worker's spool file at a time
+SPOOL_BATCH_SIZE = 500
+
+# Seconds to wait at the end of a run for attachment text extraction
+DEFAULT_ATTACHMENT_TIMEOUT = 600
+
+
+def find_ost_files(directory: str) -> List[str]:
+    """Paths of the .ost files under a directory, sorted"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(".ost"))
+    return paths
+
+
+def parse_file(file_path: str, metadata_only: bool, spool_dir: str, attachment_dir: Optional[str] = None):
+    """Parse one OST file in a worker, spooling its email rows to a file in ``spool_dir``.
+
+    Returns (spool path, email count, progress counters, folder states, seconds).
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    if attachment_dir is not None:
+        ost_parser.use_attachment_store(AttachmentStore(attachment_dir))
+    started = time.perf_counter()
+    progress = ost_parser.IngestProgress()
+    # Taken before parsing, as load_or_parse_ost_file does, so the server can re-ingest the file incrementally
+    folder_scans = ost_parser.snapshot_ost_folders(file_path)
+    stage_seconds = progress.stage_seconds
+    clock = time.perf_counter
+    count = 0
+    fd, spool_path = tempfile.mkstemp(prefix="rows-", dir=spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            batch = []
+            for email in ost_parser.iter_ost_file(file_path, progress, include_body=not metadata_only):
+                store_started = clock()
+                batch.append(dict(vars(email), date_epoch=parse_email_date(email.date)))
+                if len(batch) >= SPOOL_BATCH_SIZE:
+                    pickle.dump(batch, spool, pickle.HIGHEST_PROTOCOL)
+                    count += len(batch)
+                    batch = []
+                stage_seconds["store"] += clock() - store_started
+            if batch:
+                pickle.dump(batch, spool, pickle.HIGHEST_PROTOCOL)
+                count += len(batch)
+    except BaseException:
+        os.remove(spool_path)
+        raise
+    return spool_path, count, progress.counters(), folder_scans, time.perf_counter() - started
+
+
+def iter_spooled_rows(spool_path: str) -> Iterator[Dict]:
+    """The email rows a worker spooled, read a batch at a time"""
+    with open(spool_path, "rb") as spool:
+        while True:
+            try:
+                batch = pickle.load(spool)
+            except EOFError:
+                return
+            yield from batch
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02d}s"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+class BatchIndexer:
+    """Parses files in a process pool and writes each result to the mail index as it arrives"""
+
+    def __init__(self, server, workers: int, metadata_only: bool = False, force: bool = False,
+                 spool_dir: Optional[str] = None):
+        self.server = server
+        self.workers = max(1, workers)
+        self.metadata_only = metadata_only
+        self.force = force
+        # Where workers spool parsed rows (a temporary directory during run() unless given)
+        self.spool_dir = spool_dir
+        store = server.attachment_store
+        self.attachment_dir = str(store.root) if store is not None else None
+        self.progress = server.IngestProgress()
+        self.results: List[Dict] = []
+        self.total = 0
+
+    def already_indexed(self, fingerprint: str) -> bool:
+        mailbox = self.server.mail_index.find_mailbox(fingerprint)
+        return bool(mailbox) and (self.metadata_only or not mailbox['metadata_only'])
+
+    def report(self, result: Dict):
+        self.results.append(result)
+        prefix = f"[{len(self.results)}/{self.total}] {result['path']}:"
+        if result["status"] == "indexed":
+            rate = result["emails"] / result["seconds"] if result["seconds"] else 0.0
+            skipped = f", {result['skipped']} skipped" if result["skipped"] else ""
+            print(f"{prefix} {result['emails']} emails{skipped} in {result['seconds']:.1f}s ({rate:.0f} emails/s)")
+        elif result["status"] == "already indexed":
+            print(f"{prefix} already indexed")
+        else:
+            print(f"{prefix} FAILED: {result['error']}")
+        sys.stdout.flush()
+
+    def store(self, file_path: str, fingerprint: str, outcome) -> Dict:
+        """Write a worker's parse result to the index, removing its spool file"""
+        spool_path, count, counters, folder_scans, seconds = outcome
+        progress = self.server.IngestProgress()
+        progress.add(counters)
+        try:
+            mailbox_id = None
+            if count:
+                mailbox_id = self.server.index_rows(fingerprint, file_path, iter_spooled_rows(spool_path),
+                                                    self.metadata_only, folder_scans, progress, replace_source=True)
+        finally:
+            os.remove(spool_path)
+        self.progress.add(progress.counters())
+        result = {
+            "path": file_path,
+            "status": "indexed",
+            "emails": count,
+            "skipped": progress.messages_skipped,
+            "seconds": seconds,
+            "bytes": os.path.getsize(file_path),
+        }
+        if count and mailbox_id is None:
+            # index_rows logs the error and returns None rather than raising
+            result.update(status="failed", error="could not write the mail index (see the log)")
+        return result
+
+    def run(self, paths: List[str]):
+        self.total = len(paths)
+        files = []
+        for file_path in paths:
+            try:
+                fingerprint = self.server.file_fingerprint(file_path)
+            except OSError as e:
+                self.report({"path": file_path, "status": "failed", "error": str(e)})
+                continue
+            if not self.force and self.already_indexed(fingerprint):
+                self.report({"path": file_path, "status": "already indexed"})
+                continue
+            files.append((file_path, fingerprint))
+
+        if self.spool_dir is None:
+            with tempfile.TemporaryDirectory(prefix="batch-index-") as spool_dir:
+                self.spool_dir = spool_dir
+                try:
+                    self.parse_all(files)
+                finally:
+                    self.spool_dir = None
+        else:
+            self.parse_all(files)
+
+    def parse_all(self, files: List[Tuple[str, str]]):
+        # Up to two files per worker in flight: parsed results wait on disk
+        # for this process to index them
+        while files:
+            in_flight, files = self.parse_files(files, self.workers, 2 * self.workers)
+            # A dying worker process (e.g. pypff crashing on a corrupt file) takes the
+            # files in flight down with it; retry each of those alone to find the culprit
+            for file_path, fingerprint in in_flight:
+                if self.parse_files([(file_path, fingerprint)], 1, 1)[0]:
+                    self.report({"path": file_path, "status": "failed",
+                                 "error": "the worker process parsing it died"})
+
+    def parse_files(self, files: List[Tuple[str, str]], workers: int, in_flight: int):
+        """Parse and index (path, fingerprint) files in a process pool.
+
+        Stops if a worker process dies, returning the files that were in flight
+        then and the ones not started yet (both empty once all files are done).
+        """
+        queue = list(reversed(files))
+        # spawn (not fork), as for the server's own worker pools
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            running = {}
+            while queue or running:
+                while queue and len(running) < in_flight:
+                    file_path, fingerprint = queue.pop()
+                    future = pool.submit(parse_file, file_path, self.metadata_only, self.spool_dir,
+                                         self.attachment_dir)
+                    running[future] = (file_path, fingerprint)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    file_path, fingerprint = running[future]
+                    try:
+                        outcome = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        continue
+                    except Exception as e:
+                        result = {"path": file_path, "status": "failed", "error": str(e)}
+                    else:
+                        result = self.store(file_path, fingerprint, outcome)
+                    del running[future]
+                    self.report(result)
+                if broken:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    return list(running.values()), list(reversed(queue))
+        return [], []
+
+    def wait_for_attachment_text(self, timeout: float = DEFAULT_ATTACHMENT_TIMEOUT, poll: float = 0.5) -> bool:
+        """Let queued attachment text extraction finish, so it is searchable once the run ends.
+
+        Gives up after ``timeout`` seconds, returning False: the attachments
+        left stay pending in the index, to be extracted after a later ingest.
+        """
+        extractor = self.server.attachment_extractor
+        if extractor.queued:
+            print(f"Waiting for the text of {extractor.queued} attachments...")
+            sys.stdout.flush()
+        deadline = time.monotonic() + timeout
+        while extractor.queued:
+            if time.monotonic() >= deadline:
+                print(f"Stopped waiting after {timeout:.0f}s: the text of {extractor.queued} attachments "
+                      "will be extracted after a later ingest")
+                sys.stdout.flush()
+                return False
+            time.sleep(poll)
+        return True
+
+    def summary(self, elapsed: float) -> Dict:
+        indexed = [result for result in self.results if result["status"] == "indexed"]
+        emails = sum(result["emails"] for result in indexed)
+        data_bytes = sum(result["bytes"] for result in indexed)
+        return {
+            "files": len(self.results),
+            "indexed": len(indexed),
+            "already_indexed": sum(1 for result in self.results if result["status"] == "already indexed"),
+            "failed": [
+                {"path": result["path"], "error": result["error"]}
+                for result in self.results if result["status"] == "failed"
+            ],
+            "emails": emails,
+            "messages_skipped": self.progress.messages_skipped,
+            "skipped_by_reason": dict(self.progress.skipped_by_reason),
+            "bytes": data_bytes,
+            "elapsed_seconds": round(elapsed, 3),
+            "emails_per_second": round(emails / elapsed, 1) if elapsed else 0.0,
+            "mb_per_second": round(data_bytes / 1024 / 1024 / elapsed, 2) if elapsed else 0.0,
+            "stage_seconds": {stage: round(seconds, 3) for stage, seconds in self.progress.stage_seconds.items()},
+        }
+
+
+def print_summary(summary: Dict, workers: int):
+    print()
+    print(f"files:   {summary['files']} found, {summary['indexed']} indexed, "
+          f"{summary['already_indexed']} already indexed, {len(summary['failed'])} failed")
+    skipped = ""
+    if summary["messages_skipped"]:
+        skipped = f" ({summary['messages_skipped']} messages skipped: {summary['skipped_by_reason']})"
+    print(f"emails:  {summary['emails']} indexed{skipped}")
+    print(f"time:    {format_duration(summary['elapsed_seconds'])} with {workers} workers, "
+          f"{summary['emails_per_second']:.0f} emails/s, "
+          f"{summary['bytes'] / 1024 / 1024:.0f} MB at {summary['mb_per_second']:.1f} MB/s")
+    staged = {stage: seconds for stage, seconds in summary["stage_seconds"].items() if seconds >= 0.05}
+    if staged:
+        print("stages:  " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in staged.items())
+              + " (summed over the workers)")
+    if summary["failed"]:
+        print("failed:")
+        for failure in summary["failed"]:
+            print(f"  {failure['path']}: {failure['error']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="directory searched (recursively) for .ost files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="files parsed at once (default: one per CPU)")
+    parser.add_argument("--metadata-only", action="store_true",
+                        help="index without bodies, which are then decoded when an email is opened")
+    parser.add_argument("--index", help="mail index to write (default: OST_INDEX_PATH or the server's default)")
+    parser.add_argument("--force", action="store_true", help="reparse files that are already indexed")
+    parser.add_argument("--attachment-timeout", type=float, default=DEFAULT_ATTACHMENT_TIMEOUT,
+                        help="seconds to wait for attachment text extraction at the end "
+                             f"(default: {DEFAULT_ATTACHMENT_TIMEOUT})")
+    parser.add_argument("--json", help="also write the summary to this file")
+    parser.add_argument("--verbose", action="store_true", help="log at INFO level")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"not a directory: {args.directory}")
+
+    # Configure the server before importing it: the index to write, and serial
+    # parsing within each file (the workers inherit the environment), since
+    # the files themselves are parsed in parallel
+    if args.index:
+        os.environ["OST_INDEX_PATH"] = os.path.abspath(args.index)
+    os.environ["OST_PARSE_WORKERS"] = "1"
+
+    import server
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if not server.PYPFF_AVAILABLE:
+        print("pypff library is not installed. Cannot parse OST files.", file=sys.stderr)
+        return 2
+
+    paths = find_ost_files(os.path.abspath(args.directory))
+    print(f"Indexing {len(paths)} OST files into {server.mail_index.db_path} with {args.workers} workers")
+    sys.stdout.flush()
+
+    started = time.monotonic()
+    indexer = BatchIndexer(server, args.workers, metadata_only=args.metadata_only, force=args.force)
+    try:
+        # Attachment blobs are pruned once, when the last file is indexed
+        with server.ingest_in_flight():
+            indexer.run(paths)
+        indexer.wait_for_attachment_text(args.attachment_timeout)
+    finally:
+        server.attachment_extractor.shutdown()
+        server.mail_index.close()
+    summary = indexer.summary(time.monotonic() - started)
+
+    print_summary(summary, indexer.workers)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Micro-benchmark: html_to_text against the previous regex chain.
+
+Converts generated newsletter-sized HTML bodies (nested layout tables, inline
+styles, a <style> block, entities, lists, tracking comments) with both
+converters and reports per-body time and the speedup.
+
+Run from the backend directory:
+
+    python benchmarks/bench_html_to_text.py [--bodies 200] [--repeat 5]
+"""
+import argparse
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from html_to_text import html_to_text  # noqa: E402
+
+
+def legacy_html_to_text(body_text: str) -> str:
+    """The regex chain extract_body_text used before html_to_text, kept for comparison"""
+    body_text = re.sub(r'<br\s*/?>', '\n', body_text, flags=re.IGNORECASE)
+    body_text = re.sub(r'</p>', '\n\n', body_text, flags=re.IGNORECASE)
+    body_text = re.sub(r'</div>', '\n', body_text, flags=re.IGNORECASE)
+    body_text = re.sub(r'</tr>', '\n', body_text, flags=re.IGNORECASE)
+    body_text = re.sub(r'</li>', '\n', body_text, flags=re.IGNORECASE)
+    body_text = re.sub(r'<li[^>]*>', '• ', body_text, flags=re.IGNORECASE)
+
+    body_text = re.sub('<[^<]+?>', '', body_text)
+
+    body_text = body_text.replace('&nbsp;', ' ')
+    body_text = body_text.replace('&amp;', '&')
+    body_text = body_text.replace('&lt;', '<')
+    body_text = body_text.replace('&gt;', '>')
+    body_text = body_text.replace('&quot;', '"')
+
+    lines = body_text.split('\n')
+    lines = [line.strip() for line in lines]
+    return '\n'.join(line for line in lines if line)
+
+
+WORDS = (
+    "quarterly update team project budget forecast launch review customer roadmap "
+    "meeting schedule invoice report analysis growth product release feedback "
+    "partner offer event webinar summary highlights"
+).split()
+
+STYLE_BLOCK = """<style type="text/css">
+  body { margin: 0; padding: 0; font-family: Arial, Helvetica, sans-serif; }
+  .container { width: 600px; margin: 0 auto; background-color: #ffffff; }
+  .button a { color: #ffffff; text-decoration: none; padding: 12px 24px; }
+  @media only screen and (max-width: 600px) { .container { width: 100% !important; } }
+</style>"""
+
+
+def sentence(rng: random.Random, n: int) -> str:
+    words = [rng.choice(WORDS) for _ in range(n)]
+    return " ".join(words).capitalize() + "."
+
+
+def newsletter_html(rng: random.Random, sections: int = 12) -> str:
+    """A marketing-newsletter style HTML body of roughly 50-80 KB.
+
+    Like real newsletters it is mostly markup: nested layout tables, long
+    inline style attributes, spacer cells and tracking links around short runs
+    of text.
+    """
+    cell_style = ('font-family: Arial, Helvetica, sans-serif; font-size: 16px; line-height: 24px; '
+                  'color: #333333; mso-line-height-rule: exactly; -webkit-text-size-adjust: 100%;')
+    spacer = ('<tr><td height="20" style="font-size: 20px; line-height: 20px; mso-line-height-rule: exactly;">'
+              '&nbsp;</td></tr>')
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Newsletter</title>",
+        STYLE_BLOCK,
+        "</head><body style=\"margin: 0; padding: 0;\"><!-- tracking: campaign=1234 --><center>",
+        '<table class="container" width="600" cellpadding="0" cellspacing="0" border="0" role="presentation">',
+    ]
+    for _ in range(sections):
+        parts.append(spacer)
+        parts.append(
+            '<tr><td align="left" valign="top" style="padding: 0 30px;">'
+            '<table width="100%" cellpadding="0" cellspacing="0" border="0" role="presentation"><tr>'
+            f'<td style="{cell_style}"><h2 style="margin: 0 0 12px 0; font-size: 22px; font-weight: bold;">'
+            f'<span style="color: #1a1a1a;">{sentence(rng, 5)}</span></h2>'
+        )
+        for _ in range(rng.randint(1, 3)):
+            parts.append(
+                f'<p style="margin: 0 0 16px 0; {cell_style}">{sentence(rng, 14)} '
+                f'<a href="https://click.example.com/track?u={rng.getrandbits(64):x}&amp;id={rng.getrandbits(32):x}" '
+                f'style="color: #0066cc; text-decoration: underline;" target="_blank">{sentence(rng, 3)}</a>'
+                f' R&amp;D &lt;beta&gt; &quot;preview&quot; &mdash; &euro;{rng.randint(10, 999)}<br/>'
+                f'<span style="font-size: 13px; color: #777777;">{sentence(rng, 6)}</span></p>'
+            )
+        parts.append('<ul style="margin: 0; padding-left: 20px;">')
+        for _ in range(rng.randint(2, 4)):
+            parts.append(f'<li style="margin-bottom: 6px; {cell_style}"><a href="https://example.com/{rng.random()}" '
+                         f'style="color: #0066cc;">{sentence(rng, 6)}</a></li>')
+        parts.append('</ul></td></tr></table></td></tr>')
+        parts.append(
+            '<tr><td align="center"><table cellpadding="0" cellspacing="0" border="0" role="presentation"><tr>'
+            + "".join(
+                '<td class="button" align="center" bgcolor="#0066cc" style="border-radius: 4px; padding: 0 8px;">'
+                f'<a href="https://click.example.com/{rng.getrandbits(48):x}" target="_blank" '
+                'style="font-size: 15px; font-weight: bold; color: #ffffff; display: inline-block;">'
+                f'{rng.choice(WORDS)}</a></td>'
+                for _ in range(3)
+            )
+            + '</tr></table></td></tr>'
+        )
+    parts.append('<tr><td style="padding: 20px; font-size: 11px; color: #999999;">'
+                 '&copy; 2024 Example Inc. &middot; <a href="#">Unsubscribe</a></td></tr>')
+    parts.append('</table></center><img src="https://example.com/open.gif" width="1" height="1" alt=""></body></html>')
+    return "".join(parts)
+
+
+def time_converter(convert, bodies, repeat: int) -> list:
+    """Per-body seconds of each run over all bodies"""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for body in bodies:
+            convert(body)
+        runs.append((time.perf_counter() - started) / len(bodies))
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bodies", type=int, default=200, help="number of generated HTML bodies")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per converter")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bodies = [newsletter_html(rng) for _ in range(args.bodies)]
+    total_kb = sum(len(body) for body in bodies) / 1024
+    print(f"{len(bodies)} bodies, {total_kb / len(bodies):.1f} KB average")
+
+    # Warm up both converters (regex caches, allocator)
+    for body in bodies[:10]:
+        legacy_html_to_text(body)
+        html_to_text(body)
+
+    results = {}
+    for name, convert in (("regex chain", legacy_html_to_text), ("html_to_text", html_to_text)):
+        runs = time_converter(convert, bodies, args.repeat)
+        results[name] = statistics.median(runs)
+        print(f"{name:>14}: {results[name] * 1e6:9.1f} us/body (median of {args.repeat}), "
+              f"{total_kb / 1024 / (results[name] * len(bodies)):7.1f} MB/s")
+
+    print(f"       speedup: {results['regex chain'] / results['html_to_text']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
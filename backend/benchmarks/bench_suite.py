@@ -0,0 +1,277 @@
+"""Benchmark suite: ingest, date filtering and /api/search-emails on synthetic mailboxes.
+
+For each mailbox size a synthetic mailbox (see synthetic_mailbox.py) is
+parsed through the server's real ingest path with pypff replaced by the
+generator, written to a throwaway index, and loaded; then date-range filters
+and /api/search-emails requests (date pages, text queries, cursor paging) are
+timed. Reports throughput, latency percentiles and peak memory. Runs offline,
+without an OST file.
+
+Run from the backend directory:
+
+    python benchmarks/bench_suite.py [--sizes 10000,100000,1000000] [--queries 200] [--json results.json]
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ost_parser  # noqa: E402
+from synthetic_mailbox import LAST_NAMES, WORDS, SyntheticMailbox  # noqa: E402
+
+_PAGE_BYTES = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def peak_rss() -> int:
+    """Peak resident memory of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss() -> int:
+    """Resident memory of this process in bytes (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_BYTES
+    except OSError:
+        return peak_rss()
+
+
+class PeakMemory:
+    """Samples resident memory in a background thread while a stage runs"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        gc.collect()
+        self.baseline = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth_mb(self) -> float:
+        return (self.peak - self.baseline) / 1024 / 1024
+
+
+def percentiles(samples: list) -> dict:
+    """p50/p95/p99 and mean of latencies in seconds, reported in milliseconds"""
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": at(0.50),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+    }
+
+
+def timed(samples: list, call, *args, **kwargs):
+    started = time.perf_counter()
+    result = call(*args, **kwargs)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def random_ranges(rng: random.Random, synthetic: SyntheticMailbox, count: int) -> list:
+    """(start_date, end_date) strings of random windows from a day to a year"""
+    ranges = []
+    for _ in range(count):
+        length = timedelta(days=rng.choice((1, 7, 30, 90, 365)))
+        start = synthetic.start_date + timedelta(seconds=rng.random() * synthetic.date_spread_seconds)
+        ranges.append((start.strftime("%Y-%m-%d"), (start + length).strftime("%Y-%m-%d")))
+    return ranges
+
+
+def random_queries(rng: random.Random, count: int) -> list:
+    """Free-text queries of the kinds analysts type: words, phrases, fields and filters"""
+    kinds = (
+        lambda: rng.choice(WORDS),
+        lambda: f"{rng.choice(WORDS)} {rng.choice(WORDS)}",
+        lambda: f'"{rng.choice(WORDS)} {rng.choice(WORDS)}"',
+        lambda: f"{rng.choice(WORDS)} OR {rng.choice(WORDS)}",
+        lambda: f"from:{rng.choice(LAST_NAMES).lower()}",
+        lambda: f"{rng.choice(WORDS)} has:attachment",
+    )
+    return [rng.choice(kinds)() for _ in range(count)]
+
+
+def bench_size(server, client, size: int, args) -> dict:
+    rng = random.Random(args.seed)
+    synthetic = SyntheticMailbox(messages=size, html_ratio=args.html_ratio, seed=args.seed)
+    server.pypff = ost_parser.pypff = synthetic.pypff_module()
+    server.PYPFF_AVAILABLE = ost_parser.PYPFF_AVAILABLE = True
+    results = {"messages": size}
+
+    progress = server.IngestProgress()
+    with PeakMemory() as memory:
+        started = time.perf_counter()
+        emails = server.parse_ost_file(f"synthetic-{size}.ost", progress)
+        elapsed = time.perf_counter() - started
+    results["ingest"] = {
+        "seconds": elapsed,
+        "messages_per_second": len(emails) / elapsed,
+        "text_mb_per_second": progress.bytes_extracted / 1024 / 1024 / elapsed,
+        "peak_memory_growth_mb": memory.growth_mb,
+        "store_mb": emails.nbytes() / 1024 / 1024,
+    }
+
+    with PeakMemory() as memory:
+        started = time.perf_counter()
+        mailbox_id = server.index_emails(f"synthetic-{size}-{args.seed}", None, emails)
+        elapsed = time.perf_counter() - started
+    results["index"] = {
+        "seconds": elapsed,
+        "messages_per_second": len(emails) / elapsed,
+        "peak_memory_growth_mb": memory.growth_mb,
+    }
+
+    started = time.perf_counter()
+    mailbox = server.LoadedMailbox(emails, mailbox_id)
+    results["load"] = {"seconds": time.perf_counter() - started}
+    entry = server.register_mailbox("bench", mailbox, f"synthetic {size}")
+
+    ranges = random_ranges(rng, synthetic, args.queries)
+    queries = random_queries(rng, args.queries)
+    samples = []
+    matched = 0
+    for start_date, end_date in ranges:
+        matched += len(timed(samples, server.filter_emails_by_date, mailbox, start_date, end_date))
+    results["date_filter"] = dict(percentiles(samples), mean_matches=matched / len(ranges))
+
+    headers = {"X-Session-Id": "bench"}
+    searches = {
+        "first_page": lambda i: {},
+        "date_page": lambda i: {"start_date": ranges[i][0], "end_date": ranges[i][1]},
+        "text_query": lambda i: {"query": queries[i]},
+        "full_projection": lambda i: {"start_date": ranges[i][0], "end_date": ranges[i][1], "projection": "full"},
+    }
+    results["search"] = {}
+    for name, make_request in searches.items():
+        samples = []
+        response_bytes = wire_bytes = 0
+        for i in range(args.queries):
+            body = dict(make_request(i), handles=[entry.handle], page_size=args.page_size)
+            response = timed(samples, client.post, "/api/search-emails", json=body, headers=headers)
+            response.raise_for_status()
+            response_bytes += len(response.content)
+            # Compressed size when the response was compressed
+            wire_bytes += response.num_bytes_downloaded
+        results["search"][name] = dict(percentiles(samples), mean_response_kb=response_bytes / args.queries / 1024,
+                                        mean_wire_kb=wire_bytes / args.queries / 1024)
+
+    # Following next_cursor through consecutive pages of the whole mailbox
+    samples = []
+    cursor = None
+    for _ in range(args.queries):
+        body = {"handles": [entry.handle], "page_size": args.page_size, "cursor": cursor}
+        response = timed(samples, client.post, "/api/search-emails", json=body, headers=headers).json()
+        cursor = response["next_cursor"]
+        if cursor is None:
+            break
+    results["search"]["cursor_paging"] = percentiles(samples)
+
+    server.mailbox_catalog.remove("bench", entry.handle)
+    del mailbox, emails
+    gc.collect()
+    return results
+
+
+def print_results(results: dict):
+    size = results["messages"]
+    ingest, index = results["ingest"], results["index"]
+    print(f"\n== {size:,} messages")
+    print(f"  {'ingest':<24} {ingest['messages_per_second']:>10,.0f} msg/s  {ingest['text_mb_per_second']:6.1f} MB/s text"
+          f"  {ingest['seconds']:8.2f} s  peak +{ingest['peak_memory_growth_mb']:.0f} MB"
+          f" (store {ingest['store_mb']:.0f} MB)")
+    print(f"  {'index write':<24} {index['messages_per_second']:>10,.0f} msg/s"
+          f"  {index['seconds']:24.2f} s  peak +{index['peak_memory_growth_mb']:.0f} MB")
+    print(f"  {'load':<24} {results['load']['seconds'] * 1000:>10.1f} ms")
+
+    def latency_line(name, stats, extra=""):
+        print(f"  {name:<24} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms"
+              f"  p99 {stats['p99_ms']:8.2f} ms  ({stats['count']} runs{extra})")
+
+    date_filter = results["date_filter"]
+    latency_line("date filter", date_filter, f", {date_filter['mean_matches']:,.0f} matches on average")
+    for name, stats in results["search"].items():
+        extra = ""
+        if "mean_response_kb" in stats:
+            extra = f", {stats['mean_response_kb']:.1f} KB, {stats['mean_wire_kb']:.1f} KB on the wire"
+        latency_line(f"search {name}", stats, extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated mailbox sizes (messages)")
+    parser.add_argument("--queries", type=int, default=200, help="timed requests per query kind")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--html-ratio", type=float, default=0.5, help="share of messages with HTML-only bodies")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # Configure the server before importing it: a throwaway index, serial
+    # parsing (workers could not see the synthetic pypff) and no eviction
+    workdir = tempfile.mkdtemp(prefix="ost-bench-")
+    os.environ["OST_INDEX_PATH"] = os.path.join(workdir, "index.sqlite3")
+    os.environ["OST_PARSE_WORKERS"] = "1"
+    os.environ.setdefault("OST_MEMORY_BUDGET_MB", str(64 * 1024))
+
+    import server
+    from fastapi.testclient import TestClient
+
+    logging.getLogger().setLevel(logging.WARNING)
+    client = TestClient(server.app)
+
+    all_results = []
+    try:
+        for size in (int(value) for value in args.sizes.split(",")):
+            results = bench_size(server, client, size, args)
+            print_results(results)
+            all_results.append(results)
+            sys.stdout.flush()
+    finally:
+        server.mail_index.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\npeak RSS of the whole run: {peak_rss() / 1024 / 1024:.0f} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
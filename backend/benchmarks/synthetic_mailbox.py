@@ -0,0 +1,248 @@
+"""Synthetic mailboxes: a pypff-compatible fake folder and message tree.
+
+Lets the ingest and search paths be measured at any size without a real OST
+file. A ``SyntheticMailbox`` stands in for the ``pypff`` module: its
+``file()`` returns an object with ``open``/``close``/``get_root_folder`` like
+``pypff.file``, and the folders and messages below it expose the attributes
+and methods the server reads (sub-folder and sub-message accessors, subject,
+sender, recipients, submit and delivery times, plain text / HTML bodies,
+transport headers, attachments with ``read_buffer``).
+
+Messages are generated on access from the mailbox seed and their number, so a
+tree of a million messages costs almost no memory and the same seed always
+yields the same mailbox.
+"""
+import random
+import string
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List, Optional
+
+WORDS = (
+    "quarterly update team project budget forecast launch review customer roadmap meeting schedule "
+    "invoice report analysis growth product release feedback partner offer event webinar summary "
+    "highlights contract renewal pricing proposal migration outage incident hiring onboarding travel "
+    "expense approval security audit compliance training deadline milestone sprint backlog design"
+).split()
+
+FIRST_NAMES = ("Alice", "Bob", "Carol", "David", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy",
+               "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil", "Trent", "Victor", "Walter", "Yvonne")
+LAST_NAMES = ("Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Martinez",
+              "Lopez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee")
+DOMAINS = ("company.com", "partner.org", "vendor.net", "client.io", "example.com", "mail.example.org")
+ATTACHMENT_TYPES = (".pdf", ".docx", ".xlsx", ".pptx", ".png", ".jpg", ".zip", ".txt", ".csv")
+
+
+class SyntheticAttachment:
+    def __init__(self, name: str, size: int, seed: int):
+        self.name = name
+        self.long_filename = name
+        self.size = size
+        self._seed = seed
+        self._offset = 0
+
+    def get_size(self) -> int:
+        return self.size
+
+    def _data(self) -> bytes:
+        rng = random.Random(self._seed)
+        # Repetitive text compresses like typical documents and is cheap to make
+        block = " ".join(rng.choice(WORDS) for _ in range(64)).encode() + b"\n"
+        return (block * (self.size // len(block) + 1))[:self.size]
+
+    def read_buffer(self, size: int) -> bytes:
+        data = self._data()[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def seek_offset(self, offset: int, whence: int = 0):
+        if whence == 1:
+            offset += self._offset
+        elif whence == 2:
+            offset += self.size
+        self._offset = max(0, min(offset, self.size))
+
+
+class SyntheticMessage:
+    """One generated message; all of its attributes derive from (mailbox seed, number)"""
+
+    def __init__(self, mailbox: "SyntheticMailbox", number: int):
+        rng = random.Random(mailbox.seed * 1_000_003 + number)
+        self.identifier = 2_000_000 + number
+
+        topic = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+        self.conversation_topic = topic
+        self.conversation_index = None
+        self.subject = ("RE: " if rng.random() < mailbox.reply_ratio else "") + topic
+
+        sender = mailbox.people[int(rng.paretovariate(1.2)) % len(mailbox.people)]
+        self.sender_name, self.sender_email_address = sender
+        recipients = rng.sample(mailbox.people, rng.randint(1, 4))
+        self.display_to = "; ".join(name for name, _ in recipients)
+
+        if rng.random() < mailbox.undated_ratio:
+            self.client_submit_time = None
+        else:
+            self.client_submit_time = mailbox.start_date + timedelta(seconds=rng.random() * mailbox.date_spread_seconds)
+        self.delivery_time = self.client_submit_time
+
+        paragraphs = [
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(15, 60))).capitalize() + "."
+            for _ in range(rng.randint(1, mailbox.max_paragraphs))
+        ]
+        self.rtf_body = None
+        if rng.random() < mailbox.html_ratio:
+            self.plain_text_body = None
+            self.html_body = html_body(paragraphs, rng).encode()
+        else:
+            self.plain_text_body = "\n\n".join(paragraphs).encode()
+            self.html_body = None
+
+        message_id = f"<{number}.{mailbox.seed}@{sender[1].split('@')[1]}>"
+        self.transport_headers = (
+            f"Message-ID: {message_id}\r\n"
+            f"From: {self.sender_name} <{self.sender_email_address}>\r\n"
+            f"To: {', '.join(email for _, email in recipients)}\r\n"
+            f"Subject: {self.subject}\r\n"
+        )
+
+        self._attachments = []
+        if rng.random() < mailbox.attachment_ratio:
+            for index in range(rng.randint(1, mailbox.max_attachments)):
+                name = "".join(rng.choice(string.ascii_lowercase) for _ in range(8)) + rng.choice(ATTACHMENT_TYPES)
+                size = int(rng.lognormvariate(10, 1.2))
+                self._attachments.append(SyntheticAttachment(name, size, rng.getrandbits(32)))
+        self.number_of_attachments = len(self._attachments)
+
+    def get_attachment(self, index: int) -> SyntheticAttachment:
+        return self._attachments[index]
+
+    @property
+    def attachments(self) -> List[SyntheticAttachment]:
+        return list(self._attachments)
+
+
+def html_body(paragraphs: List[str], rng: random.Random) -> str:
+    """A small HTML mail body: a layout table, styled paragraphs, a list and a link"""
+    style = "font-family: Arial, sans-serif; font-size: 14px; color: #333333;"
+    parts = ['<html><head><style>p { margin: 0 0 12px 0; }</style></head><body>',
+             '<table width="100%" cellpadding="0" cellspacing="0"><tr><td>']
+    for paragraph in paragraphs:
+        parts.append(f'<p style="{style}">{paragraph} R&amp;D &lt;{rng.choice(WORDS)}&gt;</p>')
+    parts.append("<ul>" + "".join(f"<li>{rng.choice(WORDS)}</li>" for _ in range(rng.randint(1, 4))) + "</ul>")
+    parts.append(f'<a href="https://example.com/{rng.getrandbits(32):x}">{rng.choice(WORDS)}</a><br>')
+    parts.append("</td></tr></table><!-- footer --></body></html>")
+    return "".join(parts)
+
+
+class SyntheticFolder:
+    def __init__(self, mailbox: "SyntheticMailbox", name: str, identifier: int, first_message: int,
+                 message_count: int, sub_folders: Optional[List["SyntheticFolder"]] = None):
+        self._mailbox = mailbox
+        self.name = name
+        self.identifier = identifier
+        self._first_message = first_message
+        self._message_count = message_count
+        self._sub_folders = sub_folders or []
+
+    @property
+    def number_of_sub_folders(self) -> int:
+        return len(self._sub_folders)
+
+    @property
+    def number_of_sub_messages(self) -> int:
+        return self._message_count
+
+    def get_sub_folder(self, index: int) -> "SyntheticFolder":
+        return self._sub_folders[index]
+
+    def get_sub_message(self, index: int) -> SyntheticMessage:
+        if not 0 <= index < self._message_count:
+            raise IndexError("sub message index out of range")
+        return SyntheticMessage(self._mailbox, self._first_message + index)
+
+    @property
+    def sub_folders(self):
+        return iter(self._sub_folders)
+
+    @property
+    def sub_messages(self):
+        return (self.get_sub_message(index) for index in range(self._message_count))
+
+
+class SyntheticFile:
+    """Stands in for ``pypff.file()``; the path given to open() is ignored"""
+
+    def __init__(self, mailbox: "SyntheticMailbox"):
+        self._mailbox = mailbox
+
+    def open(self, path: str):
+        pass
+
+    def close(self):
+        pass
+
+    def get_root_folder(self) -> SyntheticFolder:
+        return self._mailbox.root
+
+
+class SyntheticMailbox:
+    """Configuration and folder tree of a generated mailbox.
+
+    ``messages`` are spread unevenly over a tree ``folder_depth`` levels deep
+    with ``folders_per_folder`` sub-folders per folder. ``html_ratio`` of the
+    messages have an HTML-only body, ``attachment_ratio`` have 1 to
+    ``max_attachments`` attachments, and dates are spread uniformly over
+    ``date_spread_days`` from ``start_date`` (``undated_ratio`` have none).
+    """
+
+    def __init__(self, messages: int = 10_000, folder_depth: int = 2, folders_per_folder: int = 3,
+                 html_ratio: float = 0.5, attachment_ratio: float = 0.2, max_attachments: int = 3,
+                 start_date: datetime = datetime(2019, 1, 1), date_spread_days: float = 5 * 365,
+                 undated_ratio: float = 0.0, reply_ratio: float = 0.3, max_paragraphs: int = 4,
+                 people: int = 500, seed: int = 42):
+        self.messages = messages
+        self.html_ratio = html_ratio
+        self.attachment_ratio = attachment_ratio
+        self.max_attachments = max_attachments
+        self.start_date = start_date
+        self.date_spread_seconds = date_spread_days * 86400
+        self.undated_ratio = undated_ratio
+        self.reply_ratio = reply_ratio
+        self.max_paragraphs = max_paragraphs
+        self.seed = seed
+
+        rng = random.Random(seed)
+        self.people = []
+        for _ in range(people):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            self.people.append((f"{first} {last}", f"{first}.{last}{rng.randint(1, 99)}@{rng.choice(DOMAINS)}".lower()))
+
+        # Folder sizes are skewed like real mailboxes: a few large folders, many small ones
+        folder_count = sum(folders_per_folder ** level for level in range(folder_depth + 1))
+        weights = [rng.paretovariate(1.0) for _ in range(folder_count)]
+        total_weight = sum(weights)
+        counts = [int(messages * weight / total_weight) for weight in weights]
+        counts[0] += messages - sum(counts)
+        self._next_identifier = 8_000
+        self._next_message = 0
+        self.root = self._build_folder("Root", folder_depth, folders_per_folder, iter(counts))
+
+    def _build_folder(self, name: str, depth: int, fanout: int, counts) -> SyntheticFolder:
+        sub_folders = [
+            self._build_folder(f"{name}/Folder {index}", depth - 1, fanout, counts)
+            for index in range(fanout if depth > 0 else 0)
+        ]
+        count = next(counts)
+        folder = SyntheticFolder(self, name.rsplit("/", 1)[-1], self._next_identifier, self._next_message, count,
+                                 sub_folders)
+        self._next_identifier += 32
+        self._next_message += count
+        return folder
+
+    def file(self) -> SyntheticFile:
+        return SyntheticFile(self)
+
+    def pypff_module(self) -> SimpleNamespace:
+        """An object to use in place of the pypff module"""
+        return SimpleNamespace(file=self.file)
@@ -0,0 +1,107 @@
+"""Response compression negotiated from the request's Accept-Encoding.
+
+Search pages and full projections are large and very repetitive JSON, so they
+shrink several times over. Brotli is used when the ``brotli`` package is
+installed and the client accepts it, gzip otherwise. Only complete text bodies
+above a minimum size are compressed: streamed responses (NDJSON ingest
+progress) are passed through so their events are not held back.
+"""
+import gzip
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Smaller bodies gain little and cost a compressor each
+DEFAULT_MINIMUM_SIZE = 1024
+# Fast settings: responses are compressed on every request
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def supported_encodings() -> tuple:
+    """Content codings this server can produce, preferred first"""
+    return ("br", "gzip") if BROTLI_AVAILABLE else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """The best supported coding the client accepts (highest q, then server preference), or None"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete JSON and text responses"""
+
+    def __init__(self, app, minimum_size: int = DEFAULT_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        pending_start = None
+
+        async def send_compressed(message):
+            nonlocal pending_start
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the response is streamed
+                pending_start = message
+                return
+            if message["type"] == "http.response.body" and pending_start is not None:
+                start, pending_start = pending_start, None
+                headers = MutableHeaders(raw=start.setdefault("headers", []))
+                body = message.get("body", b"")
+                content_type = headers.get("content-type", "")
+                if (not message.get("more_body", False)
+                        and len(body) >= self.minimum_size
+                        and "content-encoding" not in headers
+                        and content_type.startswith(COMPRESSIBLE_TYPES)):
+                    body = compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    message = dict(message, body=body)
+                headers.add_vary_header("Accept-Encoding")
+                await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
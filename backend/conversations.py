@@ -0,0 +1,147 @@
+"""Conversation threading.
+
+Every message gets a ``thread_id`` at ingest, derived from the message alone,
+so grouping a mailbox takes one pass with a hash lookup per message and no
+message is ever compared with another:
+
+  - Outlook's conversation index (the ``conversation_index`` property, or the
+    ``Thread-Index`` transport header) starts with a 22-byte header that all
+    replies and forwards of a conversation share; when a message has one, the
+    header is its thread key
+  - otherwise the key is the conversation topic (the subject without its
+    "RE:"/"FW:" prefixes, normalized) and the set of participant names, so
+    unrelated messages that merely share a subject stay apart
+
+``ThreadIndex`` numbers the threads of a mailbox with a hash table and lays
+out its positions thread by thread (a counting sort), so a thread and its
+size are found without scanning the mailbox.
+"""
+import base64
+import hashlib
+import re
+from array import array
+from typing import Callable, Dict, List, Optional
+
+from message_store import MessageStore
+
+# Bytes of a conversation index shared by every message of the conversation
+# (a reserved byte, five bytes of the conversation's start time and a GUID);
+# each reply appends a 5-byte child block.
+CONVERSATION_INDEX_HEADER_BYTES = 22
+
+# Reply and forward prefixes, in the languages Outlook writes them in, repeated and
+# optionally counted ("Re[2]:")
+_SUBJECT_PREFIX_RE = re.compile(
+    r"^(?:\s*(?:re|fw|fwd|aw|wg|sv|vs|antw|tr|rif|r|doorst|vl|ynt|odp|res|enc)\s*(?:\[\d+\])?\s*[:：])+",
+    re.IGNORECASE,
+)
+_THREAD_INDEX_HEADER_RE = re.compile(r"^thread-index:\s*(\S+)", re.IGNORECASE | re.MULTILINE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_subject(subject: Optional[str]) -> str:
+    """A subject without its reply/forward prefixes, lowercased with whitespace collapsed"""
+    subject = _SUBJECT_PREFIX_RE.sub("", subject or "")
+    return _WHITESPACE_RE.sub(" ", subject).strip().lower()
+
+
+def participant_names(sender_name: Optional[str], sender_email: Optional[str],
+                      recipients: Optional[str]) -> List[str]:
+    """Distinct participants of a message, sorted.
+
+    ``recipients`` is Outlook's display list of names, so the sender is named
+    the same way (falling back to the address) for replies to match.
+    """
+    names = {_WHITESPACE_RE.sub(" ", name).strip().strip("'\"").lower() for name in (recipients or "").split(";")}
+    names.add((sender_name or sender_email or "").strip().strip("'\"").lower())
+    names.discard("")
+    return sorted(names)
+
+
+def conversation_index_header(conversation_index) -> Optional[bytes]:
+    """The thread-identifying header of a conversation index, None if there is none"""
+    if not conversation_index or len(conversation_index) < CONVERSATION_INDEX_HEADER_BYTES:
+        return None
+    return bytes(conversation_index[:CONVERSATION_INDEX_HEADER_BYTES])
+
+
+def conversation_index_from_headers(transport_headers: Optional[str]) -> Optional[bytes]:
+    """The conversation index carried in a ``Thread-Index`` transport header"""
+    match = _THREAD_INDEX_HEADER_RE.search(transport_headers or "")
+    if match is None:
+        return None
+    try:
+        return base64.b64decode(match.group(1), validate=True)
+    except ValueError:
+        return None
+
+
+def thread_id_of(conversation_index=None, topic: Optional[str] = None, subject: Optional[str] = None,
+                 sender_name: Optional[str] = None, sender_email: Optional[str] = None,
+                 recipients: Optional[str] = None) -> str:
+    """Thread id of a message: a hash of its conversation index header, or of its topic and participants"""
+    header = conversation_index_header(conversation_index)
+    if header is not None:
+        key = b"index:" + header
+    else:
+        topic = normalize_subject(topic if topic else subject)
+        key = "topic:{}\x1f{}".format(topic, "\x1e".join(participant_names(sender_name, sender_email, recipients)))
+        key = key.encode("utf-8", "surrogatepass")
+    return hashlib.blake2b(key, digest_size=8).hexdigest()
+
+
+class ThreadIndex:
+    """Positions of a mailbox's messages grouped by thread.
+
+    Threads are numbered in order of first appearance;
+    ``positions[starts[t]:starts[t + 1]]`` are the messages of thread ``t``,
+    in position order, and ``codes[p]`` is the thread of position ``p``.
+    """
+
+    def __init__(self, store: MessageStore):
+        # One pass with a hash lookup per message numbers the threads...
+        self._numbers: Dict[int, int] = {}
+        numbers = self._numbers
+        self.codes = array('I', [numbers.setdefault(thread_id, len(numbers)) for thread_id in store.thread_ids])
+        # ...and a counting sort groups the positions by thread
+        counts = [0] * (len(numbers) + 1)
+        for code in self.codes:
+            counts[code + 1] += 1
+        for code in range(1, len(counts)):
+            counts[code] += counts[code - 1]
+        self.starts = array('I', counts)
+        self.positions = array('I', bytes(4 * len(self.codes)))
+        fill = counts[:-1]
+        for position, code in enumerate(self.codes):
+            self.positions[fill[code]] = position
+            fill[code] += 1
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def code_of(self, thread_id: Optional[str]) -> Optional[int]:
+        """Number of a thread by its id, None if no message of the mailbox is in it"""
+        try:
+            return self._numbers.get(int(thread_id, 16)) if thread_id else None
+        except ValueError:
+            return None
+
+    def size(self, code: int) -> int:
+        return self.starts[code + 1] - self.starts[code]
+
+    def members(self, code: int) -> List[int]:
+        return self.positions[self.starts[code]:self.starts[code + 1]].tolist()
+
+    def thread(self, thread_id: str, epoch_of: Callable[[int], Optional[float]]) -> List[int]:
+        """Positions of a thread's messages, oldest first (undated ones last), empty if unknown"""
+        code = self.code_of(thread_id)
+        if code is None:
+            return []
+        members = self.members(code)
+        members.sort(key=lambda position: (epoch_of(position) is None, epoch_of(position) or 0.0, position))
+        return members
+
+    def nbytes(self) -> int:
+        arrays = (self.codes, self.starts, self.positions)
+        # The thread numbers dict holds a slot and two int objects per thread
+        return sum(a.itemsize * len(a) for a in arrays) + 100 * len(self._numbers)
@@ -0,0 +1,119 @@
+"""Sorted date index for answering date range queries by bisection.
+
+Email dates are parsed once at ingest into numeric epoch seconds. The index
+keeps the epochs sorted alongside the positions of their emails, so a date
+range is answered in O(log n + k) instead of re-parsing every date string on
+every search. Emails whose date cannot be parsed are kept in a separate
+``undated`` list rather than being dropped query by query.
+
+Dates are compared as naive wall-clock times: timezone offsets are discarded,
+not converted, matching the way Outlook's local ``client_submit_time`` is shown.
+"""
+import calendar
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+_FALLBACK_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+    "%a, %d %b %Y %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S",
+]
+
+
+def datetime_to_epoch(value: datetime) -> float:
+    """Convert a datetime to epoch seconds, ignoring its timezone"""
+    return calendar.timegm(value.timetuple()) + value.microsecond / 1_000_000
+
+
+def parse_email_date(value: Optional[str]) -> Optional[float]:
+    """Parse an email or filter date string to epoch seconds, None if unparseable"""
+    if not value:
+        return None
+    value = value.strip()
+
+    try:
+        return datetime_to_epoch(datetime.fromisoformat(value.replace('Z', '+00:00')))
+    except ValueError:
+        pass
+
+    # Drop fractional seconds / trailing offsets fromisoformat did not accept
+    head = value.split('.')[0]
+    for fmt in _FALLBACK_FORMATS:
+        try:
+            return datetime_to_epoch(datetime.strptime(head, fmt))
+        except ValueError:
+            continue
+    return None
+
+
+class DateIndex:
+    """Emails' epoch dates, sorted, with the positions of the emails they belong to.
+
+    Epochs and positions are held in ``array`` buffers (8 and 4 bytes per email)
+    rather than lists of float and int objects.
+    """
+
+    def __init__(self, epochs: Iterable[Optional[float]]):
+        # Epoch of each email by position, NaN for undated emails
+        self.epoch_by_position = array('d', (float('nan') if epoch is None else epoch for epoch in epochs))
+        self.undated: List[int] = []
+
+        dated = []
+        for position, epoch in enumerate(self.epoch_by_position):
+            if epoch != epoch:
+                self.undated.append(position)
+            else:
+                dated.append((epoch, position))
+        dated.sort()
+
+        self.epochs = array('d', [epoch for epoch, _ in dated])
+        self.positions = array('i', [position for _, position in dated])
+
+    @classmethod
+    def from_dates(cls, dates: Iterable[Optional[str]]) -> "DateIndex":
+        return cls(parse_email_date(date) for date in dates)
+
+    def __len__(self):
+        return len(self.epoch_by_position)
+
+    def _bounds(self, start: Optional[float], end: Optional[float]) -> tuple:
+        lo = bisect_left(self.epochs, start) if start is not None else 0
+        hi = bisect_right(self.epochs, end) if end is not None else len(self.epochs)
+        return lo, max(lo, hi)
+
+    def range(self, start: Optional[float] = None, end: Optional[float] = None) -> List[int]:
+        """Positions of dated emails within [start, end], oldest first"""
+        lo, hi = self._bounds(start, end)
+        return self.positions[lo:hi].tolist()
+
+    def page(self, start: Optional[float] = None, end: Optional[float] = None,
+             offset: int = 0, limit: Optional[int] = None, newest_first: bool = True) -> List[int]:
+        """One page of the positions within [start, end], without materializing the whole range"""
+        lo, hi = self._bounds(start, end)
+        if limit is None:
+            limit = hi - lo
+        if newest_first:
+            stop = max(hi - offset, lo)
+            return self.positions[max(stop - limit, lo):stop].tolist()[::-1]
+        begin = min(lo + offset, hi)
+        return self.positions[begin:min(begin + limit, hi)].tolist()
+
+    def count(self, start: Optional[float] = None, end: Optional[float] = None) -> int:
+        lo, hi = self._bounds(start, end)
+        return hi - lo
+
+    def epoch_of(self, position: int) -> Optional[float]:
+        """Epoch of the email at ``position``, None if it is undated"""
+        epoch = self.epoch_by_position[position]
+        return None if epoch != epoch else epoch
+
+    def contains(self, position: int, start: Optional[float] = None, end: Optional[float] = None) -> bool:
+        """Whether the email at ``position`` is dated within [start, end]"""
+        epoch = self.epoch_by_position[position]
+        if epoch != epoch:
+            return False
+        return (start is None or epoch >= start) and (end is None or epoch <= end)
@@ -0,0 +1,243 @@
+"""Exact and near-duplicate detection.
+
+The same message often sits in several folders (Inbox and an archive folder)
+or in several OST files. Each message gets, at ingest:
+
+  - an identity from its identity headers: the Message-ID when the
+    transport headers carry one, else subject, date, sender and recipients
+  - a ``content_hash``: a 64-bit hash of that identity and the normalized body
+    (whitespace collapsed), equal for exact copies
+  - an ``email_id`` naming this copy: the identity together with where the
+    copy is stored (its pypff identifier), so each copy can be opened
+  - a ``simhash``: a 64-bit SimHash of the body's three-word shingles, within
+    a few bits for bodies that differ only slightly (a changed word, a short
+    footer, re-wrapping)
+
+Near-duplicates are found by banded lookup rather than by comparing every pair:
+the 64 bits are cut into four 16-bit bands, and only messages of the same
+sender that share a band value are compared, so grouping a mailbox costs a few
+sorts rather than a quadratic scan. Hashes at most three bits apart always
+share a band (pigeonhole); most of those four to six bits apart do too.
+"""
+import hashlib
+import re
+import sys
+from array import array
+from typing import Dict, List, Optional
+
+from message_store import MessageStore
+
+SIMHASH_BITS = 64
+SIMHASH_MASK = (1 << SIMHASH_BITS) - 1
+# Hashes at most this many bits apart are near-duplicates (unrelated bodies are
+# typically 15 or more bits apart)
+NEAR_DUPLICATE_DISTANCE = 6
+# Narrower bands would find every pair within the distance, but fill each
+# band bucket of a prolific sender with unrelated messages
+BANDS = 4
+BAND_BITS = SIMHASH_BITS // BANDS
+# Shorter bodies have too few words for their SimHash to tell messages apart
+MIN_WORDS = 20
+# Words of a body that count towards its SimHash
+MAX_WORDS = 30_000
+# Bucket members a message is compared with before it is taken as distinct
+# (bounds the work on large buckets of similar but distinct messages)
+MAX_BUCKET_COMPARISONS = 64
+
+_MESSAGE_ID_RE = re.compile(r"^message-id:\s*(<[^>\r\n]*>|\S+)", re.IGNORECASE | re.MULTILINE)
+_WORD_RE = re.compile(r"\w+")
+_WHITESPACE_RE = re.compile(r"\s+")
+# Odd multipliers for the first two words of a shingle
+_SHINGLE_FIRST = 0x9E3779B97F4A7C15
+_SHINGLE_SECOND = 0xC2B2AE3D27D4EB4F
+
+
+def message_id_from_headers(transport_headers: Optional[str]) -> Optional[str]:
+    match = _MESSAGE_ID_RE.search(transport_headers or "")
+    return match.group(1).strip() if match else None
+
+
+def email_identity(message_id: Optional[str], subject: Optional[str], date: Optional[str],
+                   sender_email: Optional[str], recipients: Optional[str]) -> str:
+    """Identity of a message, shared by its copies and (unlike subject and date alone) not by other messages"""
+    if message_id:
+        key = f"message-id\x1f{message_id}"
+    else:
+        key = "\x1f".join(("headers", subject or "", date or "", (sender_email or "").lower(), recipients or ""))
+    return hashlib.md5(key.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def copy_id(identity: str, message_identifier: Optional[int]) -> str:
+    """Id of one copy of a message: its identity and its pypff identifier (unique within a file)"""
+    if message_identifier is None:
+        return identity
+    return hashlib.md5(f"{identity}\x1f{message_identifier}".encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def normalize_body(body: Optional[str]) -> str:
+    return _WHITESPACE_RE.sub(" ", body or "").strip()
+
+
+def content_hash(identity: str, body: Optional[str]) -> int:
+    """64-bit hash of a message's identity and normalized body (only the identity without a body)"""
+    data = f"{identity}\x1f{normalize_body(body)}" if body is not None else identity
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+
+# int.bit_count() is Python 3.10+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:
+    def popcount(value: int) -> int:
+        return bin(value).count("1")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return popcount(a ^ b)
+
+
+class SimHasher:
+    """Computes body SimHashes, caching the hash of each word seen"""
+
+    def __init__(self, max_cached_words: int = 50_000):
+        self.max_cached_words = max_cached_words
+        self._hashes: Dict[str, int] = {}
+
+    def _hash(self, word: str) -> int:
+        value = int.from_bytes(hashlib.blake2b(word.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+        if len(self._hashes) >= self.max_cached_words:
+            self._hashes.clear()
+        self._hashes[word] = value
+        return value
+
+    def simhash(self, body: Optional[str]) -> int:
+        """SimHash of a body's shingles, 0 for bodies too short to have a meaningful one"""
+        words = _WORD_RE.findall((body or "").lower())[:MAX_WORDS]
+        if len(words) < MIN_WORDS:
+            return 0
+        hashes = self._hashes
+        values = [hashes.get(word) or self._hash(word) for word in words]
+        # A shingle's hash combines its words' hashes, weighted by their place in it
+        shingles = array('Q', [(first * _SHINGLE_FIRST + second * _SHINGLE_SECOND + third) & SIMHASH_MASK
+                               for first, second, third in zip(values, values[1:], values[2:])])
+        count = len(shingles)
+        # The shingles side by side in one integer: each bit's count is one
+        # shift, mask and popcount, rather than 64 per shingle
+        packed = int.from_bytes(shingles.tobytes(), sys.byteorder)
+        lowest_bits = ((1 << (SIMHASH_BITS * count)) - 1) // SIMHASH_MASK
+        # A bit is set when more than half of the shingles have it set
+        threshold = count // 2
+        result = 0
+        for bit in range(SIMHASH_BITS):
+            if popcount((packed >> bit) & lowest_bits) > threshold:
+                result |= 1 << bit
+        # 0 means "no SimHash"
+        return result or 1
+
+
+def _bands(simhash: int) -> List[int]:
+    return [(simhash >> (BAND_BITS * band)) & ((1 << BAND_BITS) - 1) for band in range(BANDS)]
+
+
+class DuplicateIndex:
+    """Groups of exact and near-duplicate messages of one mailbox.
+
+    Groups are numbered in order of first appearance; ``codes[p]`` is the
+    group of position ``p``, ``first[g]`` the first position of group ``g``
+    and ``sizes[g]`` its number of messages.
+    """
+
+    def __init__(self, store: MessageStore):
+        count = len(store)
+        parent = list(range(count))
+
+        def find(position: int) -> int:
+            while parent[position] != position:
+                parent[position] = parent[parent[position]]
+                position = parent[position]
+            return position
+
+        def union(a: int, b: int):
+            a, b = find(a), find(b)
+            if a != b:
+                # The earlier position stays the root
+                parent[max(a, b)] = min(a, b)
+
+        # Exact copies: equal content hashes are adjacent once sorted (0 means "no hash")
+        hashes = store.content_hashes
+        order = sorted(range(count), key=hashes.__getitem__)
+        for previous, position in zip(order, order[1:]):
+            if hashes[position] and hashes[position] == hashes[previous]:
+                union(previous, position)
+
+        # Near copies: messages of one sender whose SimHashes share a band value
+        simhashes = store.simhashes
+        senders = store.sender_emails.codes
+        hashed = [position for position in range(count) if simhashes[position]]
+        band_mask = (1 << BAND_BITS) - 1
+        keys = [0] * count
+        for band in range(BANDS):
+            shift = BAND_BITS * band
+            for position in hashed:
+                keys[position] = (senders[position] << BAND_BITS) | ((simhashes[position] >> shift) & band_mask)
+            run_key, run = None, []
+            for position in sorted(hashed, key=keys.__getitem__):
+                if keys[position] != run_key:
+                    run_key, run = keys[position], []
+                simhash = simhashes[position]
+                for other in run[:MAX_BUCKET_COMPARISONS]:
+                    if hamming_distance(simhash, simhashes[other]) <= NEAR_DUPLICATE_DISTANCE:
+                        union(other, position)
+                        break
+                else:
+                    run.append(position)
+
+        numbers: Dict[int, int] = {}
+        self.codes = array('I', bytes(4 * count))
+        self.first = array('I')
+        sizes = []
+        for position in range(count):
+            root = find(position)
+            code = numbers.get(root)
+            if code is None:
+                code = numbers[root] = len(sizes)
+                self.first.append(position)
+                sizes.append(0)
+            self.codes[position] = code
+            sizes[code] += 1
+        self.sizes = array('I', sizes)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.codes, self.first, self.sizes))
+
+
+class DuplicateFilter:
+    """Messages seen so far across mailboxes, found again by content hash or a near SimHash.
+
+    Each message added carries a value (e.g. where it was kept), returned by
+    ``find`` for its copies.
+    """
+
+    def __init__(self):
+        self._by_hash: Dict[int, object] = {}
+        self._by_band: Dict[tuple, List[tuple]] = {}
+
+    def find(self, content_hash: int, simhash: int, sender: Optional[str]) -> Optional[object]:
+        value = self._by_hash.get(content_hash) if content_hash else None
+        if value is not None or not simhash:
+            return value
+        for band, band_value in enumerate(_bands(simhash)):
+            for other, other_value in self._by_band.get((sender, band, band_value), ())[:MAX_BUCKET_COMPARISONS]:
+                if hamming_distance(simhash, other) <= NEAR_DUPLICATE_DISTANCE:
+                    return other_value
+        return None
+
+    def add(self, content_hash: int, simhash: int, sender: Optional[str], value: object):
+        if content_hash:
+            self._by_hash.setdefault(content_hash, value)
+        if simhash:
+            for band, band_value in enumerate(_bands(simhash)):
+                self._by_band.setdefault((sender, band, band_value), []).append((simhash, value))
@@ -0,0 +1,359 @@
+"""Streaming export of emails to mbox, a zip of EML files, CSV and Parquet.
+
+Each format is a writer that receives emails one at a time and writes into an
+``ExportSink``. ``stream_export`` drains the sink whenever it holds a chunk,
+so an export of any size keeps about one chunk and one email in memory (plus,
+for Parquet, one row group) while the response is sent.
+
+Emails are given as dicts with the fields of ``MessageStore.row`` (body
+filled in), the ``handle`` of their mailbox and ``attachments``: the
+(name, path) of each attachment whose data was stored. mbox and EML include
+those attachments; CSV and Parquet list attachment names only.
+"""
+import base64
+import binascii
+import csv
+import email.utils
+import io
+import mimetypes
+import re
+import secrets
+import time
+import struct
+import urllib.parse
+import zipfile
+import zlib
+from email.header import Header
+from typing import Iterable, Iterator, Optional
+
+from date_index import parse_email_date
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Bytes collected before they are sent as one chunk of the response
+EXPORT_CHUNK_BYTES = 256 * 1024
+# Rows (or body characters) buffered per Parquet row group
+PARQUET_ROW_GROUP_ROWS = 10_000
+PARQUET_ROW_GROUP_CHARS = 32 * 1024 * 1024
+# Fast settings: EML archives can hold hundreds of thousands of messages
+ZIP_LEVEL = 5
+# Zip fields are 32-bit unless the archive carries Zip64 records
+_ZIP32_LIMIT = 0xFFFFFFFF
+# General purpose flag: entry names are UTF-8
+_ZIP_UTF8_NAMES = 0x0800
+# 1980-01-01, the earliest MS-DOS date
+_DOS_EPOCH = 315532800
+# Longer header values are folded (lines may not exceed 998 characters)
+MAX_HEADER_CHARS = 900
+
+# Columns of the CSV and Parquet formats
+EXPORT_COLUMNS = (
+    "handle", "email_id", "date", "sender_name", "sender_email", "recipients", "subject",
+    "has_attachments", "attachment_count", "attachment_names", "thread_id", "content_hash", "body",
+)
+
+# mboxrd: "From " lines (and already quoted ones) in a message get one more ">"
+_MBOX_FROM_RE = re.compile(rb"^(>*From )", re.MULTILINE)
+_HEADER_WHITESPACE_RE = re.compile(r"\s+")
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w.,()' -]+")
+
+
+class ExportSink:
+    """A write-only file that keeps what was written until it is drained"""
+
+    closed = False
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    @property
+    def buffered(self) -> int:
+        """Bytes written since the last drain"""
+        return len(self._buffer)
+
+
+def _header_text(value: Optional[str]) -> str:
+    # Header values cannot carry line breaks
+    return _HEADER_WHITESPACE_RE.sub(" ", value or "").strip()
+
+
+def _header(name: str, value: str) -> str:
+    # ASCII values as they are, others as RFC 2047 encoded words (folded)
+    if value.isascii() and len(value) < MAX_HEADER_CHARS:
+        return f"{name}: {value}"
+    return f"{name}: " + Header(value, "utf-8", header_name=name).encode(linesep="\n")
+
+
+def _filename_params(name: str) -> str:
+    if name.isascii():
+        return '; filename="{}"'.format(name.replace("\\", "\\\\").replace('"', '\\"'))
+    return "; filename*=utf-8''" + urllib.parse.quote(name, safe="")
+
+
+def email_to_mime(email_fields: dict, linesep: str = "\r\n") -> bytes:
+    """An email as an RFC 5322 message, with its stored attachments.
+
+    The message is assembled directly rather than through ``email.message``,
+    which takes several times longer per message: the body is quoted-printable
+    UTF-8 text and attachments are base64, each part after a random boundary.
+    """
+    sender_name = _header_text(email_fields.get("sender_name"))
+    sender_email = _header_text(email_fields.get("sender_email"))
+    headers = [
+        _header("From", email.utils.formataddr((sender_name, sender_email), "utf-8") if sender_email else sender_name),
+    ]
+    # Outlook only keeps the recipients' display names
+    if email_fields.get("recipients"):
+        headers.append(_header("To", _header_text(email_fields["recipients"])))
+    headers.append(_header("Subject", _header_text(email_fields.get("subject"))))
+    epoch = parse_email_date(email_fields["date"]) if email_fields.get("date") else None
+    if epoch is not None:
+        headers.append("Date: " + email.utils.formatdate(epoch, usegmt=True))
+    for name, field in (("X-OST-Email-Id", "email_id"), ("X-OST-Thread-Id", "thread_id")):
+        if email_fields.get(field):
+            headers.append(f"{name}: {email_fields[field]}")
+    headers.append("MIME-Version: 1.0")
+
+    body = (email_fields.get("body") or "").replace("\r\n", "\n").replace("\r", "\n")
+    text_part = [
+        'Content-Type: text/plain; charset="utf-8"',
+        "Content-Transfer-Encoding: quoted-printable",
+        "",
+        binascii.b2a_qp(body.encode("utf-8", "surrogatepass")).decode("ascii"),
+    ]
+    attachments = email_fields.get("attachments") or ()
+    if not attachments:
+        return "\n".join(headers + text_part).replace("\n", linesep).encode("ascii", "replace")
+
+    # "=_" never occurs in quoted-printable or base64 text
+    boundary = "=_" + secrets.token_hex(12)
+    headers.append(f'Content-Type: multipart/mixed; boundary="{boundary}"')
+    lines = headers + ["", f"--{boundary}"] + text_part
+    for name, path in attachments:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        with open(path, "rb") as f:
+            data = f.read()
+        lines += [
+            f"--{boundary}",
+            f"Content-Type: {content_type}",
+            "Content-Transfer-Encoding: base64",
+            "Content-Disposition: attachment" + _filename_params(_header_text(name)),
+            "",
+            base64.encodebytes(data).decode("ascii"),
+        ]
+    lines.append(f"--{boundary}--")
+    # Everything above uses LF line endings
+    return "\n".join(lines).replace("\n", linesep).encode("ascii", "replace")
+
+
+class MboxWriter:
+    """mboxrd: messages with LF line endings, each after a "From " separator line"""
+
+    extension = "mbox"
+    media_type = "application/mbox"
+
+    def __init__(self, sink: ExportSink):
+        self.sink = sink
+
+    def write(self, email_fields: dict):
+        epoch = parse_email_date(email_fields["date"]) if email_fields.get("date") else None
+        sender = (email_fields.get("sender_email") or "").strip() or "MAILER-DAEMON"
+        separator = f"From {sender.replace(' ', '_')} {time.asctime(time.gmtime(epoch or 0))}\n"
+        data = email_to_mime(email_fields, "\n")
+        self.sink.write(separator.encode("utf-8", "replace"))
+        self.sink.write(_MBOX_FROM_RE.sub(rb">\1", data))
+        self.sink.write(b"\n" if data.endswith(b"\n") else b"\n\n")
+
+    def close(self):
+        pass
+
+
+class EmlZipWriter:
+    """A zip archive with one .eml file per email, numbered in result order.
+
+    Written by hand rather than with ``zipfile``, which keeps an object of
+    several hundred bytes per entry until the archive is closed: here each
+    entry's central directory record is packed as soon as the entry is
+    written (about 100 bytes). Zip64 records are added when the archive
+    outgrows the classic format (65535 entries or 4 GiB).
+    """
+
+    extension = "zip"
+    media_type = "application/zip"
+
+    def __init__(self, sink: ExportSink):
+        self.sink = sink
+        self.count = 0
+        self.central_directory = bytearray()
+
+    def write(self, email_fields: dict):
+        self.count += 1
+        subject = _UNSAFE_FILENAME_RE.sub("_", _header_text(email_fields.get("subject")))[:80].strip()
+        name = f"{self.count:07d} {subject or 'email'}.eml".encode("utf-8")
+        data = email_to_mime(email_fields)
+        compressor = zlib.compressobj(ZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        epoch = parse_email_date(email_fields["date"]) if email_fields.get("date") else None
+        dos_time, dos_date = _dos_datetime(epoch)
+        crc = zlib.crc32(data)
+        offset = self.sink.tell()
+
+        self.sink.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, 20, _ZIP_UTF8_NAMES, zipfile.ZIP_DEFLATED,
+                                    dos_time, dos_date, crc, len(compressed), len(data), len(name), 0))
+        self.sink.write(name)
+        self.sink.write(compressed)
+
+        extra = b""
+        if offset >= _ZIP32_LIMIT:
+            extra = struct.pack("<HHQ", 0x0001, 8, offset)
+            offset = _ZIP32_LIMIT
+        self.central_directory += struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014b50, 45, 45 if extra else 20, _ZIP_UTF8_NAMES, zipfile.ZIP_DEFLATED,
+            dos_time, dos_date, crc, len(compressed), len(data), len(name), len(extra), 0, 0, 0, 0o644 << 16, offset)
+        self.central_directory += name + extra
+
+    def close(self):
+        directory_offset = self.sink.tell()
+        self.sink.write(self.central_directory)
+        directory_size = len(self.central_directory)
+        self.central_directory = bytearray()
+        entries = self.count
+        if entries >= 0xFFFF or directory_offset >= _ZIP32_LIMIT or directory_size >= _ZIP32_LIMIT:
+            record_offset = self.sink.tell()
+            self.sink.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, entries, entries,
+                                        directory_size, directory_offset))
+            self.sink.write(struct.pack("<IIQI", 0x07064b50, 0, record_offset, 1))
+            entries = min(entries, 0xFFFF)
+            directory_offset = min(directory_offset, _ZIP32_LIMIT)
+            directory_size = min(directory_size, _ZIP32_LIMIT)
+        self.sink.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, entries, entries, directory_size,
+                                    directory_offset, 0))
+
+
+def _dos_datetime(epoch: Optional[float]) -> tuple:
+    """(time, date) of a zip entry, in MS-DOS format (which starts in 1980)"""
+    moment = time.gmtime(max(epoch, _DOS_EPOCH) if epoch is not None else time.time())
+    return ((moment.tm_hour << 11) | (moment.tm_min << 5) | (moment.tm_sec // 2),
+            ((moment.tm_year - 1980) << 9) | (moment.tm_mon << 5) | moment.tm_mday)
+
+
+def _column_value(email_fields: dict, column: str):
+    if column == "attachment_names":
+        return email_fields.get("attachment_names") or []
+    return email_fields.get(column)
+
+
+class CsvWriter:
+    """One row per email with EXPORT_COLUMNS; attachment names are joined with "; " """
+
+    extension = "csv"
+    media_type = "text/csv; charset=utf-8"
+
+    def __init__(self, sink: ExportSink):
+        self.sink = sink
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self._write_row(EXPORT_COLUMNS)
+
+    def _write_row(self, row):
+        self.writer.writerow(row)
+        self.sink.write(self.buffer.getvalue().encode("utf-8", "surrogatepass"))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def write(self, email_fields: dict):
+        row = []
+        for column in EXPORT_COLUMNS:
+            value = _column_value(email_fields, column)
+            row.append("; ".join(value) if column == "attachment_names" else value)
+        self._write_row(row)
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """EXPORT_COLUMNS as a Parquet file (requires pyarrow), written one row group at a time"""
+
+    extension = "parquet"
+    media_type = "application/vnd.apache.parquet"
+
+    def __init__(self, sink: ExportSink):
+        self.schema = pyarrow.schema([
+            (column, pyarrow.list_(pyarrow.string()) if column == "attachment_names"
+             else pyarrow.bool_() if column == "has_attachments"
+             else pyarrow.int32() if column == "attachment_count"
+             else pyarrow.string())
+            for column in EXPORT_COLUMNS
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode="w"), self.schema,
+                                                    compression="zstd")
+        self._reset()
+
+    def _reset(self):
+        self.columns = {column: [] for column in EXPORT_COLUMNS}
+        self.rows = 0
+        self.chars = 0
+
+    def _flush(self):
+        if self.rows:
+            self.writer.write_table(pyarrow.table(self.columns, schema=self.schema))
+            self._reset()
+
+    def write(self, email_fields: dict):
+        for column in EXPORT_COLUMNS:
+            self.columns[column].append(_column_value(email_fields, column))
+        self.rows += 1
+        self.chars += len(email_fields.get("body") or "")
+        if self.rows >= PARQUET_ROW_GROUP_ROWS or self.chars >= PARQUET_ROW_GROUP_CHARS:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+EXPORT_FORMATS = {
+    "mbox": MboxWriter,
+    "eml": EmlZipWriter,
+    "csv": CsvWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def stream_export(emails: Iterable[dict], export_format: str,
+                  chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """The bytes of an export of ``emails``, in chunks of about ``chunk_bytes``"""
+    sink = ExportSink()
+    writer = EXPORT_FORMATS[export_format](sink)
+    for email_fields in emails:
+        writer.write(email_fields)
+        if sink.buffered >= chunk_bytes:
+            yield sink.drain()
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,213 @@
+"""Per-field count indexes for faceted aggregation over a mailbox.
+
+Answers "how many emails per sender / sender domain / recipient / month, and
+how many with attachments" for any date range without visiting every email.
+Built once from a MessageStore and its DateIndex:
+
+  - emails are laid out in date order (undated ones last), so a date range is
+    a contiguous slice ``[lo, hi)`` of that order found by bisection
+  - each facet field keeps its values in that order (dictionary codes; a
+    recipient list contributes one code per recipient) and the code counts of
+    every calendar month
+  - a range count adds up the months it covers fully and counts only the
+    partial months at its ends, so its cost is bounded by the number of
+    months and the size of a month, not of the mailbox
+  - day, week and month histograms come from the date-ordered bucket starts,
+    and attachment presence from a prefix sum
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from date_index import DateIndex, datetime_to_epoch
+from message_store import FLAG_HAS_ATTACHMENTS, MessageStore
+
+INTERVALS = ("month", "week", "day")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _bucket_of(epoch: float, interval: str) -> Tuple[str, float]:
+    """Label of the calendar bucket holding ``epoch`` and the epoch the next bucket starts at"""
+    moment = _EPOCH + timedelta(seconds=epoch)
+    day = datetime(moment.year, moment.month, moment.day)
+    try:
+        if interval == "month":
+            start = day.replace(day=1)
+            if start.month == 12:
+                following = start.replace(year=start.year + 1, month=1)
+            else:
+                following = start.replace(month=start.month + 1)
+            return start.strftime("%Y-%m"), datetime_to_epoch(following)
+        if interval == "week":
+            # ISO weeks, labelled by their Monday
+            start = day - timedelta(days=day.weekday())
+            return start.strftime("%Y-%m-%d"), datetime_to_epoch(start + timedelta(days=7))
+        return day.strftime("%Y-%m-%d"), datetime_to_epoch(day + timedelta(days=1))
+    except (OverflowError, ValueError):
+        # The last representable bucket
+        return day.strftime("%Y-%m-%d"), float("inf")
+
+
+def bucket_starts(epochs: array, interval: str) -> Tuple[List[str], array]:
+    """Labels of the non-empty buckets of sorted ``epochs`` and the index each one starts at"""
+    labels, starts = [], array('i')
+    index = 0
+    while index < len(epochs):
+        label, following = _bucket_of(epochs[index], interval)
+        labels.append(label)
+        starts.append(index)
+        index = bisect_left(epochs, following, index + 1)
+    return labels, starts
+
+
+class FacetField:
+    """One facet's values in date order, with code counts per block of that order"""
+
+    def __init__(self, labels: List[Optional[str]], values: array, offsets: Optional[array],
+                 block_bounds: List[int]):
+        # Display value of each code
+        self.labels = labels
+        self.values = values
+        # Multi-valued fields: the values of email i are values[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self._block_bounds = block_bounds
+        self._block_counts = [self._count_slice(block_bounds[k], block_bounds[k + 1])
+                              for k in range(len(block_bounds) - 1)]
+        self._total = Counter()
+        for counts in self._block_counts:
+            self._total.update(counts)
+
+    def _count_slice(self, lo: int, hi: int) -> Counter:
+        if self.offsets is not None:
+            lo, hi = self.offsets[lo], self.offsets[hi]
+        return Counter(self.values[lo:hi])
+
+    def counts(self, lo: int, hi: int) -> Counter:
+        """Code counts of the emails in ``[lo, hi)`` of the date order"""
+        bounds = self._block_bounds
+        if lo <= 0 and hi >= bounds[-1]:
+            return Counter(self._total)
+        first = bisect_left(bounds, lo)
+        last = bisect_right(bounds, hi) - 1
+        if first >= last:
+            # Within a single block
+            return self._count_slice(lo, hi)
+        counts = self._count_slice(lo, bounds[first])
+        for block in range(first, last):
+            counts.update(self._block_counts[block])
+        counts.update(self._count_slice(bounds[last], hi))
+        return counts
+
+    def nbytes(self) -> int:
+        entries = sum(len(counts) for counts in self._block_counts) + len(self._total)
+        offsets = self.offsets.itemsize * len(self.offsets) if self.offsets is not None else 0
+        # A counter entry costs a dict slot and an int object
+        return self.values.itemsize * len(self.values) + offsets + 100 * entries
+
+
+class FacetIndex:
+    """Facet counts of one mailbox for any date range.
+
+    ``sender`` is keyed by sender address, ``recipient`` by each
+    ``;``-separated entry of the recipients field. Sender domains are derived
+    from the sender counts.
+    """
+
+    def __init__(self, store: MessageStore, date_index: DateIndex):
+        self.date_index = date_index
+        order = date_index.positions.tolist() + date_index.undated
+        self.dated_count = len(date_index.positions)
+        self.email_count = len(order)
+
+        # Histogram buckets, over the dated part of the order
+        self.buckets = {interval: bucket_starts(date_index.epochs, interval) for interval in INTERVALS}
+        # Field counts are kept per month, plus one block for the undated emails
+        block_bounds = sorted(set(self.buckets["month"][1]) | {0, self.dated_count, self.email_count})
+
+        sender_codes = store.sender_emails.codes
+        self.sender = FacetField(list(store.sender_emails.values), array('I', [sender_codes[p] for p in order]),
+                                 None, block_bounds)
+        self.sender_domains = [_domain_of(address) for address in store.sender_emails.values]
+        # First display name seen with each sender address (later ones win the dict, so go backwards)
+        names = store.sender_names.values
+        self.sender_names = {code: names[name_code] for code, name_code in
+                             dict(zip(reversed(sender_codes), reversed(store.sender_names.codes))).items()}
+
+        recipient_labels, recipients_of_code = _split_recipients(store.recipients.values)
+        recipient_codes = store.recipients.codes
+        values, offsets = array('I'), array('I', [0])
+        for position in order:
+            values.extend(recipients_of_code[recipient_codes[position]])
+            offsets.append(len(values))
+        self.recipient = FacetField(recipient_labels, values, offsets, block_bounds)
+
+        # Emails with attachments among the first i of the order
+        flags = store.flags
+        self.attachments_before = array('I', [0])
+        running = 0
+        for position in order:
+            if flags[position] & FLAG_HAS_ATTACHMENTS:
+                running += 1
+            self.attachments_before.append(running)
+
+    def bounds(self, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        """``[lo, hi)`` of the emails dated within [start, end]; every email when no range is given"""
+        if start is None and end is None:
+            return 0, self.email_count
+        epochs = self.date_index.epochs
+        lo = bisect_left(epochs, start) if start is not None else 0
+        hi = bisect_right(epochs, end) if end is not None else len(epochs)
+        return lo, max(lo, hi)
+
+    def histogram(self, interval: str, lo: int, hi: int) -> List[Tuple[str, int]]:
+        """(bucket label, count) of the dated emails in ``[lo, hi)``, oldest first"""
+        labels, starts = self.buckets[interval]
+        hi = min(hi, self.dated_count)
+        first = max(bisect_right(starts, lo) - 1, 0)
+        histogram = []
+        for bucket in range(first, len(starts)):
+            bucket_start = starts[bucket]
+            if bucket_start >= hi:
+                break
+            bucket_end = starts[bucket + 1] if bucket + 1 < len(starts) else self.dated_count
+            count = min(bucket_end, hi) - max(bucket_start, lo)
+            if count > 0:
+                histogram.append((labels[bucket], count))
+        return histogram
+
+    def attachment_count(self, lo: int, hi: int) -> int:
+        return self.attachments_before[hi] - self.attachments_before[lo]
+
+    def nbytes(self) -> int:
+        buckets = sum(4 * len(starts) + 60 * len(labels) for labels, starts in self.buckets.values())
+        return (self.sender.nbytes() + self.recipient.nbytes() + buckets
+                + self.attachments_before.itemsize * len(self.attachments_before))
+
+
+def _domain_of(address: Optional[str]) -> Optional[str]:
+    if not address or "@" not in address:
+        return None
+    return address.rsplit("@", 1)[1].strip().strip(">").lower() or None
+
+
+def _split_recipients(values: List[Optional[str]]) -> Tuple[List[str], List[Tuple[int, ...]]]:
+    """Distinct individual recipients, and the recipient codes of each recipients-field value"""
+    labels: List[str] = []
+    codes: Dict[str, int] = {}
+    recipients_of_value = []
+    for value in values:
+        entries = []
+        for entry in (value or "").split(";"):
+            entry = entry.strip()
+            if not entry:
+                continue
+            code = codes.get(entry)
+            if code is None:
+                code = codes[entry] = len(labels)
+                labels.append(entry)
+            entries.append(code)
+        recipients_of_value.append(tuple(entries))
+    return labels, recipients_of_value
@@ -0,0 +1,95 @@
+"""Fast JSON encoding for API responses.
+
+Responses are encoded with orjson when it is installed (several times faster
+than the json module), falling back to json otherwise. A list of emails can be
+given as ``JSONFragments``: emails already serialized (and cached) as bytes,
+which are joined into the response as they are rather than being converted
+and encoded again on every request.
+"""
+import json
+import math
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _default(value: Any) -> Any:
+    """Encode what the JSON encoders don't know natively"""
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _finite(value: Any) -> Any:
+    """A copy of a value with NaN and infinities replaced by None, as orjson encodes them"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_finite(item) for item in value]
+    if isinstance(value, BaseModel):
+        return _finite(value.model_dump())
+    return value
+
+
+def _json_dumps(value: Any) -> str:
+    return json.dumps(value, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def dumps(value: Any) -> bytes:
+    """Compact UTF-8 JSON of a value (pydantic models are dumped to dicts)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    try:
+        return _json_dumps(value).encode("utf-8")
+    except ValueError:
+        # NaN or an infinity somewhere: rare enough to only copy the value then
+        return _json_dumps(_finite(value)).encode("utf-8")
+
+
+def add_field(fragment: bytes, name: str, value: Any) -> bytes:
+    """A serialized JSON object with one more field appended"""
+    return b"".join((fragment[:-1], b"," if len(fragment) > 2 else b"", dumps(name), b":", dumps(value), b"}"))
+
+
+class JSONFragments(list):
+    """A JSON array whose items are already-encoded JSON values (bytes)"""
+
+    def encode(self) -> bytes:
+        return b"[" + b",".join(self) + b"]"
+
+
+def encode_json(content: Any) -> bytes:
+    """JSON of a response; ``JSONFragments`` values of a top-level dict are spliced in as they are"""
+    if isinstance(content, JSONFragments):
+        return content.encode()
+    if isinstance(content, dict) and any(isinstance(value, JSONFragments) for value in content.values()):
+        parts = []
+        for key, value in content.items():
+            encoded = value.encode() if isinstance(value, JSONFragments) else dumps(value)
+            parts.append(dumps(str(key)) + b":" + encoded)
+        return b"{" + b",".join(parts) + b"}"
+    return dumps(content)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with ``encode_json``.
+
+    Endpoints returning ``JSONFragments`` must return this response
+    themselves: FastAPI would otherwise convert the content with
+    jsonable_encoder first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
+
@@ -0,0 +1,140 @@
+"""Background ingestion jobs.
+
+Parsing a mailbox takes minutes of CPU and disk time, so ingest endpoints hand
+the work to a bounded thread pool and return a job id straight away. Clients
+poll the job for its state and progress, and can ask for it to be cancelled.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested"""
+
+
+class IngestJob:
+    def __init__(self, kind: str, source: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.source = source
+        self.state = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Any object with a snapshot() -> dict method, set by the job function
+        self.progress = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Call regularly from the job function; raises JobCancelled once cancel() was called"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "source": self.source,
+            "state": self.state,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "cancel_requested": self.cancel_requested,
+            "progress": self.progress.snapshot() if self.progress is not None else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Runs ingest jobs in a bounded pool and keeps track of their state"""
+
+    # Finished jobs kept around for status queries
+    MAX_FINISHED_JOBS = 100
+
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest")
+        self._jobs: Dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, source: Optional[str], fn: Callable[[IngestJob], dict],
+               cleanup: Optional[Callable[[], None]] = None) -> IngestJob:
+        """Queue ``fn(job)``; its return value becomes the job result.
+
+        ``cleanup`` runs after the job finishes, whatever the outcome (e.g. to
+        delete an uploaded temp file).
+        """
+        job = IngestJob(kind, source)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, cleanup)
+        return job
+
+    def _run(self, job: IngestJob, fn: Callable[[IngestJob], dict], cleanup: Optional[Callable[[], None]]):
+        try:
+            if job.cancel_requested:
+                raise JobCancelled()
+            job.state = RUNNING
+            job.started_at = time.time()
+            job.result = fn(job)
+            job.state = COMPLETED
+        except JobCancelled:
+            job.state = CANCELLED
+            logging.info(f"Ingest job {job.id} cancelled")
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e)
+            logging.error(f"Ingest job {job.id} failed: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    logging.error(f"Error cleaning up after ingest job {job.id}: {str(e)}")
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.state in FINISHED_STATES]
+        if len(finished) > self.MAX_FINISHED_JOBS:
+            finished.sort(key=lambda job: job.finished_at or job.created_at)
+            for job in finished[:len(finished) - self.MAX_FINISHED_JOBS]:
+                del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        """Request cancellation; a queued job never starts, a running one stops at its next check"""
+        job = self.get(job_id)
+        if job and job.state not in FINISHED_STATES:
+            job._cancel.set()
+        return job
+
+    def shutdown(self):
+        for job in self.list():
+            job._cancel.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
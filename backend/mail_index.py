@@ -0,0 +1,660 @@
+"""Persistent on-disk index of parsed mailboxes.
+
+Every parsed OST file is written to a local SQLite database keyed by a file
+fingerprint, so reopening the same file (or restarting the server) loads the
+extracted messages from disk instead of walking the whole mailbox with pypff.
+
+Messages are also indexed in an FTS5 full-text table (a positional inverted
+index over subject, body, sender, recipients and attachment names), which
+answers ranked text queries without scanning the mailbox.
+
+For incremental re-ingest, each mailbox also keeps the state of every folder
+as of its last scan (message count and last message), and each message its
+pypff identifier, so a changed file can be brought up to date in place.
+
+When attachments are extracted, each message lists the digests of its
+attachments in the attachment store. ``attachment_blobs`` holds one row per
+distinct attachment with its extracted text, and the text is indexed with
+every message that carries the attachment. Text is extracted after the
+mailbox is stored, so those messages are re-indexed when it arrives.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class MailboxChanged(LookupError):
+    """Raised when a mailbox was rewritten since the copy a caller holds was loaded"""
+
+# Bump whenever the table layout changes. The index is a cache of what pypff
+# extracted, so an outdated database is simply dropped and rebuilt.
+SCHEMA_VERSION = 10
+
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+FINGERPRINT_SAMPLE_BLOCKS = 16
+
+EMAIL_COLUMNS = [
+    "email_id",
+    "subject",
+    "sender_name",
+    "sender_email",
+    "recipients",
+    "date",
+    "date_epoch",
+    "body",
+    "has_attachments",
+    "attachment_count",
+    "attachment_names",
+    "attachment_digests",
+    "folder_path",
+    "message_index",
+    "message_identifier",
+    "thread_id",
+    "content_hash",
+    "simhash",
+]
+
+FOLDER_SCAN_COLUMNS = ["folder_key", "folder_path", "message_count", "last_identifier", "last_delivery_epoch"]
+
+# Row ids per statement when deleting a list of rows
+DELETE_BATCH_SIZE = 500
+
+# Columns of the full-text table and their BM25 weights - a hit in the subject
+# or sender says more about a message than one somewhere in a long body.
+FTS_COLUMNS = ["subject", "body", "sender", "recipients", "attachments", "attachment_text"]
+FTS_WEIGHTS = [3.0, 1.0, 2.0, 1.5, 1.0, 0.5]
+
+
+def file_fingerprint(file_path: str, include_mtime: bool = True) -> str:
+    """Fingerprint a file from its size, mtime and a sample of its blocks.
+
+    Hashing a 40 GB mailbox in full would cost almost as much as parsing it,
+    so only FINGERPRINT_SAMPLE_BLOCKS evenly spaced blocks (always including the
+    first and the last one) are read. Uploaded files land in a fresh temp file
+    each time, so their mtime is meaningless and can be left out.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    digest.update(f"size:{stat.st_size}".encode())
+    if include_mtime:
+        digest.update(f"mtime:{stat.st_mtime_ns}".encode())
+
+    last_block = max(stat.st_size - FINGERPRINT_BLOCK_SIZE, 0)
+    if FINGERPRINT_SAMPLE_BLOCKS > 1:
+        step = last_block / (FINGERPRINT_SAMPLE_BLOCKS - 1)
+        offsets = sorted({int(i * step) for i in range(FINGERPRINT_SAMPLE_BLOCKS)})
+    else:
+        offsets = [0]
+
+    with open(file_path, "rb") as f:
+        for offset in offsets:
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+
+    return digest.hexdigest()
+
+
+class MailIndex:
+    """SQLite-backed store of extracted email rows, one mailbox per fingerprint"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # Writes go through one shared connection under a lock. Reads use a
+        # connection per thread, so with WAL they never wait for an ingest
+        # that is writing a large mailbox.
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._local = threading.local()
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _ensure_schema(self):
+        with self._lock:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                if version:
+                    logging.info(f"Mail index schema changed ({version} -> {SCHEMA_VERSION}), rebuilding {self.db_path}")
+                self._drop_all()
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS mailboxes (
+                    id INTEGER PRIMARY KEY,
+                    fingerprint TEXT NOT NULL UNIQUE,
+                    source_path TEXT,
+                    file_size INTEGER,
+                    email_count INTEGER NOT NULL DEFAULT 0,
+                    metadata_only INTEGER NOT NULL DEFAULT 0,
+                    -- Bumped whenever the mailbox's rows are rewritten under the same id
+                    generation INTEGER NOT NULL DEFAULT 0,
+                    indexed_at REAL NOT NULL,
+                    last_opened_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS emails (
+                    id INTEGER PRIMARY KEY,
+                    mailbox_id INTEGER NOT NULL REFERENCES mailboxes(id) ON DELETE CASCADE,
+                    position INTEGER NOT NULL,
+                    email_id TEXT,
+                    subject TEXT,
+                    sender_name TEXT,
+                    sender_email TEXT,
+                    recipients TEXT,
+                    date TEXT,
+                    date_epoch REAL,
+                    body TEXT,
+                    has_attachments INTEGER NOT NULL DEFAULT 0,
+                    attachment_count INTEGER NOT NULL DEFAULT 0,
+                    attachment_names TEXT,
+                    attachment_digests TEXT,
+                    folder_path TEXT,
+                    message_index INTEGER,
+                    message_identifier INTEGER,
+                    thread_id TEXT,
+                    content_hash TEXT,
+                    simhash TEXT
+                );
+                CREATE INDEX IF NOT EXISTS emails_by_mailbox ON emails(mailbox_id, position);
+                CREATE INDEX IF NOT EXISTS emails_by_date ON emails(mailbox_id, date_epoch);
+                CREATE INDEX IF NOT EXISTS emails_by_folder ON emails(mailbox_id, folder_path);
+                CREATE TABLE IF NOT EXISTS folder_scans (
+                    mailbox_id INTEGER NOT NULL REFERENCES mailboxes(id) ON DELETE CASCADE,
+                    folder_key TEXT NOT NULL,
+                    folder_path TEXT NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    last_identifier INTEGER,
+                    last_delivery_epoch REAL,
+                    PRIMARY KEY (mailbox_id, folder_key)
+                );
+                CREATE TABLE IF NOT EXISTS attachment_refs (
+                    email_row INTEGER NOT NULL,
+                    mailbox_id INTEGER NOT NULL,
+                    attachment_index INTEGER NOT NULL,
+                    digest TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS attachment_refs_by_email ON attachment_refs(email_row);
+                CREATE INDEX IF NOT EXISTS attachment_refs_by_digest ON attachment_refs(digest);
+                CREATE INDEX IF NOT EXISTS attachment_refs_by_mailbox ON attachment_refs(mailbox_id);
+                CREATE TABLE IF NOT EXISTS attachment_blobs (
+                    digest TEXT PRIMARY KEY,
+                    name TEXT,
+                    text_status TEXT NOT NULL DEFAULT 'pending',
+                    text TEXT
+                );
+                CREATE VIEW IF NOT EXISTS emails_fts_source AS
+                    SELECT id, mailbox_id, subject, body,
+                           COALESCE(sender_name, '') || ' ' || COALESCE(sender_email, '') AS sender,
+                           recipients, attachment_names AS attachments,
+                           (SELECT group_concat(b.text, ' ') FROM attachment_refs r
+                            JOIN attachment_blobs b ON b.digest = r.digest
+                            WHERE r.email_row = emails.id) AS attachment_text
+                    FROM emails;
+                CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+                    subject, body, sender, recipients, attachments, attachment_text,
+                    content='emails_fts_source', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                """
+            )
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.commit()
+
+    def _drop_all(self):
+        self._conn.execute("DROP VIEW IF EXISTS emails_fts_source")
+        self._conn.execute("DROP TABLE IF EXISTS emails_fts")
+        tables = [
+            row[0] for row in self._conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+        for table in tables:
+            self._conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        self._conn.commit()
+
+    def find_mailbox(self, fingerprint: str) -> Optional[Dict]:
+        """Return the mailbox record stored for a fingerprint, if any"""
+        row = self._reader().execute(
+            "SELECT * FROM mailboxes WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get_mailbox(self, mailbox_id: int) -> Optional[Dict]:
+        row = self._reader().execute("SELECT * FROM mailboxes WHERE id = ?", (mailbox_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_source_mailbox(self, source_path: str) -> Optional[Dict]:
+        """Return the most recently indexed mailbox read from a path, if any"""
+        row = self._reader().execute(
+            "SELECT * FROM mailboxes WHERE source_path = ? ORDER BY indexed_at DESC LIMIT 1", (source_path,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def latest_mailbox(self) -> Optional[Dict]:
+        """Return the most recently opened mailbox"""
+        row = self._reader().execute(
+            "SELECT * FROM mailboxes ORDER BY last_opened_at DESC LIMIT 1"
+        ).fetchone()
+        return dict(row) if row else None
+
+    def generation(self, mailbox_id: int) -> Optional[int]:
+        """Generation of a mailbox's rows (see search), None if it is not indexed"""
+        row = self._reader().execute("SELECT generation FROM mailboxes WHERE id = ?", (mailbox_id,)).fetchone()
+        return row["generation"] if row else None
+
+    def touch_mailbox(self, mailbox_id: int):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE mailboxes SET last_opened_at = ? WHERE id = ?", (time.time(), mailbox_id)
+            )
+            self._conn.commit()
+
+    def replaced_mailbox_ids(self, fingerprint: str, source_path: Optional[str] = None) -> List[int]:
+        """Mailboxes a new copy of a file replaces: the one with its fingerprint, then those read from source_path"""
+        return self._replaced_mailbox_ids(self._reader(), fingerprint, source_path)
+
+    @staticmethod
+    def _replaced_mailbox_ids(conn: sqlite3.Connection, fingerprint: str, source_path: Optional[str]) -> List[int]:
+        ids = [row["id"] for row in conn.execute("SELECT id FROM mailboxes WHERE fingerprint = ?", (fingerprint,))]
+        if source_path:
+            ids += [row["id"] for row in conn.execute(
+                "SELECT id FROM mailboxes WHERE source_path = ? AND fingerprint != ? ORDER BY indexed_at DESC",
+                (source_path, fingerprint),
+            )]
+        return ids
+
+    def store_mailbox(self, fingerprint: str, source_path: Optional[str], emails: Iterable[Dict],
+                      metadata_only: bool = False, folder_scans: Optional[Dict[str, Dict]] = None,
+                      replace_source: bool = False) -> int:
+        """Store extracted email rows under a fingerprint, replacing any older copy.
+
+        The mailbox row and all of its emails are written in one transaction,
+        so an interrupted ingest never leaves a half-indexed mailbox behind.
+        ``metadata_only`` records that the rows were extracted without bodies,
+        ``folder_scans`` the folder states seen before parsing (see update_mailbox).
+        With ``replace_source`` (for a file on disk, read again after it
+        changed) the mailboxes indexed from the same source_path are replaced
+        too. The new copy takes the id of the first mailbox it replaces (see
+        replaced_mailbox_ids).
+        """
+        file_size = None
+        if source_path and os.path.exists(source_path):
+            file_size = os.path.getsize(source_path)
+
+        insert_sql = self._insert_sql()
+
+        with self._lock:
+            try:
+                now = time.time()
+                replaced = self._replaced_mailbox_ids(self._conn, fingerprint,
+                                                      source_path if replace_source else None)
+                generation = 0
+                if replaced:
+                    generation = self._conn.execute(
+                        "SELECT generation + 1 FROM mailboxes WHERE id = ?", (replaced[0],)
+                    ).fetchone()[0]
+                for old_id in replaced:
+                    self._delete_mailbox_rows(old_id)
+                # Reusing the id keeps it valid for whoever holds it (None lets SQLite pick one)
+                cursor = self._conn.execute(
+                    "INSERT INTO mailboxes (id, fingerprint, source_path, file_size, metadata_only, generation, "
+                    "indexed_at, last_opened_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (replaced[0] if replaced else None, fingerprint, source_path, file_size,
+                     1 if metadata_only else 0, generation, now, now),
+                )
+                mailbox_id = cursor.lastrowid
+
+                count = 0
+                batch = []
+                for email in emails:
+                    batch.append((mailbox_id, count, *self._email_to_row(email)))
+                    count += 1
+                    if len(batch) >= 1000:
+                        self._conn.executemany(insert_sql, batch)
+                        batch = []
+                if batch:
+                    self._conn.executemany(insert_sql, batch)
+
+                # Attachment text already extracted (from an earlier copy) is indexed right away
+                self._insert_attachment_refs(mailbox_id, 0)
+                self._conn.execute(
+                    f"INSERT INTO emails_fts (rowid, {', '.join(FTS_COLUMNS)}) "
+                    f"SELECT id, {', '.join(FTS_COLUMNS)} FROM emails_fts_source WHERE mailbox_id = ?",
+                    (mailbox_id,),
+                )
+                self._conn.execute("UPDATE mailboxes SET email_count = ? WHERE id = ?", (count, mailbox_id))
+                if folder_scans:
+                    self._write_folder_scans(mailbox_id, folder_scans)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+        logging.info(f"Indexed {count} emails for mailbox {mailbox_id} ({source_path})")
+        return mailbox_id
+
+    def folder_scans(self, mailbox_id: int) -> Dict[str, Dict]:
+        """Folder states recorded at the mailbox's last scan, by folder key"""
+        cursor = self._reader().execute(
+            f"SELECT {', '.join(FOLDER_SCAN_COLUMNS)} FROM folder_scans WHERE mailbox_id = ?", (mailbox_id,)
+        )
+        return {row["folder_key"]: dict(row) for row in cursor}
+
+    def folder_messages(self, mailbox_id: int, folder_paths: Iterable[str]) -> List[Dict]:
+        """Row id, position, identifier and location of the messages in some folders"""
+        rows = []
+        for folder_path in folder_paths:
+            rows += map(dict, self._reader().execute(
+                "SELECT id, position, email_id, message_identifier, folder_path, message_index "
+                "FROM emails WHERE mailbox_id = ? AND folder_path = ? ORDER BY position",
+                (mailbox_id, folder_path),
+            ))
+        return rows
+
+    def update_mailbox(self, mailbox_id: int, fingerprint: str, added: Iterable[Dict], removed_ids: List[int],
+                       relocated: List[tuple], folder_scans: Dict[str, Dict]) -> int:
+        """Bring an indexed mailbox up to date with a changed file, in place.
+
+        ``removed_ids`` are the row ids of messages no longer in the file,
+        ``relocated`` ``(row id, folder_path, message_index)`` of messages that
+        moved, and ``added`` the rows of new messages, which are appended after
+        the existing ones. Positions are renumbered if rows were removed. The
+        mailbox takes the file's new fingerprint and folder states, and its
+        generation goes up. Returns the new email count.
+        """
+        with self._lock:
+            try:
+                # A copy already stored under the new fingerprint is superseded
+                stale = self._conn.execute(
+                    "SELECT id FROM mailboxes WHERE fingerprint = ? AND id != ?", (fingerprint, mailbox_id)
+                ).fetchone()
+                if stale:
+                    self._delete_mailbox_rows(stale["id"])
+
+                for start in range(0, len(removed_ids), DELETE_BATCH_SIZE):
+                    ids = removed_ids[start:start + DELETE_BATCH_SIZE]
+                    placeholders = ", ".join("?" for _ in ids)
+                    self._conn.execute(
+                        f"INSERT INTO emails_fts (emails_fts, rowid, {', '.join(FTS_COLUMNS)}) "
+                        f"SELECT 'delete', id, {', '.join(FTS_COLUMNS)} FROM emails_fts_source "
+                        f"WHERE id IN ({placeholders})",
+                        ids,
+                    )
+                    self._conn.execute(f"DELETE FROM attachment_refs WHERE email_row IN ({placeholders})", ids)
+                    self._conn.execute(f"DELETE FROM emails WHERE id IN ({placeholders})", ids)
+                if removed_ids:
+                    self._conn.execute(
+                        "UPDATE emails SET position = numbered.position FROM ("
+                        "  SELECT id, ROW_NUMBER() OVER (ORDER BY position) - 1 AS position"
+                        "  FROM emails WHERE mailbox_id = ?"
+                        ") AS numbered WHERE emails.id = numbered.id",
+                        (mailbox_id,),
+                    )
+
+                self._conn.executemany(
+                    "UPDATE emails SET folder_path = ?, message_index = ? WHERE id = ?",
+                    [(folder_path, message_index, row_id) for row_id, folder_path, message_index in relocated],
+                )
+
+                first_added = count = self._conn.execute(
+                    "SELECT COUNT(*) FROM emails WHERE mailbox_id = ?", (mailbox_id,)
+                ).fetchone()[0]
+                insert_sql = self._insert_sql()
+                batch = []
+                for email in added:
+                    batch.append((mailbox_id, count, *self._email_to_row(email)))
+                    count += 1
+                    if len(batch) >= 1000:
+                        self._conn.executemany(insert_sql, batch)
+                        batch = []
+                if batch:
+                    self._conn.executemany(insert_sql, batch)
+                self._insert_attachment_refs(mailbox_id, first_added)
+                self._conn.execute(
+                    f"INSERT INTO emails_fts (rowid, {', '.join(FTS_COLUMNS)}) "
+                    f"SELECT id, {', '.join(FTS_COLUMNS)} FROM emails_fts_source WHERE mailbox_id = ? AND id IN ("
+                    "  SELECT id FROM emails WHERE mailbox_id = ? AND position >= ?)",
+                    (mailbox_id, mailbox_id, first_added),
+                )
+
+                mailbox = self._conn.execute("SELECT source_path FROM mailboxes WHERE id = ?", (mailbox_id,)).fetchone()
+                file_size = None
+                if mailbox and mailbox["source_path"] and os.path.exists(mailbox["source_path"]):
+                    file_size = os.path.getsize(mailbox["source_path"])
+                now = time.time()
+                self._conn.execute(
+                    "UPDATE mailboxes SET fingerprint = ?, file_size = ?, email_count = ?, generation = generation + 1, "
+                    "indexed_at = ?, last_opened_at = ? WHERE id = ?",
+                    (fingerprint, file_size, count, now, now, mailbox_id),
+                )
+                self._write_folder_scans(mailbox_id, folder_scans)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+        logging.info(f"Updated mailbox {mailbox_id} in place: {count - first_added} emails added, "
+                     f"{len(removed_ids)} removed, {count} in total")
+        return count
+
+    def _insert_attachment_refs(self, mailbox_id: int, first_position: int):
+        """Record the attachments of the mailbox's emails from ``first_position`` on, and their blobs"""
+        self._conn.execute(
+            "INSERT INTO attachment_refs (email_row, mailbox_id, attachment_index, digest) "
+            "SELECT e.id, e.mailbox_id, j.key, j.value FROM emails e, json_each(e.attachment_digests) j "
+            "WHERE e.mailbox_id = ? AND e.position >= ? AND j.value != ''",
+            (mailbox_id, first_position),
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO attachment_blobs (digest, name) "
+            "SELECT r.digest, json_extract(e.attachment_names, '$[' || r.attachment_index || ']') "
+            "FROM attachment_refs r JOIN emails e ON e.id = r.email_row "
+            "WHERE r.mailbox_id = ? AND e.position >= ?",
+            (mailbox_id, first_position),
+        )
+
+    def pending_attachment_blobs(self) -> List[Dict]:
+        """Digest and first-seen name of the attachments whose text has not been extracted yet"""
+        cursor = self._reader().execute(
+            "SELECT digest, name FROM attachment_blobs WHERE text_status = 'pending' "
+            "AND digest IN (SELECT digest FROM attachment_refs)"
+        )
+        return [dict(row) for row in cursor]
+
+    def attachment_blob(self, digest: str) -> Optional[Dict]:
+        row = self._reader().execute(
+            "SELECT digest, name, text_status, length(text) AS text_length FROM attachment_blobs WHERE digest = ?",
+            (digest,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def set_attachment_text(self, digest: str, status: str, text: Optional[str]) -> int:
+        """Store the text extracted from an attachment and re-index the emails carrying it.
+
+        Returns how many emails were re-indexed.
+        """
+        with self._lock:
+            try:
+                rows = [row[0] for row in self._conn.execute(
+                    "SELECT DISTINCT email_row FROM attachment_refs WHERE digest = ?", (digest,)
+                )]
+                changes_index = bool(rows) and bool(text)
+                for start in range(0, len(rows) if changes_index else 0, DELETE_BATCH_SIZE):
+                    ids = rows[start:start + DELETE_BATCH_SIZE]
+                    placeholders = ", ".join("?" for _ in ids)
+                    # Old values out (as they were indexed), new values in
+                    self._conn.execute(
+                        f"INSERT INTO emails_fts (emails_fts, rowid, {', '.join(FTS_COLUMNS)}) "
+                        f"SELECT 'delete', id, {', '.join(FTS_COLUMNS)} FROM emails_fts_source "
+                        f"WHERE id IN ({placeholders})",
+                        ids,
+                    )
+                self._conn.execute(
+                    "UPDATE attachment_blobs SET text_status = ?, text = ? WHERE digest = ?", (status, text, digest)
+                )
+                for start in range(0, len(rows) if changes_index else 0, DELETE_BATCH_SIZE):
+                    ids = rows[start:start + DELETE_BATCH_SIZE]
+                    placeholders = ", ".join("?" for _ in ids)
+                    self._conn.execute(
+                        f"INSERT INTO emails_fts (rowid, {', '.join(FTS_COLUMNS)}) "
+                        f"SELECT id, {', '.join(FTS_COLUMNS)} FROM emails_fts_source WHERE id IN ({placeholders})",
+                        ids,
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return len(rows) if changes_index else 0
+
+    def prune_attachment_blobs(self) -> List[str]:
+        """Forget attachments no stored email refers to any more, returning their digests"""
+        with self._lock:
+            digests = [row[0] for row in self._conn.execute(
+                "SELECT digest FROM attachment_blobs WHERE digest NOT IN (SELECT digest FROM attachment_refs)"
+            )]
+            for start in range(0, len(digests), DELETE_BATCH_SIZE):
+                batch = digests[start:start + DELETE_BATCH_SIZE]
+                self._conn.execute(
+                    f"DELETE FROM attachment_blobs WHERE digest IN ({', '.join('?' for _ in batch)})", batch
+                )
+            self._conn.commit()
+        return digests
+
+    def _write_folder_scans(self, mailbox_id: int, folder_scans: Dict[str, Dict]):
+        self._conn.execute("DELETE FROM folder_scans WHERE mailbox_id = ?", (mailbox_id,))
+        self._conn.executemany(
+            f"INSERT INTO folder_scans (mailbox_id, {', '.join(FOLDER_SCAN_COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' for _ in FOLDER_SCAN_COLUMNS)})",
+            [(mailbox_id, key, *(scan[column] for column in FOLDER_SCAN_COLUMNS[1:]))
+             for key, scan in folder_scans.items()],
+        )
+
+    @staticmethod
+    def _insert_sql() -> str:
+        placeholders = ", ".join("?" for _ in EMAIL_COLUMNS)
+        return (
+            f"INSERT INTO emails (mailbox_id, position, {', '.join(EMAIL_COLUMNS)}) "
+            f"VALUES (?, ?, {placeholders})"
+        )
+
+    def _delete_mailbox_rows(self, mailbox_id: int):
+        # External-content FTS rows must be removed with the values they were indexed with
+        self._conn.execute(
+            f"INSERT INTO emails_fts (emails_fts, rowid, {', '.join(FTS_COLUMNS)}) "
+            f"SELECT 'delete', id, {', '.join(FTS_COLUMNS)} FROM emails_fts_source WHERE mailbox_id = ?",
+            (mailbox_id,),
+        )
+        self._conn.execute("DELETE FROM attachment_refs WHERE mailbox_id = ?", (mailbox_id,))
+        self._conn.execute("DELETE FROM emails WHERE mailbox_id = ?", (mailbox_id,))
+        self._conn.execute("DELETE FROM folder_scans WHERE mailbox_id = ?", (mailbox_id,))
+        self._conn.execute("DELETE FROM mailboxes WHERE id = ?", (mailbox_id,))
+
+    def search(self, mailbox_id: int, match: Optional[str], has_attachment: Optional[bool] = None,
+               limit: Optional[int] = None, generation: Optional[int] = None) -> List[tuple]:
+        """Run a full-text query against one mailbox.
+
+        ``match`` is an FTS5 expression (see text_query.parse_query). Returns
+        ``(position, score)`` pairs, best BM25 score first; without a text
+        expression every message passing the filters is returned newest first.
+        Positions are those of the mailbox's current rows: with ``generation``
+        (of the rows the caller holds) MailboxChanged is raised if they have
+        been rewritten since.
+        """
+        params: list = []
+        if match:
+            weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+            sql = (
+                f"SELECT e.position, -bm25(emails_fts, {weights}) AS score "
+                "FROM emails_fts JOIN emails e ON e.id = emails_fts.rowid "
+                "WHERE emails_fts MATCH ? AND e.mailbox_id = ?"
+            )
+            params += [match, mailbox_id]
+        else:
+            sql = "SELECT e.position, 0.0 AS score FROM emails e WHERE e.mailbox_id = ?"
+            params.append(mailbox_id)
+
+        if has_attachment is not None:
+            sql += " AND e.has_attachments = ?"
+            params.append(1 if has_attachment else 0)
+
+        if match:
+            sql += " ORDER BY score DESC, e.position"
+        else:
+            sql += " ORDER BY e.date_epoch IS NULL, e.date_epoch DESC, e.position DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        conn = self._reader()
+        if generation is None:
+            return [(row[0], row[1]) for row in conn.execute(sql, params)]
+        # One read transaction, so the hits are of the generation checked
+        conn.execute("BEGIN")
+        try:
+            if self.generation(mailbox_id) != generation:
+                raise MailboxChanged(mailbox_id)
+            return [(row[0], row[1]) for row in conn.execute(sql, params)]
+        finally:
+            conn.execute("COMMIT")
+
+    def load_emails(self, mailbox_id: int) -> List[Dict]:
+        """Load all email rows of a mailbox in their original parse order"""
+        return list(self.iter_emails(mailbox_id))
+
+    def iter_emails(self, mailbox_id: int) -> Iterator[Dict]:
+        """Yield the email rows of a mailbox in their original parse order, one at a time"""
+        cursor = self._reader().execute(
+            f"SELECT {', '.join(EMAIL_COLUMNS)} FROM emails WHERE mailbox_id = ? ORDER BY position",
+            (mailbox_id,),
+        )
+        for row in cursor:
+            yield self._row_to_email(row)
+
+    @staticmethod
+    def _email_to_row(email: Dict) -> tuple:
+        return (
+            email.get("email_id"),
+            email.get("subject"),
+            email.get("sender_name"),
+            email.get("sender_email"),
+            email.get("recipients"),
+            email.get("date"),
+            email.get("date_epoch"),
+            email.get("body"),
+            1 if email.get("has_attachments") else 0,
+            email.get("attachment_count") or 0,
+            json.dumps(email.get("attachment_names") or []),
+            json.dumps(email.get("attachment_digests") or []),
+            email.get("folder_path"),
+            email.get("message_index"),
+            email.get("message_identifier"),
+            email.get("thread_id"),
+            email.get("content_hash"),
+            email.get("simhash"),
+        )
+
+    @staticmethod
+    def _row_to_email(row: sqlite3.Row) -> Dict:
+        email = dict(row)
+        email["has_attachments"] = bool(email["has_attachments"])
+        email["attachment_names"] = json.loads(email["attachment_names"] or "[]")
+        email["attachment_digests"] = json.loads(email["attachment_digests"] or "[]")
+        return email
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,258 @@
+"""Catalog of the mailboxes held in memory, shared by all clients of the server.
+
+Every loaded mailbox gets an opaque handle. Handles belong to the session that
+loaded them (one per browser tab or analyst), so several people can work on
+one backend without replacing each other's mailbox, and a search can target
+any of the session's handles.
+
+Entries loaded from the same key (a mailbox of the persistent index) share
+one resident copy, counted once against the memory budget. When the budget is
+exceeded the least recently used mailboxes are evicted: a mailbox that can be
+reloaded (because it is in the persistent index) keeps its handles and is
+brought back on its next use, one that cannot is dropped and its handles
+forgotten.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+DEFAULT_SESSION = "default"
+
+
+class MailboxNotFound(KeyError):
+    """Raised for a handle that is unknown, dropped, or owned by another session"""
+
+
+class CatalogEntry:
+    def __init__(self, session: str, mailbox: Any, size_bytes: int, label: Optional[str] = None,
+                 reload: Optional[Callable[[], Any]] = None, key: Optional[Any] = None):
+        self.handle = uuid.uuid4().hex
+        self.session = session
+        self.label = label
+        # What the mailbox was loaded from; loading it again in the same session reuses the handle
+        self.key = key
+        self.mailbox = mailbox
+        self.size_bytes = size_bytes
+        # Brings the mailbox back after eviction; None if it cannot be reloaded
+        self.reload = reload
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.evictions = 0
+        # Serializes reloads of this entry without holding up the whole catalog
+        self._load_lock = threading.Lock()
+
+    @property
+    def resident(self) -> bool:
+        return self.mailbox is not None
+
+    @property
+    def slot(self) -> Hashable:
+        """What the entry's resident copy is shared and counted by: its key, else the entry itself"""
+        return ("key", self.key) if self.key is not None else ("handle", self.handle)
+
+    def to_dict(self) -> dict:
+        return {
+            "handle": self.handle,
+            "label": self.label,
+            "resident": self.resident,
+            "size_bytes": self.size_bytes,
+            "created_at": self.created_at,
+            "last_used_at": self.last_used_at,
+            "evictions": self.evictions,
+        }
+
+
+class MailboxCatalog:
+    """Mailboxes by handle, with LRU eviction under a memory budget.
+
+    ``size_of(mailbox)`` measures a mailbox brought back by a reload (the size
+    it had when it was added is kept without one).
+    """
+
+    def __init__(self, max_bytes: int, spill: bool = True, size_of: Optional[Callable[[Any], int]] = None):
+        self.max_bytes = max_bytes
+        # Whether evicted mailboxes that can be reloaded keep their handles
+        self.spill = spill
+        self.size_of = size_of
+        # Least recently used first
+        self._entries: "OrderedDict[str, CatalogEntry]" = OrderedDict()
+        # Most recently loaded handle of each session
+        self._current: Dict[str, str] = {}
+        # Bytes of each resident copy, by entry slot
+        self._resident_sizes: Dict[Hashable, int] = {}
+        self._lock = threading.RLock()
+        self.evictions = 0
+        self.reloads = 0
+
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._resident_sizes.values())
+
+    def add(self, session: str, mailbox: Any, size_bytes: int, label: Optional[str] = None,
+            reload: Optional[Callable[[], Any]] = None, key: Optional[Any] = None) -> CatalogEntry:
+        """Register a loaded mailbox and make it the session's current one"""
+        with self._lock:
+            entry = None
+            if key is not None:
+                entry = next((e for e in self._entries.values() if e.session == session and e.key == key), None)
+            if entry is not None:
+                # Same source loaded again in this session - keep the handle, replace the emails
+                entry.label, entry.reload = label, reload
+            else:
+                entry = CatalogEntry(session, None, size_bytes, label, reload, key)
+                self._entries[entry.handle] = entry
+            # The newest copy of a key is the one every session holding it uses
+            self._make_resident(entry, mailbox, size_bytes)
+            self._current[session] = entry.handle
+            self._touch(entry)
+            self._evict(keep=entry)
+            return entry
+
+    def get(self, session: str, handle: str) -> Any:
+        """The mailbox of a handle, reloading it if it was evicted"""
+        entry = self.entry(session, handle)
+        with self._lock:
+            self._touch(entry)
+            mailbox = entry.mailbox
+        if mailbox is not None:
+            return mailbox
+
+        with entry._load_lock:
+            if entry.mailbox is None:
+                with self._lock:
+                    shared = self._resident_copy(entry)
+                    if shared is not None:
+                        # Another session holds the same mailbox
+                        entry.mailbox, entry.size_bytes = shared.mailbox, shared.size_bytes
+                        return entry.mailbox
+                logging.info(f"Reloading evicted mailbox {entry.handle} ({entry.label})")
+                mailbox = entry.reload()
+                size_bytes = self.size_of(mailbox) if self.size_of is not None else entry.size_bytes
+                with self._lock:
+                    if entry.handle not in self._entries:
+                        # Removed while it was being reloaded
+                        raise MailboxNotFound(handle)
+                    self._make_resident(entry, mailbox, size_bytes)
+                    self.reloads += 1
+                    self._evict(keep=entry)
+            return entry.mailbox
+
+    def entry(self, session: str, handle: str) -> CatalogEntry:
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None or entry.session != session:
+                raise MailboxNotFound(handle)
+            return entry
+
+    def current(self, session: str) -> Optional[CatalogEntry]:
+        """The session's most recently loaded mailbox entry, if it is still in the catalog"""
+        with self._lock:
+            handle = self._current.get(session)
+            return self._entries.get(handle) if handle else None
+
+    def find_resident(self, key: Any) -> Optional[Any]:
+        """A resident mailbox loaded from ``key`` in any session, if there is one"""
+        with self._lock:
+            for entry in reversed(self._entries.values()):
+                if entry.key == key and entry.resident:
+                    return entry.mailbox
+            return None
+
+    def rekey(self, old_keys: Iterable[Any], key: Any, reload: Optional[Callable[[], Any]]):
+        """Point the entries loaded from any of ``old_keys`` at ``key``, whose data replaced theirs.
+
+        Their resident mailboxes are dropped from memory and brought back with
+        ``reload`` when next used, so no session keeps serving the old data.
+        """
+        old_keys = set(old_keys)
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.key in old_keys:
+                    self._release(entry)
+                    entry.key, entry.reload = key, reload
+
+    def entries(self, session: str) -> List[CatalogEntry]:
+        """The session's entries, most recently used first"""
+        with self._lock:
+            return [entry for entry in reversed(self._entries.values()) if entry.session == session]
+
+    def remove(self, session: str, handle: str) -> CatalogEntry:
+        with self._lock:
+            entry = self.entry(session, handle)
+            self._drop(entry)
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current.clear()
+            self._resident_sizes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mailboxes": len(self._entries),
+                "resident_mailboxes": len(self._resident_sizes),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+            }
+
+    def _touch(self, entry: CatalogEntry):
+        entry.last_used_at = time.time()
+        self._entries.move_to_end(entry.handle)
+
+    def _sharing(self, entry: CatalogEntry) -> List[CatalogEntry]:
+        """The resident entries sharing ``entry``'s copy (itself included if resident)"""
+        slot = entry.slot
+        return [other for other in self._entries.values() if other.resident and other.slot == slot]
+
+    def _resident_copy(self, entry: CatalogEntry) -> Optional[CatalogEntry]:
+        return next(iter(self._sharing(entry)), None)
+
+    def _make_resident(self, entry: CatalogEntry, mailbox: Any, size_bytes: int):
+        for other in self._sharing(entry) + [entry]:
+            other.mailbox, other.size_bytes = mailbox, size_bytes
+        self._resident_sizes[entry.slot] = size_bytes
+
+    def _release(self, entry: CatalogEntry):
+        """Drop an entry's resident copy, and its bytes once no other entry shares it"""
+        if not entry.resident:
+            return
+        entry.mailbox = None
+        if not self._sharing(entry):
+            self._resident_sizes.pop(entry.slot, None)
+
+    def _drop(self, entry: CatalogEntry):
+        self._release(entry)
+        del self._entries[entry.handle]
+        if self._current.get(entry.session) == entry.handle:
+            del self._current[entry.session]
+
+    def _evict(self, keep: CatalogEntry):
+        """Evict least recently used mailboxes until the resident ones fit the budget"""
+        for entry in list(self._entries.values()):
+            if self.resident_bytes <= self.max_bytes:
+                return
+            if not entry.resident or entry.slot == keep.slot:
+                continue
+            # Memory is only freed once every entry sharing the copy lets go of it
+            self.evictions += 1
+            for other in self._sharing(entry):
+                other.evictions += 1
+                if self.spill and other.reload is not None:
+                    logging.info(f"Evicting mailbox {other.handle} ({other.label}) from memory, "
+                                 f"{other.size_bytes} bytes")
+                    self._release(other)
+                else:
+                    logging.info(f"Dropping mailbox {other.handle} ({other.label}), it cannot be reloaded")
+                    self._drop(other)
+
+        if self.resident_bytes > self.max_bytes:
+            logging.warning(f"Mailbox {keep.handle} ({keep.label}) alone exceeds the memory budget "
+                            f"({keep.size_bytes} of {self.max_bytes} bytes)")
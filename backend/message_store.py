@@ -0,0 +1,338 @@
+"""Columnar in-memory storage for parsed messages.
+
+Holding every message as a model instance costs an object, a field dict and a
+separate copy of each sender, recipient and attachment list per message -
+several GB at a million messages. The ``MessageStore`` keeps one column per
+field instead:
+
+  - numeric fields (date epochs, attachment counts, flags, message indexes,
+    identifiers, thread ids and duplicate-detection hashes) in ``array``
+    buffers
+  - low-cardinality strings (senders, recipients, folder paths) dictionary
+    encoded: each distinct value is stored once and rows hold a code
+  - free-text strings (subjects, bodies, ids, dates, attachment names and
+    digests) back to back as UTF-8 in one buffer per column, found through an
+    offsets array; bodies, the bulk of a mailbox, are zlib-compressed when
+    they are long enough to gain from it (they are only read to display a
+    message)
+
+Messages are appended as they are parsed and materialized (as the model class
+the store was created with) only when a response needs them.
+"""
+import itertools
+import sys
+import zlib
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from date_index import parse_email_date
+
+# Bits of the flags column
+FLAG_HAS_ATTACHMENTS = 1
+# The body was not extracted at ingest (metadata-only mode) - distinct from an empty body
+FLAG_NO_BODY = 2
+# The body is stored zlib-compressed
+FLAG_BODY_COMPRESSED = 4
+
+# Bodies shorter than this (in UTF-8 bytes) are stored as they are
+BODY_COMPRESS_MIN_BYTES = 256
+# Fast compression: bodies are compressed at ingest speed and rarely read
+BODY_COMPRESS_LEVEL = 1
+
+# Separates a message's attachment names in their column
+_NAME_SEPARATOR = "\x1f"
+
+_NO_INDEX = -1
+_UNSET = object()
+_store_keys = itertools.count()
+
+
+class StringHeap:
+    """A column of strings stored back to back as UTF-8, found by offset"""
+
+    def __init__(self):
+        self._data = bytearray()
+        # End offset of each value; value i spans ends[i - 1]:ends[i]
+        self._ends = array('Q')
+        # Rows holding None rather than a string (rare, so a set is smallest)
+        self._nulls = set()
+
+    def append(self, value: Optional[str]):
+        if value is None:
+            self._nulls.add(len(self._ends))
+        elif value:
+            self._data += value.encode('utf-8', 'surrogatepass')
+        self._ends.append(len(self._data))
+
+    def append_bytes(self, value: bytes):
+        """Append an already encoded value (read back with raw())"""
+        self._data += value
+        self._ends.append(len(self._data))
+
+    def raw(self, index: int) -> bytes:
+        start = self._ends[index - 1] if index else 0
+        return bytes(self._data[start:self._ends[index]])
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        if index < 0:
+            index += len(self._ends)
+        if index in self._nulls:
+            return None
+        start = self._ends[index - 1] if index else 0
+        return self._data[start:self._ends[index]].decode('utf-8', 'surrogatepass')
+
+    def length_of(self, index: int) -> int:
+        """Encoded length of a value, without decoding it"""
+        start = self._ends[index - 1] if index else 0
+        return self._ends[index] - start
+
+    def __len__(self):
+        return len(self._ends)
+
+    def copy(self) -> "StringHeap":
+        heap = StringHeap()
+        heap._data = bytearray(self._data)
+        heap._ends = array('Q', self._ends)
+        heap._nulls = set(self._nulls)
+        return heap
+
+    def nbytes(self) -> int:
+        return len(self._data) + self._ends.itemsize * len(self._ends) + sys.getsizeof(self._nulls)
+
+
+class DictionaryColumn:
+    """A column of strings with few distinct values, each stored once"""
+
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+        self._codes_by_value: Dict[Optional[str], int] = {}
+        self.codes = array('I')
+
+    def _code(self, value: Optional[str]) -> int:
+        code = self._codes_by_value.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._codes_by_value[value] = code
+        return code
+
+    def append(self, value: Optional[str]):
+        self.codes.append(self._code(value))
+
+    def set(self, index: int, value: Optional[str]):
+        self.codes[index] = self._code(value)
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        return self.values[self.codes[index]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def copy(self) -> "DictionaryColumn":
+        column = DictionaryColumn()
+        column.values = list(self.values)
+        column._codes_by_value = dict(self._codes_by_value)
+        column.codes = array('I', self.codes)
+        return column
+
+    def nbytes(self) -> int:
+        distinct = sum(sys.getsizeof(value) for value in self.values)
+        # The values list and the reverse dict hold a pointer or slot per value
+        return self.codes.itemsize * len(self.codes) + distinct + 100 * len(self.values)
+
+
+class MessageStore:
+    """Parsed messages of one mailbox, column by column.
+
+    Behaves as a read-only sequence of messages: ``store[i]`` materializes
+    message ``i`` with the ``factory`` the store was created with (called with
+    the message's fields as keyword arguments).
+    """
+
+    def __init__(self, factory: Callable[..., Any] = dict):
+        self._factory = factory
+        # Unique for the life of the process, unlike id(); keys caches of per-message data
+        self.key = next(_store_keys)
+        self.email_ids = StringHeap()
+        self.subjects = StringHeap()
+        self.dates = StringHeap()
+        self.bodies = StringHeap()
+        self.attachment_names = StringHeap()
+        # SHA-256 of each attachment in the attachment store, aligned with the names ("" if not stored)
+        self.attachment_digests = StringHeap()
+        self.sender_names = DictionaryColumn()
+        self.sender_emails = DictionaryColumn()
+        self.recipients = DictionaryColumn()
+        self.folder_paths = DictionaryColumn()
+        # Epoch seconds of each message's date, NaN when it has no parseable date
+        self.date_epochs = array('d')
+        self.attachment_counts = array('I')
+        self.message_indexes = array('i')
+        # pypff node identifiers, which stay the same while a message is in the file
+        self.message_identifiers = array('q')
+        # Conversation thread ids (64-bit hashes, see conversations.thread_id_of), 0 when unknown
+        self.thread_ids = array('Q')
+        # Exact and near-duplicate fingerprints (see dedup), 0 when unknown
+        self.content_hashes = array('Q')
+        self.simhashes = array('Q')
+        self.flags = array('B')
+
+    def append(self, email: Any, date_epoch: Any = _UNSET) -> int:
+        """Append a message model (anything with the message fields as attributes)"""
+        return self.append_fields(date_epoch=date_epoch, **vars(email))
+
+    def append_fields(self, subject: Optional[str] = None, sender_name: Optional[str] = None,
+                      sender_email: Optional[str] = None, recipients: Optional[str] = None,
+                      date: Optional[str] = None, body: Optional[str] = None,
+                      has_attachments: bool = False, attachment_count: int = 0,
+                      attachment_names: Optional[List[str]] = None, attachment_digests: Optional[List[str]] = None,
+                      email_id: Optional[str] = None,
+                      folder_path: Optional[str] = None, message_index: Optional[int] = None,
+                      message_identifier: Optional[int] = None, thread_id: Optional[str] = None,
+                      content_hash: Optional[str] = None, simhash: Optional[str] = None,
+                      date_epoch: Any = _UNSET, **_other) -> int:
+        """Append one message from its fields, returning its position.
+
+        ``date_epoch`` is parsed from ``date`` unless given (None for undated).
+        """
+        if date_epoch is _UNSET:
+            date_epoch = parse_email_date(date)
+
+        flags = (FLAG_HAS_ATTACHMENTS if has_attachments else 0) | (FLAG_NO_BODY if body is None else 0)
+        encoded_body = body.encode('utf-8', 'surrogatepass') if body else b""
+        if len(encoded_body) >= BODY_COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(encoded_body, BODY_COMPRESS_LEVEL)
+            if len(compressed) < len(encoded_body):
+                encoded_body = compressed
+                flags |= FLAG_BODY_COMPRESSED
+
+        self.email_ids.append(email_id)
+        self.subjects.append(subject)
+        self.dates.append(date)
+        self.bodies.append_bytes(encoded_body)
+        self.attachment_names.append(_NAME_SEPARATOR.join(attachment_names) if attachment_names else "")
+        self.attachment_digests.append(_NAME_SEPARATOR.join(attachment_digests) if attachment_digests else "")
+        self.sender_names.append(sender_name)
+        self.sender_emails.append(sender_email)
+        self.recipients.append(recipients)
+        self.folder_paths.append(folder_path)
+        self.date_epochs.append(float('nan') if date_epoch is None else date_epoch)
+        self.attachment_counts.append(attachment_count or 0)
+        self.message_indexes.append(_NO_INDEX if message_index is None else message_index)
+        self.message_identifiers.append(_NO_INDEX if message_identifier is None else message_identifier)
+        self.thread_ids.append(int(thread_id, 16) if thread_id else 0)
+        self.content_hashes.append(int(content_hash, 16) if content_hash else 0)
+        self.simhashes.append(int(simhash, 16) if simhash else 0)
+        self.flags.append(flags)
+        return len(self.flags) - 1
+
+    def copy(self) -> "MessageStore":
+        """An independent copy of the store (with a key of its own), to change without affecting readers"""
+        store = MessageStore(self._factory)
+        for name, value in vars(self).items():
+            if isinstance(value, (StringHeap, DictionaryColumn)):
+                setattr(store, name, value.copy())
+            elif isinstance(value, array):
+                setattr(store, name, array(value.typecode, value))
+        return store
+
+    def extend(self, emails) -> "MessageStore":
+        for email in emails:
+            self.append(email)
+        return self
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __bool__(self):
+        return len(self.flags) > 0
+
+    def row(self, index: int, include_body: bool = True) -> dict:
+        """The fields of one message as a dict (body None if it was not extracted or not requested)"""
+        if index < 0:
+            index += len(self.flags)
+        if not 0 <= index < len(self.flags):
+            raise IndexError("message index out of range")
+        flags = self.flags[index]
+        names = self.attachment_names[index]
+        digests = self.attachment_digests[index]
+        message_index = self.message_indexes[index]
+        message_identifier = self.message_identifiers[index]
+        thread_id = self.thread_ids[index]
+        content_hash = self.content_hashes[index]
+        simhash = self.simhashes[index]
+        return {
+            "email_id": self.email_ids[index],
+            "subject": self.subjects[index],
+            "sender_name": self.sender_names[index],
+            "sender_email": self.sender_emails[index],
+            "recipients": self.recipients[index],
+            "date": self.dates[index],
+            "body": self.body(index) if include_body else None,
+            "has_attachments": bool(flags & FLAG_HAS_ATTACHMENTS),
+            "attachment_count": self.attachment_counts[index],
+            "attachment_names": names.split(_NAME_SEPARATOR) if names else [],
+            "attachment_digests": digests.split(_NAME_SEPARATOR) if digests else [],
+            "folder_path": self.folder_paths[index],
+            "message_index": None if message_index == _NO_INDEX else message_index,
+            "message_identifier": None if message_identifier == _NO_INDEX else message_identifier,
+            "thread_id": format(thread_id, "016x") if thread_id else None,
+            "content_hash": format(content_hash, "016x") if content_hash else None,
+            "simhash": format(simhash, "016x") if simhash else None,
+        }
+
+    def __getitem__(self, index: int) -> Any:
+        return self._factory(**self.row(index))
+
+    def __iter__(self) -> Iterator[Any]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def relocate(self, index: int, folder_path: Optional[str], message_index: Optional[int]):
+        """Record that a message is now at another place in its file"""
+        self.folder_paths.set(index, folder_path)
+        self.message_indexes[index] = _NO_INDEX if message_index is None else message_index
+
+    def has_body(self, index: int) -> bool:
+        return not self.flags[index] & FLAG_NO_BODY
+
+    def body(self, index: int) -> Optional[str]:
+        """A message's body, None if it was not extracted at ingest"""
+        flags = self.flags[index]
+        if flags & FLAG_NO_BODY:
+            return None
+        data = self.bodies.raw(index)
+        if flags & FLAG_BODY_COMPRESSED:
+            data = zlib.decompress(data)
+        return data.decode('utf-8', 'surrogatepass')
+
+    def body_preview(self, index: int, length: int) -> str:
+        """The first ``length`` characters of a body, decoding only what is needed"""
+        flags = self.flags[index]
+        if flags & FLAG_NO_BODY:
+            return ""
+        # A character is at most 4 bytes of UTF-8
+        max_bytes = 4 * length
+        data = self.bodies.raw(index)
+        if flags & FLAG_BODY_COMPRESSED:
+            data = zlib.decompressobj().decompress(data, max_bytes)
+        return data[:max_bytes].decode('utf-8', 'ignore')[:length]
+
+    def date_epoch(self, index: int) -> Optional[float]:
+        epoch = self.date_epochs[index]
+        return None if epoch != epoch else epoch
+
+    def iter_rows(self) -> Iterator[dict]:
+        """Every message as a dict with its date_epoch, e.g. for writing to the index"""
+        for index in range(len(self)):
+            row = self.row(index)
+            row["date_epoch"] = self.date_epoch(index)
+            yield row
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the store"""
+        columns = (self.email_ids, self.subjects, self.dates, self.bodies, self.attachment_names,
+                   self.attachment_digests, self.sender_names, self.sender_emails, self.recipients, self.folder_paths)
+        arrays = (self.date_epochs, self.attachment_counts, self.message_indexes, self.message_identifiers,
+                  self.thread_ids, self.content_hashes, self.simhashes, self.flags)
+        return sum(column.nbytes() for column in columns) + sum(a.itemsize * len(a) for a in arrays)
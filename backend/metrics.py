@@ -0,0 +1,209 @@
+"""Process-wide metrics in the Prometheus text exposition format.
+
+A small registry of counters, gauges and histograms with labels, rendered for
+``GET /api/metrics``, so ingest hosts can be scraped without adding a client
+library. Gauges and counters can also be read from a callback when scraped
+(e.g. the size of a cache, or hits it counts itself).
+``RequestMetricsMiddleware`` times every API request by route, and responses
+rendered through ``TimedJSONResponse`` add their JSON encoding time and size
+to the request's route.
+"""
+import contextvars
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request latency buckets in seconds, from a cached page to a large parse
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A metric family; ``read`` (returning a number, or a dict of label value
+    tuples to numbers) is called on every scrape instead of recording values"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 read: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        self._read = read
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> Iterable[str]:
+        if self._read is not None:
+            value = self._read()
+            values = value if isinstance(value, dict) else {(): value}
+            with self._lock:
+                self._values = {key if isinstance(key, tuple) else (key,): v for key, v in values.items()}
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (not cumulative), sum and count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(key, ([*state[0]], state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = (),
+                read: Optional[Callable[[], object]] = None) -> Counter:
+        return self._register(Counter(self.prefix + name, help_text, labels, read))
+
+    def gauge(self, name: str, help_text: str, labels: Iterable[str] = (),
+              read: Optional[Callable[[], object]] = None) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help_text, labels, read))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# Encoding time and size of the responses rendered for the current request
+_response_timings: contextvars.ContextVar = contextvars.ContextVar("response_timings", default=None)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records how long encoding its body took"""
+
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        body = super().render(content)
+        timings = _response_timings.get()
+        if timings is not None:
+            timings["render_seconds"] += time.perf_counter() - started
+            timings["bytes"] += len(body)
+        return body
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing HTTP requests by method, route template and status"""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.requests = registry.counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+        self.latency = registry.histogram("http_request_duration_seconds", "HTTP request latency",
+                                          ("method", "route"))
+        self.render_seconds = registry.counter("http_response_render_seconds_total",
+                                               "Time spent encoding JSON responses", ("route",))
+        self.response_bytes = registry.counter("http_response_bytes_total", "Bytes of JSON responses", ("route",))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        timings = {"render_seconds": 0.0, "bytes": 0}
+        token = _response_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _response_timings.reset(token)
+            # The router records the matched route in the scope; template paths keep the label set small
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            self.requests.inc(method=method, route=route, status=status["code"])
+            self.latency.observe(elapsed, method=method, route=route)
+            if timings["bytes"]:
+                self.render_seconds.inc(timings["render_seconds"], route=route)
+                self.response_bytes.inc(timings["bytes"], route=route)
@@ -0,0 +1,709 @@
+"""Parsing of OST files into email messages.
+
+Everything that reads a mailbox with pypff lives here: the EmailMessage
+model, the serial and parallel traversals, per-message extraction (headers,
+body, HTML conversion, attachments, duplicate fingerprints, thread ids) and
+the folder snapshots used for incremental re-ingest.
+
+Importing this module has no side effects - it opens no index, starts no
+threads or processes and prints nothing - so parse worker processes (the
+server's parallel parser and batch_index) import it rather than the server.
+Attachments are streamed into ``attachment_store`` when one is set with
+``use_attachment_store``; worker processes are given its directory.
+"""
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+from pydantic import BaseModel
+
+from attachment_store import AttachmentStore
+from conversations import conversation_index_from_headers, thread_id_of
+from date_index import parse_email_date
+from dedup import SimHasher, content_hash, copy_id, email_identity, message_id_from_headers
+from html_to_text import html_to_text
+from ingest_jobs import JobCancelled
+from message_store import MessageStore
+
+PYPFF_AVAILABLE = False
+try:
+    import pypff
+    PYPFF_AVAILABLE = True
+except ImportError:
+    pypff = None
+
+# Where attachment data is streamed while parsing (None: only attachment names are read)
+attachment_store: Optional[AttachmentStore] = None
+
+
+def use_attachment_store(store: Optional[AttachmentStore]):
+    """Stream the attachments of parsed messages into a store (None to only read their names)"""
+    global attachment_store
+    attachment_store = store
+
+
+class EmailMessage(BaseModel):
+    subject: Optional[str] = None
+    sender_name: Optional[str] = None
+    sender_email: Optional[str] = None
+    recipients: Optional[str] = None
+    date: Optional[str] = None
+    body: Optional[str] = None
+    has_attachments: bool = False
+    attachment_count: int = 0
+    attachment_names: List[str] = []
+    # Attachment store digests, aligned with attachment_names ("" where not stored)
+    attachment_digests: List[str] = []
+    email_id: Optional[str] = None
+    # Where the message lives in the OST file: sub-folder indices from the root
+    # ("2/0/5") and its index within that folder. Used to decode the body on
+    # demand when the mailbox was ingested without bodies (body is None).
+    folder_path: Optional[str] = None
+    message_index: Optional[int] = None
+    # pypff identifier of the message, which survives changes elsewhere in the
+    # file; matches messages across scans for incremental re-ingest
+    message_identifier: Optional[int] = None
+    # Conversation the message belongs to (see conversations.thread_id_of)
+    thread_id: Optional[str] = None
+    # Duplicate-detection fingerprints: equal for exact copies, a few bits
+    # apart for near copies (see dedup)
+    content_hash: Optional[str] = None
+    simhash: Optional[str] = None
+
+
+def new_message_store() -> MessageStore:
+    """An empty columnar store whose messages materialize as EmailMessage"""
+    return MessageStore(EmailMessage)
+
+
+# Stages of an ingest, timed separately for the profile report and /api/metrics:
+# getting folders and message objects from pypff, reading headers, enumerating
+# (and, when enabled, storing) attachments, reading bodies, converting HTML bodies to text, computing the
+# duplicate-detection fingerprints, appending to the message store and writing the index.
+INGEST_STAGES = ("traversal", "metadata", "attachments", "body", "html", "fingerprint", "store", "index")
+
+# Skipped messages logged as warnings per traversal; further ones only at debug level
+MAX_LOGGED_SKIPS = 5
+
+
+class IngestProgress:
+    """Counters updated while a mailbox is traversed"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.folders_visited = 0
+        self.folders_failed = 0
+        self.messages_parsed = 0
+        self.messages_skipped = 0
+        # Text extracted (subjects and bodies), as a measure of decoding throughput
+        self.bytes_extracted = 0
+        # Body bytes as read from the file, before HTML conversion
+        self.body_bytes = 0
+        # Attachments read into the attachment store: new blobs, copies of stored ones, failures
+        self.attachments_stored = 0
+        self.attachments_deduplicated = 0
+        self.attachment_bytes_stored = 0
+        self.attachment_errors = 0
+        # Seconds spent in each of INGEST_STAGES (with parse workers, summed over the workers)
+        self.stage_seconds = dict.fromkeys(INGEST_STAGES, 0.0)
+        self.skipped_by_reason = {}
+
+    COUNTERS = ("folders_visited", "folders_failed", "messages_parsed", "messages_skipped", "bytes_extracted",
+                "body_bytes", "attachments_stored", "attachments_deduplicated", "attachment_bytes_stored",
+                "attachment_errors")
+
+    def counters(self) -> dict:
+        counters = {name: getattr(self, name) for name in self.COUNTERS}
+        counters["stage_seconds"] = dict(self.stage_seconds)
+        counters["skipped_by_reason"] = dict(self.skipped_by_reason)
+        return counters
+
+    def add(self, counters: dict):
+        """Add counters reported by another traversal (e.g. a parse worker)"""
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + counters.get(name, 0))
+        for stage, seconds in counters.get("stage_seconds", {}).items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        for reason, count in counters.get("skipped_by_reason", {}).items():
+            self.skipped_by_reason[reason] = self.skipped_by_reason.get(reason, 0) + count
+
+    def reset(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.stage_seconds = dict.fromkeys(INGEST_STAGES, 0.0)
+        self.skipped_by_reason = {}
+
+    def skip(self, error: Exception):
+        """Count a message that could not be parsed, by the kind of error"""
+        reason = "attachment" if "attachment" in str(error).lower() else type(error).__name__
+        self.messages_skipped += 1
+        self.skipped_by_reason[reason] = self.skipped_by_reason.get(reason, 0) + 1
+        if self.messages_skipped <= MAX_LOGGED_SKIPS:
+            logging.warning(f"Skipping message ({reason}): {str(error)}")
+        else:
+            logging.debug(f"Skipping message ({reason}): {str(error)}")
+
+    def profile(self) -> dict:
+        """Where the ingest's time went, stage by stage, with its counters"""
+        snapshot = self.snapshot()
+        staged = sum(self.stage_seconds.values())
+        snapshot.update({
+            "folders_failed": self.folders_failed,
+            "body_bytes": self.body_bytes,
+            "skipped_by_reason": dict(self.skipped_by_reason),
+            "attachments": {
+                "stored": self.attachments_stored,
+                "deduplicated": self.attachments_deduplicated,
+                "bytes_stored": self.attachment_bytes_stored,
+                "errors": self.attachment_errors,
+            },
+            "stages": {
+                stage: {
+                    "seconds": round(seconds, 4),
+                    "share": round(seconds / staged, 4) if staged else 0.0,
+                }
+                for stage, seconds in self.stage_seconds.items()
+            },
+        })
+        return snapshot
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return {
+            "folders_visited": self.folders_visited,
+            "messages_parsed": self.messages_parsed,
+            "messages_skipped": self.messages_skipped,
+            "bytes_extracted": self.bytes_extracted,
+            "elapsed_seconds": round(elapsed, 3),
+            "messages_per_second": round(self.messages_parsed / elapsed, 1),
+            "bytes_per_second": round(self.bytes_extracted / elapsed, 1),
+        }
+
+
+def iter_ost_file(file_path: str, progress: Optional[IngestProgress] = None,
+                  workers: Optional[int] = None, include_body: bool = True) -> Iterator[EmailMessage]:
+    """Yield the email messages of an OST file as they are parsed.
+
+    With more than one worker (see resolve_parse_workers) folder subtrees are
+    parsed in a process pool; messages still come out in the serial order.
+    If the pool cannot be used, parsing falls back to the serial path.
+    Without ``include_body`` only metadata is extracted (see load_email_body).
+    """
+    if not PYPFF_AVAILABLE:
+        # Don't fallback silently - raise error
+        raise Exception("pypff library is not installed. Cannot parse OST files.")
+    
+    if progress is None:
+        progress = IngestProgress()
+    
+    workers = resolve_parse_workers(workers)
+    if workers > 1:
+        yielded = False
+        try:
+            for email in iter_ost_file_parallel(file_path, workers, progress, include_body):
+                yielded = True
+                yield email
+            return
+        except Exception as e:
+            if yielded:
+                raise
+            logging.warning(f"Parallel parsing failed, falling back to serial parsing: {str(e)}")
+            progress.reset()
+    
+    pst = pypff.file()
+    pst.open(file_path)
+    try:
+        root = pst.get_root_folder()
+        yield from iter_folder_messages(root, progress, include_body=include_body)
+    finally:
+        pst.close()
+
+
+def parse_ost_file(file_path: str, progress: Optional[IngestProgress] = None,
+                   check_cancelled: Optional[Callable[[], None]] = None,
+                   include_body: bool = True) -> MessageStore:
+    """Parse OST file and extract email messages into a columnar store.
+
+    ``check_cancelled`` is called after every message and may raise to stop parsing.
+    """
+    emails = new_message_store()
+    if progress is None:
+        progress = IngestProgress()
+    stage_seconds = progress.stage_seconds
+    clock = time.perf_counter
+
+    try:
+        for email in iter_ost_file(file_path, progress, include_body=include_body):
+            if check_cancelled:
+                check_cancelled()
+            started = clock()
+            emails.append(email)
+            stage_seconds["store"] += clock() - started
+
+        logging.info(f"Successfully parsed {len(emails)} emails from file")
+        if progress.messages_skipped:
+            logging.warning(f"Skipped {progress.messages_skipped} messages that could not be parsed: {progress.skipped_by_reason}")
+
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logging.error(f"Error parsing OST file: {str(e)}")
+        raise Exception(f"Failed to parse OST file: {str(e)}")
+    
+    return emails
+
+
+def snapshot_folders(folder, path: tuple = (), scans: Optional[dict] = None) -> dict:
+    """Record the state of every folder, sub-folders first, by folder key.
+
+    A folder's state is its path, message count and last message (identifier
+    and delivery time). Only one message per folder is opened, so this is
+    cheap next to parsing. The key is the folder's pypff identifier, which
+    stays the same when folders are added or removed around it.
+    """
+    if scans is None:
+        scans = {}
+    for index in range(folder.number_of_sub_folders):
+        snapshot_folders(folder.get_sub_folder(index), path + (index,), scans)
+
+    folder_path = "/".join(str(index) for index in path)
+    message_count = folder.number_of_sub_messages
+    last_identifier = None
+    last_delivery_epoch = None
+    if message_count:
+        last_message = folder.get_sub_message(message_count - 1)
+        last_identifier = getattr(last_message, 'identifier', None)
+        delivery_time = getattr(last_message, 'delivery_time', None)
+        last_delivery_epoch = parse_email_date(str(delivery_time)) if delivery_time else None
+
+    identifier = getattr(folder, 'identifier', None)
+    key = str(identifier) if identifier is not None else "path:" + folder_path
+    scans[key] = {
+        "folder_path": folder_path,
+        "message_count": message_count,
+        "last_identifier": last_identifier,
+        "last_delivery_epoch": last_delivery_epoch,
+    }
+    return scans
+
+
+def snapshot_ost_folders(file_path: str) -> Optional[dict]:
+    """Folder states of an OST file, or None if they cannot be read"""
+    try:
+        pst = pypff.file()
+        pst.open(file_path)
+        try:
+            return snapshot_folders(pst.get_root_folder())
+        finally:
+            pst.close()
+    except Exception as e:
+        logging.warning(f"Could not record folder states of {file_path}, it will be fully reparsed when it changes: {str(e)}")
+        return None
+
+
+def folder_changed(previous: Optional[dict], current: dict) -> bool:
+    return previous is None or any(
+        previous[field] != current[field] for field in ("message_count", "last_identifier", "last_delivery_epoch")
+    )
+
+
+# Ingests between their first attachment read and the commit of their emails.
+# The blobs they stored or found already stored have no references until
+# then, so blobs are only pruned, under this lock, while none is in flight.
+
+
+def parse_folder(folder, store: Optional[MessageStore] = None) -> MessageStore:
+    """Recursively parse folder and append its messages to a message store"""
+    if store is None:
+        store = new_message_store()
+    for email in iter_folder_messages(folder):
+        store.append(email)
+    return store
+
+
+def iter_folder_messages(folder, progress: Optional[IngestProgress] = None, path: tuple = (),
+                         include_body: bool = True) -> Iterator[EmailMessage]:
+    """Recursively yield the messages of a folder, sub-folders first.
+
+    Messages are produced one at a time, so callers can stream them out
+    without holding intermediate lists for every folder level. ``path`` is
+    the folder's sub-folder indices from the root, recorded on each message.
+    """
+    if progress is None:
+        progress = IngestProgress()
+    progress.folders_visited += 1
+
+    try:
+        # Parse sub-folders
+        for index, sub_folder in enumerate(timed_iter(folder.sub_folders, progress)):
+            yield from iter_folder_messages(sub_folder, progress, path + (index,), include_body)
+
+        # Parse messages in current folder
+        yield from iter_own_messages(folder, progress, path, include_body)
+
+    except Exception as e:
+        progress.folders_failed += 1
+        logging.error(f"Error parsing folder: {str(e)}")
+
+
+def timed_iter(iterable, progress: IngestProgress, stage: str = "traversal") -> Iterator:
+    """Iterate, adding the time taken to produce each item (e.g. by pypff) to an ingest stage"""
+    iterator = iter(iterable)
+    stage_seconds = progress.stage_seconds
+    clock = time.perf_counter
+    while True:
+        started = clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stage_seconds[stage] += clock() - started
+            return
+        stage_seconds[stage] += clock() - started
+        yield item
+
+
+def iter_own_messages(folder, progress: IngestProgress, path: tuple = (),
+                      include_body: bool = True) -> Iterator[EmailMessage]:
+    """Yield the messages directly in a folder (not in its sub-folders)"""
+    folder_path = "/".join(str(index) for index in path)
+    for message_index, message in enumerate(timed_iter(folder.sub_messages, progress)):
+        try:
+            email_msg = parse_message(message, include_body, progress)
+            email_msg.folder_path = folder_path
+            email_msg.message_index = message_index
+        except Exception as e:
+            progress.skip(e)
+            continue
+        
+        progress.messages_parsed += 1
+        progress.bytes_extracted += len(email_msg.body or "") + len(email_msg.subject or "")
+        yield email_msg
+
+
+def parse_message(message, include_body: bool = True, progress: Optional[IngestProgress] = None) -> EmailMessage:
+    """Extract one pypff message into an EmailMessage (body is None without ``include_body``).
+
+    With ``progress``, the time spent on each part is added to its ingest stages.
+    """
+    clock = time.perf_counter
+    started = clock()
+    
+    # Get attachment count and names (and data, when the attachment store is enabled)
+    attachments_started = clock()
+    attachment_count = 0
+    has_attachments = False
+    attachment_names = []
+    attachment_digests = []
+    
+    try:
+        if hasattr(message, 'number_of_attachments'):
+            attachment_count = message.number_of_attachments
+            has_attachments = attachment_count > 0
+            
+            for i in range(attachment_count):
+                try:
+                    attachment = message.get_attachment(i)
+                    if hasattr(attachment, 'name') and attachment.name:
+                        attachment_names.append(attachment.name)
+                    elif attachment_store is not None:
+                        # Keep the names aligned with the digests
+                        attachment_names.append(f"attachment-{i + 1}")
+                    else:
+                        continue
+                    if attachment_store is not None:
+                        attachment_digests.append(store_attachment(attachment, progress))
+                except:
+                    # Skip problematic attachments silently
+                    pass
+                
+    except:
+        # If we can't get attachments, just continue without them
+        pass
+    
+    # Extract email body, unless it is to be decoded on demand
+    body_started = clock()
+    body_text = extract_body_text(message, progress) if include_body else None
+    body_finished = clock()
+    
+    # Get email date - the client_submit_time is already in local timezone
+    email_date = None
+    if hasattr(message, 'client_submit_time') and message.client_submit_time:
+        email_date = str(message.client_submit_time)
+    
+    subject = message.subject if hasattr(message, 'subject') and message.subject else "(No Subject)"
+    sender_name = message.sender_name if hasattr(message, 'sender_name') and message.sender_name else "Unknown"
+    sender_email = message.sender_email_address if hasattr(message, 'sender_email_address') and message.sender_email_address else ""
+    recipients = message.display_to if hasattr(message, 'display_to') and message.display_to else ""
+    transport_headers = None
+    try:
+        transport_headers = getattr(message, 'transport_headers', None)
+    except Exception as e:
+        logging.debug(f"Error reading transport headers: {str(e)}")
+    
+    # Copies of a message share its identity, but each has an id of its own (see dedup)
+    identity = email_identity(message_id_from_headers(transport_headers), subject, email_date, sender_email, recipients)
+    message_identifier = getattr(message, 'identifier', None)
+    fingerprint_started = clock()
+    fingerprints = fingerprint_fields(identity, body_text if include_body else None)
+    fingerprint_finished = clock()
+    
+    email_msg = EmailMessage(
+        email_id=copy_id(identity, message_identifier),
+        message_identifier=message_identifier,
+        subject=subject,
+        sender_name=sender_name,
+        sender_email=sender_email,
+        recipients=recipients,
+        date=email_date,
+        body=(body_text or "") if include_body else None,
+        has_attachments=has_attachments,
+        attachment_count=attachment_count,
+        attachment_names=attachment_names,
+        attachment_digests=attachment_digests,
+        thread_id=message_thread_id(message, transport_headers, subject, sender_name, sender_email, recipients),
+        **fingerprints,
+    )
+
+    if progress is not None:
+        stage_seconds = progress.stage_seconds
+        stage_seconds["attachments"] += body_started - attachments_started
+        # HTML conversion is timed (as its own stage) inside extract_body_text
+        stage_seconds["body"] += body_finished - body_started
+        stage_seconds["fingerprint"] += fingerprint_finished - fingerprint_started
+        stage_seconds["metadata"] += ((attachments_started - started) + (fingerprint_started - body_finished)
+                                      + (clock() - fingerprint_finished))
+    return email_msg
+
+
+# SimHashes of the bodies parsed by this process (parse workers have their own)
+simhasher = SimHasher()
+
+
+def fingerprint_fields(identity: str, body: Optional[str]) -> dict:
+    """content_hash and simhash of an email (from its identity alone when the body was not extracted)"""
+    simhash = simhasher.simhash(body) if body is not None else 0
+    return {
+        "content_hash": format(content_hash(identity, body), "016x"),
+        "simhash": format(simhash, "016x") if simhash else None,
+    }
+
+
+def message_thread_id(message, transport_headers: Optional[str], subject: str, sender_name: str,
+                      sender_email: str, recipients: str) -> str:
+    """Thread id of a pypff message, from its conversation index when it has one (see conversations)"""
+    conversation_index = None
+    topic = None
+    try:
+        conversation_index = getattr(message, 'conversation_index', None)
+        if not conversation_index and transport_headers:
+            conversation_index = conversation_index_from_headers(transport_headers)
+        topic = getattr(message, 'conversation_topic', None)
+    except Exception as e:
+        logging.debug(f"Error reading conversation properties: {str(e)}")
+    return thread_id_of(conversation_index, topic, subject, sender_name, sender_email, recipients)
+
+
+def store_attachment(attachment, progress: Optional[IngestProgress] = None) -> str:
+    """Stream a pypff attachment into the attachment store, returning its digest ("" on failure)"""
+    try:
+        digest, size, written = attachment_store.put_attachment(attachment)
+    except Exception as e:
+        logging.debug(f"Error storing attachment: {str(e)}")
+        if progress is not None:
+            progress.attachment_errors += 1
+        return ""
+    if progress is not None:
+        if written:
+            progress.attachments_stored += 1
+            progress.attachment_bytes_stored += size
+        else:
+            progress.attachments_deduplicated += 1
+    return digest
+
+
+def extract_body_text(message, progress: Optional[IngestProgress] = None) -> str:
+    """Extract the body of a pypff message as text.
+
+    With ``progress``, the body size is counted and the HTML conversion time
+    is moved from the body stage to its own.
+    """
+    # Extract email body - try multiple formats
+    body_text = ""
+
+    # Try plain text first
+    if hasattr(message, 'plain_text_body') and message.plain_text_body:
+        body_text = message.plain_text_body
+        if progress is not None:
+            progress.body_bytes += len(body_text)
+        if isinstance(body_text, bytes):
+            body_text = body_text.decode('utf-8', errors='ignore')
+    # Try HTML body
+    elif hasattr(message, 'html_body') and message.html_body:
+        try:
+            # HTML body is bytes, need to decode
+            html_body = message.html_body
+            if isinstance(html_body, bytes):
+                body_text = html_body.decode('utf-8', errors='ignore')
+            else:
+                body_text = str(html_body)
+
+            started = time.perf_counter()
+            body_text = html_to_text(body_text)
+            if progress is not None:
+                elapsed = time.perf_counter() - started
+                progress.stage_seconds["html"] += elapsed
+                progress.stage_seconds["body"] -= elapsed
+                progress.body_bytes += len(html_body)
+
+        except Exception as e:
+            logging.debug(f"Error extracting HTML body: {str(e)}")
+    # Try RTF body as last resort
+    elif hasattr(message, 'rtf_body') and message.rtf_body:
+        body_text = "[RTF content - preview not available]"
+    
+    return body_text
+
+
+# Parallel parsing: folder subtrees are split into units and parsed in a process pool.
+# Mailboxes smaller than this are not worth the cost of starting the workers.
+PARALLEL_MIN_MESSAGES = 2000
+# Units planned per worker, so a large subtree does not leave the other workers idle
+PARSE_UNITS_PER_WORKER = 4
+
+
+def resolve_parse_workers(workers: Optional[int] = None) -> int:
+    """Number of parse worker processes: the argument, else OST_PARSE_WORKERS ('auto' = one per CPU).
+
+    1 (the default) keeps the serial parser.
+    """
+    if workers is None:
+        setting = os.environ.get('OST_PARSE_WORKERS', '1').strip().lower()
+        if setting == 'auto':
+            workers = os.cpu_count() or 1
+        else:
+            try:
+                workers = int(setting)
+            except ValueError:
+                logging.warning(f"Invalid OST_PARSE_WORKERS value {setting!r}, parsing serially")
+                workers = 1
+    return max(1, workers)
+
+
+def scan_folder_tree(folder, path: tuple = (), tree: Optional[dict] = None) -> dict:
+    """Map each folder path (sub-folder indices from the root) to
+    (own message count, subtree message count, number of sub-folders).
+
+    Only folder metadata is read, so this is cheap next to parsing messages.
+    """
+    if tree is None:
+        tree = {}
+    own = 0
+    subtree = 0
+    sub_folder_count = 0
+    try:
+        own = folder.number_of_sub_messages
+        sub_folder_count = folder.number_of_sub_folders
+        for index in range(sub_folder_count):
+            scan_folder_tree(folder.get_sub_folder(index), path + (index,), tree)
+            subtree += tree[path + (index,)][1]
+    except Exception as e:
+        logging.error(f"Error scanning folder: {str(e)}")
+    tree[path] = (own, own + subtree, sub_folder_count)
+    return tree
+
+
+def plan_parse_units(tree: dict, target_units: int) -> List[tuple]:
+    """Split the folder tree into ("subtree", path) / ("messages", path) units.
+
+    The largest subtree is repeatedly replaced by its sub-folder subtrees
+    followed by its own messages, which keeps the units in the same order as
+    the serial traversal, until there are enough units to balance the workers.
+    """
+    units = [("subtree", ())]
+    while len(units) < target_units:
+        candidates = [
+            (tree[path][1], i) for i, (kind, path) in enumerate(units)
+            if kind == "subtree" and tree[path][2] > 0
+        ]
+        if not candidates:
+            break
+        _, i = max(candidates)
+        path = units[i][1]
+        own, _subtree, sub_folder_count = tree[path]
+        expanded = [("subtree", path + (index,)) for index in range(sub_folder_count)]
+        # The folder itself is visited by its messages unit
+        expanded.append(("messages", path))
+        units[i:i + 1] = expanded
+    return units
+
+
+# pypff handle opened once per worker process
+_worker_pst = None
+
+
+_worker_include_body = True
+
+
+def _init_parse_worker(file_path: str, include_body: bool, attachment_dir: Optional[str] = None):
+    global _worker_pst, _worker_include_body
+    _worker_pst = pypff.file()
+    _worker_pst.open(file_path)
+    _worker_include_body = include_body
+    if attachment_dir is not None:
+        use_attachment_store(AttachmentStore(attachment_dir))
+
+
+def _parse_unit_worker(unit: tuple) -> tuple:
+    kind, path = unit
+    folder = _worker_pst.get_root_folder()
+    for index in path:
+        folder = folder.get_sub_folder(index)
+    
+    progress = IngestProgress()
+    if kind == "subtree":
+        emails = list(iter_folder_messages(folder, progress, path, _worker_include_body))
+    else:
+        progress.folders_visited += 1
+        emails = list(iter_own_messages(folder, progress, path, _worker_include_body))
+    return emails, progress.counters()
+
+
+def iter_ost_file_parallel(file_path: str, workers: int, progress: IngestProgress,
+                           include_body: bool = True) -> Iterator[EmailMessage]:
+    """Parse folder subtrees in a process pool, yielding messages in serial order.
+
+    Each worker opens its own pypff handle on the file. Results are merged in
+    unit order, so the output does not depend on which worker finishes first.
+    """
+    pst = pypff.file()
+    pst.open(file_path)
+    try:
+        tree = scan_folder_tree(pst.get_root_folder())
+        total = tree[()][1]
+        if total < PARALLEL_MIN_MESSAGES:
+            yield from iter_folder_messages(pst.get_root_folder(), progress, include_body=include_body)
+            return
+    finally:
+        pst.close()
+    
+    units = plan_parse_units(tree, workers * PARSE_UNITS_PER_WORKER)
+    logging.info(f"Parsing {total} messages in {len(units)} units with {workers} worker processes")
+    
+    # spawn (not fork) so workers never inherit the server's threads and locks
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_parse_worker,
+        initargs=(file_path, include_body, str(attachment_store.root) if attachment_store is not None else None),
+    )
+    try:
+        futures = [pool.submit(_parse_unit_worker, unit) for unit in units]
+        for future in futures:
+            emails, counters = future.result()
+            progress.add(counters)
+            yield from emails
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
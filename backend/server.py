@@ -1,16 +1,46 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, Header, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Callable, Dict, Iterable, Iterator, List, Literal, Optional
 from datetime import datetime, timezone
 import tempfile
 import shutil
-import re
+import time
+import sqlite3
+import hashlib
+import json
+import base64
+import threading
+import heapq
+import itertools
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+
+from attachment_store import AttachmentStore
+from attachment_text import AttachmentTextExtractor
+from body_cache import LRUCache
+from compression import CompressionMiddleware
+from conversations import ThreadIndex, thread_id_of
+from date_index import DateIndex, parse_email_date
+from dedup import DuplicateFilter, DuplicateIndex, copy_id, email_identity
+from export import EXPORT_FORMATS, PYARROW_AVAILABLE, stream_export
+from facet_index import FacetIndex
+from fast_json import FastJSONResponse, JSONFragments, add_field, encode_json
+from ingest_jobs import JobCancelled, JobManager
+from mailbox_catalog import DEFAULT_SESSION, CatalogEntry, MailboxCatalog, MailboxNotFound
+from mail_index import MailboxChanged, MailIndex, file_fingerprint
+from message_store import MessageStore
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, RequestMetricsMiddleware, TimedJSONResponse
+from ost_parser import (EmailMessage, IngestProgress, extract_body_text, fingerprint_fields, folder_changed,
+                        iter_ost_file, new_message_store, parse_message, parse_ost_file, snapshot_folders,
+                        snapshot_ost_folders, use_attachment_store)
+from text_query import QueryError, parse_query
 
 PYPFF_AVAILABLE = False
 try:
@@ -26,178 +56,641 @@ except ImportError as e:
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-app = FastAPI()
+class APIJSONResponse(TimedJSONResponse, FastJSONResponse):
+    """Fast-encoded JSON response that records its encoding time for the request metrics"""
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Queued ingests and attachment extractions are dropped, running ingests stop at their next check
+    ingest_jobs.shutdown()
+    attachment_extractor.shutdown()
+
+
+app = FastAPI(default_response_class=APIJSONResponse, lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
-class EmailMessage(BaseModel):
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+PREVIEW_LENGTH = 200
+
+
+class EmailSummary(BaseModel):
+    """List view of an email: everything except the body and attachment names"""
+    email_id: Optional[str] = None
     subject: Optional[str] = None
     sender_name: Optional[str] = None
     sender_email: Optional[str] = None
     recipients: Optional[str] = None
     date: Optional[str] = None
-    body: Optional[str] = None
     has_attachments: bool = False
     attachment_count: int = 0
-    attachment_names: List[str] = []
-    email_id: Optional[str] = None
+    thread_id: Optional[str] = None
+    # Equal for exact copies of a message, each of which has its own email_id
+    content_hash: Optional[str] = None
+    preview: str = ""
+    # Handle of the mailbox the email is in, set when several mailboxes are searched
+    handle: Optional[str] = None
+
+    @classmethod
+    def from_email(cls, email: EmailMessage) -> "EmailSummary":
+        body = email.body or ""
+        return cls(
+            email_id=email.email_id,
+            subject=email.subject,
+            sender_name=email.sender_name,
+            sender_email=email.sender_email,
+            recipients=email.recipients,
+            date=email.date,
+            has_attachments=email.has_attachments,
+            attachment_count=email.attachment_count,
+            thread_id=email.thread_id,
+            content_hash=email.content_hash,
+            preview=body[:PREVIEW_LENGTH],
+        )
+
+    @staticmethod
+    def fields_from_store(store: MessageStore, position: int) -> dict:
+        """Summary fields of a stored email (all but handle), without materializing its body"""
+        row = store.row(position, include_body=False)
+        row.pop("body")
+        row.pop("attachment_names")
+        row.pop("attachment_digests")
+        row.pop("folder_path")
+        row.pop("message_index")
+        row.pop("message_identifier")
+        row.pop("simhash")
+        row["preview"] = store.body_preview(position, PREVIEW_LENGTH)
+        return row
 
 
 class SearchRequest(BaseModel):
     start_date: Optional[str] = None
     end_date: Optional[str] = None
+    # Free-text query, e.g. 'budget OR forecast from:john subject:"q4 report" has:attachment'
+    query: Optional[str] = None
+    # Results per page, and the next_cursor returned with the previous page
+    page_size: int = Field(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+    # 'summary' omits body and attachment_names, 'full' returns complete emails
+    projection: Literal["summary", "full"] = "summary"
+    # Mailboxes to search, by the handles returned when they were loaded.
+    # Defaults to the session's most recently loaded mailbox.
+    handles: Optional[List[str]] = None
+    # Return only the best match (or newest) of each conversation, with its
+    # thread_message_count; open the rest through /api/threads/{thread_id}
+    collapse_threads: bool = False
+    # Return one result per set of exact or near-duplicate copies of an email
+    # (across folders and mailboxes), with the duplicate_count it stands for
+    collapse_duplicates: bool = False
+
+
+class ExportRequest(SearchRequest):
+    """The filters of a search (its paging fields are ignored) and the format to export to"""
+    # mbox, a zip of .eml files, CSV or Parquet (which needs pyarrow)
+    format: Literal["mbox", "eml", "csv", "parquet"] = "mbox"
+
+
+DEFAULT_FACET_LIMIT = 20
+MAX_FACET_LIMIT = 1000
+
+
+class FacetRequest(BaseModel):
+    # Same date range as SearchRequest; without one every email is counted
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    # Most frequent values returned per facet
+    limit: int = Field(default=DEFAULT_FACET_LIMIT, ge=1, le=MAX_FACET_LIMIT)
+    # Bucket size of the date histogram
+    interval: Literal["month", "week", "day"] = "month"
+    # Mailboxes to count, by handle. Defaults to the session's most recently loaded mailbox.
+    handles: Optional[List[str]] = None
 
 
 class FilePathRequest(BaseModel):
     file_path: str
+    # Skip body extraction at ingest and decode bodies when emails are opened.
+    # Defaults to OST_METADATA_ONLY. Bodies are then not full-text searchable.
+    metadata_only: Optional[bool] = None
+    # Bring a previously indexed copy of the same path up to date instead of
+    # reparsing the whole file. Defaults to OST_INCREMENTAL.
+    incremental: Optional[bool] = None
+    # Include a per-stage timing report of the ingest in the response
+    profile: bool = False
 
 
-# Store parsed emails in memory (for demo purposes)
-parsed_emails_cache = []
+class LoadedMailbox:
+    """Emails held in memory for searching, with the indexes built over them.
 
+    ``emails`` is a columnar MessageStore; indexing it materializes one
+    EmailMessage, so only the emails a response returns become objects.
+    """
 
-def parse_ost_file(file_path: str) -> List[EmailMessage]:
-    """Parse OST file and extract email messages"""
-    emails = []
-    
-    if not PYPFF_AVAILABLE:
-        # Don't fallback silently - raise error
-        raise Exception("pypff library is not installed. Cannot parse OST files.")
-    
+    def __init__(self, emails, mailbox_id: Optional[int] = None, from_index: bool = False,
+                 source_path: Optional[str] = None, generation: Optional[int] = None):
+        if not isinstance(emails, MessageStore):
+            emails = new_message_store().extend(emails)
+        self.emails: MessageStore = emails
+        # OST file bodies are decoded from when they were not extracted at ingest
+        self.source_path = source_path
+        # Persistent index mailbox id (None if the emails could not be indexed)
+        self.mailbox_id = mailbox_id
+        # Generation of the index rows these emails match (the current one unless given)
+        if generation is None and mailbox_id is not None:
+            generation = mail_index.generation(mailbox_id)
+        self.generation = generation
+        self.from_index = from_index
+        # Dates were normalized to epochs as the emails were stored
+        self.date_index = DateIndex(emails.date_epochs)
+        if self.date_index.undated:
+            logging.warning(f"{len(self.date_index.undated)} of {len(emails)} emails have no parseable date")
+        self._positions_by_id = None
+        self._facets: Optional[FacetIndex] = None
+        self._threads: Optional[ThreadIndex] = None
+        self._duplicates: Optional[DuplicateIndex] = None
+        # What an incremental re-ingest added and removed, when it was loaded that way
+        self.changes: Optional[dict] = None
+
+    def position_of(self, email_id: str) -> Optional[int]:
+        """Position of the email with the given id (built on first use)"""
+        if self._positions_by_id is None:
+            positions = {}
+            email_ids = self.emails.email_ids
+            for position in range(len(email_ids)):
+                stored_id = email_ids[position]
+                if stored_id and stored_id not in positions:
+                    positions[stored_id] = position
+            self._positions_by_id = positions
+        return self._positions_by_id.get(email_id)
+
+    def facets(self) -> FacetIndex:
+        """Per-field counts for /facets (built on first use)"""
+        if self._facets is None:
+            self._facets = FacetIndex(self.emails, self.date_index)
+        return self._facets
+
+    def threads(self) -> ThreadIndex:
+        """Messages grouped by conversation (built on first use)"""
+        if self._threads is None:
+            self._threads = ThreadIndex(self.emails)
+        return self._threads
+
+    def duplicates(self) -> DuplicateIndex:
+        """Groups of exact and near-duplicate emails (built on first use)"""
+        if self._duplicates is None:
+            self._duplicates = DuplicateIndex(self.emails)
+        return self._duplicates
+
+
+# Date index entries per email: its epoch twice and its position
+DATE_INDEX_BYTES_PER_EMAIL = 20
+
+
+# Reserved for the facet index of a mailbox, which is built on its first /facets request
+FACET_INDEX_BYTES_PER_EMAIL = 24
+
+
+# Reserved for the thread index, built on the first thread request or collapsed search
+THREAD_INDEX_BYTES_PER_EMAIL = 60
+
+
+# Reserved for the duplicate index, built on the first search collapsing duplicates
+DUPLICATE_INDEX_BYTES_PER_EMAIL = 12
+
+
+def estimate_mailbox_bytes(mailbox: LoadedMailbox) -> int:
+    """Approximate memory held by a loaded mailbox, for the catalog's budget"""
+    per_email = (DATE_INDEX_BYTES_PER_EMAIL + FACET_INDEX_BYTES_PER_EMAIL + THREAD_INDEX_BYTES_PER_EMAIL
+                 + DUPLICATE_INDEX_BYTES_PER_EMAIL)
+    return mailbox.emails.nbytes() + per_email * len(mailbox.emails)
+
+
+# Loaded mailboxes by handle and session, evicted least recently used first once
+# they take more than OST_MEMORY_BUDGET_MB. Evicted mailboxes are reloaded from
+# the index on their next use (OST_CATALOG_SPILL=0 forgets them instead).
+mailbox_catalog = MailboxCatalog(
+    max_bytes=int(os.environ.get('OST_MEMORY_BUDGET_MB', '1024')) * 1024 * 1024,
+    spill=os.environ.get('OST_CATALOG_SPILL', '1').strip().lower() in ('1', 'true', 'yes'),
+    size_of=estimate_mailbox_bytes,
+)
+
+# Persistent index of parsed mailboxes, so reopening a file skips the reparse
+mail_index = MailIndex(os.environ.get('OST_INDEX_PATH', str(ROOT_DIR / 'ost_index.sqlite3')))
+
+# Bodies decoded on demand for mailboxes ingested without them
+body_cache = LRUCache(max_bytes=int(os.environ.get('OST_BODY_CACHE_MB', '64')) * 1024 * 1024)
+
+# Emails serialized for responses, by (store key, position, projection). Each
+# email is encoded once, the first time a page shows it; later pages are
+# assembled from these bytes.
+json_fragments = LRUCache(max_bytes=int(os.environ.get('OST_JSON_CACHE_MB', '64')) * 1024 * 1024)
+
+# Attachment data, stored once per distinct content under OST_ATTACHMENT_DIR
+# when OST_EXTRACT_ATTACHMENTS is on (off by default: ingest then reads every
+# attachment). Their text is extracted by OST_ATTACHMENT_WORKERS processes
+# after the mailbox is indexed, and becomes searchable as it arrives.
+ATTACHMENTS_ENABLED = os.environ.get('OST_EXTRACT_ATTACHMENTS', '0').strip().lower() in ('1', 'true', 'yes')
+attachment_store = (AttachmentStore(os.environ.get('OST_ATTACHMENT_DIR', str(ROOT_DIR / 'attachments')))
+                    if ATTACHMENTS_ENABLED else None)
+use_attachment_store(attachment_store)
+
+
+def _save_attachment_text(digest: str, status: str, text: Optional[str]):
+    mail_index.set_attachment_text(digest, status, text)
+    attachment_texts.inc(status=status)
+
+
+attachment_extractor = AttachmentTextExtractor(
+    workers=int(os.environ.get('OST_ATTACHMENT_WORKERS', '2')),
+    on_result=_save_attachment_text,
+)
+
+# Background ingest jobs, at most OST_INGEST_WORKERS parsing at once
+ingest_jobs = JobManager(max_workers=int(os.environ.get('OST_INGEST_WORKERS', '2')))
+
+# Process-wide metrics, served on /api/metrics. Per-route request counts and
+# latencies are added by RequestMetricsMiddleware.
+metrics = MetricsRegistry(prefix="ost_")
+ingests_total = metrics.counter("ingests_total", "Mailbox loads, by how they were served (parse, incremental, index)",
+                                ("mode",))
+ingest_duration = metrics.histogram("ingest_duration_seconds", "Wall time of mailbox loads", ("mode",))
+ingest_messages = metrics.counter("ingest_messages_total", "Messages parsed from OST files")
+ingest_skipped = metrics.counter("ingest_skipped_messages_total", "Messages that could not be parsed, by reason",
+                                 ("reason",))
+ingest_stage_seconds = metrics.counter("ingest_stage_seconds_total",
+                                       "Time spent in each ingest stage (summed over parse workers)", ("stage",))
+ingest_body_bytes = metrics.counter("ingest_body_bytes_total", "Body bytes read from OST files, before HTML conversion")
+ingest_text_bytes = metrics.counter("ingest_text_bytes_total", "Subject and body text extracted")
+ingest_folders = metrics.counter("ingest_folders_total", "Folders traversed, by outcome", ("outcome",))
+ingest_rate = metrics.gauge("ingest_last_messages_per_second", "Parse throughput of the latest ingest that parsed messages")
+index_write_errors = metrics.counter("index_write_errors_total", "Failed writes to the mail index")
+ingest_attachments = metrics.counter("ingest_attachments_total",
+                                     "Attachments read into the attachment store, by outcome (stored, duplicate, failed)",
+                                     ("outcome",))
+ingest_attachment_bytes = metrics.counter("ingest_attachment_bytes_total", "Attachment bytes written to the attachment store")
+exported_emails = metrics.counter("exported_emails_total", "Emails written by exports, by format", ("format",))
+attachment_texts = metrics.counter("attachment_texts_total", "Attachments whose text extraction finished, by status",
+                                   ("status",))
+metrics.gauge("attachment_texts_queued", "Attachments waiting for text extraction",
+              read=lambda: attachment_extractor.queued)
+metrics.gauge("ingest_jobs", "Ingest jobs known to the server, by state", ("state",),
+              read=lambda: _count_jobs_by_state())
+metrics.gauge("body_cache_bytes", "Bytes of bodies in the on-demand body cache", read=lambda: body_cache.current_bytes)
+metrics.gauge("body_cache_peak_bytes", "Largest size the body cache reached", read=lambda: body_cache.peak_bytes)
+metrics.gauge("body_cache_max_bytes", "Capacity of the body cache", read=lambda: body_cache.max_bytes)
+metrics.gauge("body_cache_entries", "Bodies in the body cache", read=lambda: len(body_cache))
+metrics.counter("body_cache_hits_total", "Body cache hits", read=lambda: body_cache.hits)
+metrics.counter("body_cache_misses_total", "Body cache misses", read=lambda: body_cache.misses)
+metrics.counter("body_cache_evictions_total", "Bodies evicted from the body cache", read=lambda: body_cache.evictions)
+metrics.gauge("json_cache_bytes", "Bytes of serialized emails cached for responses",
+              read=lambda: json_fragments.current_bytes)
+metrics.counter("json_cache_hits_total", "Emails served from the serialized email cache",
+                read=lambda: json_fragments.hits)
+metrics.counter("json_cache_misses_total", "Emails serialized for a response", read=lambda: json_fragments.misses)
+metrics.gauge("catalog_mailboxes", "Mailboxes in the catalog", read=lambda: mailbox_catalog.stats()["mailboxes"])
+metrics.gauge("catalog_resident_mailboxes", "Mailboxes held in memory",
+              read=lambda: mailbox_catalog.stats()["resident_mailboxes"])
+metrics.gauge("catalog_resident_bytes", "Estimated memory held by resident mailboxes",
+              read=lambda: mailbox_catalog.resident_bytes)
+metrics.gauge("catalog_max_bytes", "Memory budget of the mailbox catalog", read=lambda: mailbox_catalog.max_bytes)
+metrics.counter("catalog_evictions_total", "Mailboxes evicted from memory", read=lambda: mailbox_catalog.evictions)
+metrics.counter("catalog_reloads_total", "Evicted mailboxes reloaded from the index",
+                read=lambda: mailbox_catalog.reloads)
+
+
+def _count_jobs_by_state() -> dict:
+    counts = {}
+    for job in ingest_jobs.list():
+        counts[job.state] = counts.get(job.state, 0) + 1
+    return counts
+
+
+def record_ingest(progress: "IngestProgress", mode: str):
+    """Add a finished ingest to the metrics and log its stage profile"""
+    elapsed = time.monotonic() - progress.started_at
+    ingests_total.inc(mode=mode)
+    ingest_duration.observe(elapsed, mode=mode)
+    ingest_messages.inc(progress.messages_parsed)
+    for reason, count in progress.skipped_by_reason.items():
+        ingest_skipped.inc(count, reason=reason)
+    for stage, seconds in progress.stage_seconds.items():
+        ingest_stage_seconds.inc(seconds, stage=stage)
+    ingest_body_bytes.inc(progress.body_bytes)
+    ingest_attachments.inc(progress.attachments_stored, outcome="stored")
+    ingest_attachments.inc(progress.attachments_deduplicated, outcome="duplicate")
+    ingest_attachments.inc(progress.attachment_errors, outcome="failed")
+    ingest_attachment_bytes.inc(progress.attachment_bytes_stored)
+    ingest_text_bytes.inc(progress.bytes_extracted)
+    ingest_folders.inc(progress.folders_visited - progress.folders_failed, outcome="ok")
+    ingest_folders.inc(progress.folders_failed, outcome="failed")
+    if progress.messages_parsed:
+        ingest_rate.set(progress.messages_parsed / max(elapsed, 1e-6))
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in progress.stage_seconds.items())
+        logging.info(f"Ingest profile ({mode}): {progress.messages_parsed} messages, "
+                     f"{progress.messages_skipped} skipped in {elapsed:.2f}s - {stages}")
+
+
+def load_or_parse_ost_file(file_path: str, fingerprint: str, source_path: Optional[str] = None,
+                           progress: Optional[IngestProgress] = None,
+                           check_cancelled: Optional[Callable[[], None]] = None,
+                           metadata_only: bool = False, incremental: bool = False) -> LoadedMailbox:
+    """Load emails from the persistent index, parsing the file only on a miss.
+
+    A mailbox indexed without bodies is reparsed when bodies are wanted. With
+    ``incremental``, a file that changed since it was last indexed from the
+    same path is brought up to date by refresh_indexed_mailbox instead.
+    The ingest is recorded in the metrics under progress (created if not given).
+    """
+    if progress is None:
+        progress = IngestProgress()
+    mailbox = mail_index.find_mailbox(fingerprint)
+    if mailbox and (metadata_only or not mailbox['metadata_only']):
+        logging.info(f"Loading {mailbox['email_count']} emails for {file_path} from index")
+        mail_index.touch_mailbox(mailbox['id'])
+        loaded = open_indexed_mailbox(mailbox['id'])
+        record_ingest(progress, "index")
+        return loaded
+
+    with ingest_in_flight():
+        folder_scans = None
+        if incremental:
+            previous = mail_index.find_source_mailbox(source_path or file_path)
+            if previous and bool(previous['metadata_only']) == metadata_only:
+                try:
+                    loaded = refresh_indexed_mailbox(file_path, fingerprint, previous, progress, check_cancelled)
+                    record_ingest(progress, "incremental")
+                    return loaded
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    logging.warning(f"Incremental re-ingest of {file_path} failed, parsing it in full: {str(e)}")
+                    progress.reset()
+            # Taken before parsing: a message added meanwhile makes its folder look changed next time
+            folder_scans = snapshot_ost_folders(file_path)
+
+        # Dates are normalized to epochs once, as the emails are stored, and indexed with the rows
+        emails = parse_ost_file(file_path, progress, check_cancelled, include_body=not metadata_only)
+        # An upload's source_path is only its file name, which other uploads may share
+        mailbox_id = index_emails(fingerprint, source_path or file_path, emails, metadata_only, folder_scans,
+                                  progress, replace_source=source_path is None)
+    record_ingest(progress, "parse")
+    return LoadedMailbox(emails, mailbox_id, source_path=source_path or file_path)
+
+
+def open_indexed_mailbox(mailbox_id: int) -> LoadedMailbox:
+    """An indexed mailbox: the copy another session holds if it is current, else loaded from the index"""
+    resident = mailbox_catalog.find_resident(mailbox_id)
+    # Not one that reports how it was parsed or refreshed (see describe_load)
+    if (resident is not None and resident.from_index and resident.changes is None
+            and resident.generation == mail_index.generation(mailbox_id)):
+        return resident
+    return load_indexed_mailbox(mailbox_id)
+
+
+def load_indexed_mailbox(mailbox_id: int) -> LoadedMailbox:
+    """Load a mailbox from the persistent index"""
+    # Read first: rows rewritten meanwhile then fail the generation check rather than pass it
+    mailbox = mail_index.get_mailbox(mailbox_id)
+    emails = new_message_store()
+    for row in mail_index.iter_emails(mailbox_id):
+        emails.append_fields(**row)
+    return LoadedMailbox(
+        emails,
+        mailbox_id,
+        from_index=True,
+        source_path=mailbox['source_path'] if mailbox else None,
+        generation=mailbox['generation'] if mailbox else None,
+    )
+
+
+def index_emails(fingerprint: str, source_path: Optional[str], emails: MessageStore,
+                 metadata_only: bool = False, folder_scans: Optional[dict] = None,
+                 progress: Optional[IngestProgress] = None, replace_source: bool = False) -> Optional[int]:
+    """Write emails to the persistent index, returning the mailbox id.
+
+    With ``replace_source`` (source_path is a file on disk) earlier copies
+    indexed from the same path are replaced, and catalog entries holding
+    any replaced mailbox are pointed at the new one.
+    """
+    if not emails:
+        return None
+    return index_rows(fingerprint, source_path, emails.iter_rows(), metadata_only, folder_scans, progress,
+                      replace_source)
+
+
+def index_rows(fingerprint: str, source_path: Optional[str], rows: Iterable[dict],
+               metadata_only: bool = False, folder_scans: Optional[dict] = None,
+               progress: Optional[IngestProgress] = None, replace_source: bool = False) -> Optional[int]:
+    """index_emails for email rows (MessageStore.iter_rows dicts) read as they are written"""
+    started = time.perf_counter()
     try:
-        pst = pypff.file()
-        pst.open(file_path)
-        root = pst.get_root_folder()
-        emails = parse_folder(root)
-        
-        pst.close()
-        
-        logging.info(f"Successfully parsed {len(emails)} emails from file")
-        
+        replaced = mail_index.replaced_mailbox_ids(fingerprint, source_path if replace_source else None)
+        mailbox_id = mail_index.store_mailbox(
+            fingerprint,
+            source_path,
+            rows,
+            metadata_only=metadata_only,
+            folder_scans=folder_scans,
+            replace_source=replace_source,
+        )
+        if replaced:
+            mailbox_catalog.rekey(replaced, mailbox_id, index_reloader(mailbox_id))
+        update_attachment_blobs()
+        return mailbox_id
     except Exception as e:
-        logging.error(f"Error parsing OST file: {str(e)}")
-        raise Exception(f"Failed to parse OST file: {str(e)}")
-    
-    return emails
+        # The index is only a cache - a failed write must not fail the request
+        logging.error(f"Error writing mail index: {str(e)}")
+        index_write_errors.inc()
+        return None
+    finally:
+        if progress is not None:
+            progress.stage_seconds["index"] += time.perf_counter() - started
 
 
-def parse_folder(folder) -> List[EmailMessage]:
-    """Recursively parse folder and extract messages"""
-    messages = []
-    
+# Changes listed by email id in an incremental re-ingest report (beyond that only counted)
+MAX_REPORTED_CHANGES = 100
+
+
+_ingests_in_flight = 0
+_ingests_in_flight_lock = threading.Lock()
+
+
+@contextmanager
+def ingest_in_flight():
+    """Brackets an ingest that may store attachments, up to the indexing of its emails"""
+    global _ingests_in_flight
+    with _ingests_in_flight_lock:
+        _ingests_in_flight += 1
     try:
-        # Parse sub-folders
-        for sub_folder in folder.sub_folders:
-            messages.extend(parse_folder(sub_folder))
-        
-        # Parse messages in current folder
-        for message in folder.sub_messages:
-            try:
-                # Generate unique email ID
-                import hashlib
-                email_id = hashlib.md5(f"{message.subject}_{message.client_submit_time}".encode()).hexdigest()
-                
-                # Get attachment count and names (no data extraction)
-                attachment_count = 0
-                has_attachments = False
-                attachment_names = []
-                
+        yield
+    finally:
+        with _ingests_in_flight_lock:
+            _ingests_in_flight -= 1
+            if not _ingests_in_flight:
+                prune_attachment_blobs()
+
+
+def prune_attachment_blobs():
+    """Delete the blobs no indexed email refers to (only safe while no ingest is in flight)"""
+    if attachment_store is None:
+        return
+    for digest in mail_index.prune_attachment_blobs():
+        attachment_store.remove(digest)
+
+
+def update_attachment_blobs():
+    """Queue the text extraction of newly indexed attachments and delete the blobs no email refers to"""
+    if attachment_store is None:
+        return
+    with _ingests_in_flight_lock:
+        # Otherwise the last ingest in flight prunes as it ends
+        if not _ingests_in_flight:
+            prune_attachment_blobs()
+    pending = mail_index.pending_attachment_blobs()
+    attachment_extractor.submit(
+        (blob['digest'], str(attachment_store.path(blob['digest'])), blob['name']) for blob in pending
+    )
+
+
+def refresh_indexed_mailbox(file_path: str, fingerprint: str, previous: dict,
+                            progress: Optional[IngestProgress] = None,
+                            check_cancelled: Optional[Callable[[], None]] = None) -> LoadedMailbox:
+    """Bring an indexed mailbox up to date with a changed OST file.
+
+    Folders whose state (see snapshot_folders) is unchanged are skipped
+    without opening their messages. In the others every message is matched
+    by its pypff identifier against the messages the index holds for the
+    folder: known ones are kept (their location updated), new ones parsed,
+    and known ones no longer found are removed - so moves between folders
+    cost no reparse. The index is updated in place and the loaded mailbox
+    carries a ``changes`` report.
+    """
+    if progress is None:
+        progress = IngestProgress()
+    mailbox_id = previous['id']
+    old_scans = mail_index.folder_scans(mailbox_id)
+    if not old_scans:
+        raise Exception("no folder states were recorded when the mailbox was indexed")
+    include_body = not previous['metadata_only']
+
+    pst = pypff.file()
+    pst.open(file_path)
+    try:
+        root = pst.get_root_folder()
+        scans = snapshot_folders(root)
+        changed = [key for key, scan in scans.items() if folder_changed(old_scans.get(key), scan)]
+        moved = [key for key, scan in scans.items()
+                 if key not in changed and old_scans[key]['folder_path'] != scan['folder_path']]
+        gone = [key for key in old_scans if key not in scans]
+
+        # Messages of the changed and deleted folders, any of which may turn up again in a changed folder
+        known = {}
+        unmatched = []
+        old_paths = [old_scans[key]['folder_path'] for key in changed + gone if key in old_scans]
+        for row in mail_index.folder_messages(mailbox_id, old_paths):
+            if row['message_identifier'] is None or row['message_identifier'] in known:
+                unmatched.append(row)
+            else:
+                known[row['message_identifier']] = row
+
+        relocated = []
+        for key in moved:
+            folder_path = scans[key]['folder_path']
+            for row in mail_index.folder_messages(mailbox_id, [old_scans[key]['folder_path']]):
+                relocated.append((row, folder_path, row['message_index']))
+
+        added = new_message_store()
+        for key in changed:
+            folder_path = scans[key]['folder_path']
+            folder = root
+            for index in folder_path.split("/") if folder_path else []:
+                folder = folder.get_sub_folder(int(index))
+            progress.folders_visited += 1
+
+            for message_index in range(scans[key]['message_count']):
+                if check_cancelled:
+                    check_cancelled()
                 try:
-                    if hasattr(message, 'number_of_attachments'):
-                        attachment_count = message.number_of_attachments
-                        has_attachments = attachment_count > 0
-                        
-                        # Get attachment names only
-                        for i in range(attachment_count):
-                            try:
-                                attachment = message.get_attachment(i)
-                                if hasattr(attachment, 'name') and attachment.name:
-                                    attachment_names.append(attachment.name)
-                            except:
-                                # Skip problematic attachments silently
-                                pass
-                            
-                except:
-                    # If we can't get attachments, just continue without them
-                    pass
-                
-                # Extract email body - try multiple formats
-                body_text = ""
-                
-                # Try plain text first
-                if hasattr(message, 'plain_text_body') and message.plain_text_body:
-                    body_text = message.plain_text_body
-                # Try HTML body
-                elif hasattr(message, 'html_body') and message.html_body:
-                    try:
-                        # HTML body is bytes, need to decode
-                        html_body = message.html_body
-                        if isinstance(html_body, bytes):
-                            body_text = html_body.decode('utf-8', errors='ignore')
-                        else:
-                            body_text = str(html_body)
-                        
-                        # Better HTML to text conversion - preserve structure
-                        body_text = re.sub(r'<br\s*/?>', '\n', body_text, flags=re.IGNORECASE)
-                        body_text = re.sub(r'</p>', '\n\n', body_text, flags=re.IGNORECASE)
-                        body_text = re.sub(r'</div>', '\n', body_text, flags=re.IGNORECASE)
-                        body_text = re.sub(r'</tr>', '\n', body_text, flags=re.IGNORECASE)
-                        body_text = re.sub(r'</li>', '\n', body_text, flags=re.IGNORECASE)
-                        body_text = re.sub(r'<li[^>]*>', '• ', body_text, flags=re.IGNORECASE)
-                        
-                        # Remove remaining HTML tags
-                        body_text = re.sub('<[^<]+?>', '', body_text)
-                        
-                        # Clean up entities
-                        body_text = body_text.replace('&nbsp;', ' ')
-                        body_text = body_text.replace('&amp;', '&')
-                        body_text = body_text.replace('&lt;', '<')
-                        body_text = body_text.replace('&gt;', '>')
-                        body_text = body_text.replace('&quot;', '"')
-                        
-                        # Clean up excessive whitespace but preserve line breaks
-                        lines = body_text.split('\n')
-                        lines = [line.strip() for line in lines]
-                        body_text = '\n'.join(line for line in lines if line)
-                        
-                    except Exception as e:
-                        logging.debug(f"Error extracting HTML body: {str(e)}")
-                # Try RTF body as last resort
-                elif hasattr(message, 'rtf_body') and message.rtf_body:
-                    body_text = "[RTF content - preview not available]"
-                
-                # Get email date - the client_submit_time is already in local timezone
-                email_date = None
-                if hasattr(message, 'client_submit_time') and message.client_submit_time:
-                    email_date = str(message.client_submit_time)
-                
-                email_msg = EmailMessage(
-                    email_id=email_id,
-                    subject=message.subject if hasattr(message, 'subject') and message.subject else "(No Subject)",
-                    sender_name=message.sender_name if hasattr(message, 'sender_name') and message.sender_name else "Unknown",
-                    sender_email=message.sender_email_address if hasattr(message, 'sender_email_address') and message.sender_email_address else "",
-                    recipients=message.display_to if hasattr(message, 'display_to') and message.display_to else "",
-                    date=email_date,
-                    body=body_text if body_text else "",
-                    has_attachments=has_attachments,
-                    attachment_count=attachment_count,
-                    attachment_names=attachment_names
-                )
-                
-                messages.append(email_msg)
-            except Exception as e:
-                # Only log if it's not an attachment error
-                if "attachment" not in str(e).lower():
-                    logging.debug(f"Skipping message due to error: {str(e)}")
-                continue
-                
-    except Exception as e:
-        logging.error(f"Error parsing folder: {str(e)}")
-    
-    return messages
+                    message = folder.get_sub_message(message_index)
+                    row = known.pop(getattr(message, 'identifier', None), None)
+                    if row is not None:
+                        if (row['folder_path'], row['message_index']) != (folder_path, message_index):
+                            relocated.append((row, folder_path, message_index))
+                        continue
+                    email_msg = parse_message(message, include_body, progress)
+                    email_msg.folder_path = folder_path
+                    email_msg.message_index = message_index
+                except Exception as e:
+                    progress.skip(e)
+                    continue
+                progress.messages_parsed += 1
+                progress.bytes_extracted += len(email_msg.body or "") + len(email_msg.subject or "")
+                added.append(email_msg)
+    finally:
+        pst.close()
+
+    removed = list(known.values()) + unmatched
+    if check_cancelled:
+        check_cancelled()
+    index_started = time.perf_counter()
+    email_count = mail_index.update_mailbox(
+        mailbox_id,
+        fingerprint,
+        added.iter_rows(),
+        [row['id'] for row in removed],
+        [(row['id'], folder_path, message_index) for row, folder_path, message_index in relocated],
+        scans,
+    )
+    update_attachment_blobs()
+    progress.stage_seconds["index"] += time.perf_counter() - index_started
+    # Bodies cached (and the pypff handle kept open) for the old file are stale now
+    forget_body_source(previous['source_path'])
+
+    # Start from the copy already in memory when rows were only added or moved
+    # (removals renumber positions, so then the index is reloaded instead). That
+    # copy may be in use by other sessions, with indexes built for its rows, so
+    # the changes go to a copy of its store rather than the store itself.
+    resident = mailbox_catalog.find_resident(mailbox_id)
+    # Every session holding the mailbox reloads it on next use: their copies
+    # no longer match the index positions text searches return
+    mailbox_catalog.rekey([mailbox_id], mailbox_id, index_reloader(mailbox_id))
+    if resident is not None and not removed and len(resident.emails) == previous['email_count']:
+        store = resident.emails.copy()
+        for row, folder_path, message_index in relocated:
+            store.relocate(row['position'], folder_path, message_index)
+        for position in range(len(added)):
+            store.append_fields(date_epoch=added.date_epoch(position), **added.row(position))
+        mailbox = LoadedMailbox(store, mailbox_id, from_index=True, source_path=previous['source_path'])
+    else:
+        mailbox = load_indexed_mailbox(mailbox_id)
+
+    mailbox.changes = {
+        "added": len(added),
+        "removed": len(removed),
+        "relocated": len(relocated),
+        "folders_scanned": len(changed),
+        "folders_total": len(scans),
+        "added_email_ids": [added.email_ids[position] for position in range(min(len(added), MAX_REPORTED_CHANGES))],
+        "removed_email_ids": [row['email_id'] for row in removed[:MAX_REPORTED_CHANGES]],
+    }
+    logging.info(f"Incremental re-ingest of {file_path}: {len(added)} added, {len(removed)} removed, "
+                 f"{len(changed)} of {len(scans)} folders scanned, {email_count} emails")
+    return mailbox
+
+
+def describe_load(mailbox: LoadedMailbox) -> str:
+    """Message telling how a mailbox was loaded"""
+    if mailbox.changes is not None:
+        return (f"Updated {len(mailbox.emails)} emails from your file: "
+                f"{mailbox.changes['added']} added, {mailbox.changes['removed']} removed")
+    return f"{'Loaded' if mailbox.from_index else 'Successfully parsed'} {len(mailbox.emails)} emails from your file"
 
 
 def get_sample_emails() -> List[EmailMessage]:
     """Return sample email data for demonstration"""
-    return [
+    emails = [
         EmailMessage(
             subject="Q4 Financial Report",
             sender_name="John Smith",
@@ -287,77 +780,443 @@ def get_sample_emails() -> List[EmailMessage]:
             attachment_names=["Event_Pass.pdf"]
         )
     ]
+    for message_identifier, email in enumerate(emails, 1):
+        # As parse_message does, with the position standing in for the pypff identifier
+        identity = email_identity(None, email.subject, email.date, email.sender_email, email.recipients)
+        email.message_identifier = message_identifier
+        email.email_id = copy_id(identity, message_identifier)
+        email.thread_id = thread_id_of(subject=email.subject, sender_name=email.sender_name,
+                                       sender_email=email.sender_email, recipients=email.recipients)
+        for name, value in fingerprint_fields(identity, email.body).items():
+            setattr(email, name, value)
+    return emails
+
+
+def parse_date_bounds(start_date: Optional[str], end_date: Optional[str]) -> tuple:
+    """Parse search filter dates to epoch seconds; an unparseable bound is ignored"""
+    bounds = []
+    for name, value in (("start_date", start_date), ("end_date", end_date)):
+        epoch = parse_email_date(value) if value else None
+        if value and epoch is None:
+            logging.error(f"Error parsing {name} {value}")
+        bounds.append(epoch)
+    return tuple(bounds)
 
 
-def filter_emails_by_date(emails: List[EmailMessage], start_date: Optional[str], end_date: Optional[str]) -> List[EmailMessage]:
-    """Filter emails by date range"""
-    if not start_date and not end_date:
-        return emails
+def date_ordered_page(mailbox: LoadedMailbox, start: Optional[float], end: Optional[float],
+                      offset: int = 0, limit: Optional[int] = None) -> tuple:
+    """One page of the emails dated within [start, end], newest first.
+
+    Emails without a parseable date can never match a date range; when no range
+    is given they follow the dated ones. Returns the total number of matching
+    emails and the positions on the page.
+    """
+    date_index = mailbox.date_index
+    total = date_index.count(start, end)
+    positions = date_index.page(start, end, offset, limit)
     
-    filtered = []
+    if start is None and end is None and date_index.undated:
+        dated_total = total
+        total += len(date_index.undated)
+        if limit is None or len(positions) < limit:
+            undated_offset = max(offset - dated_total, 0)
+            undated_limit = None if limit is None else limit - len(positions)
+            undated = date_index.undated[undated_offset:]
+            positions += undated if undated_limit is None else undated[:undated_limit]
     
-    # Parse filter dates
-    start_dt = None
-    end_dt = None
+    return total, positions
+
+
+def filter_emails_by_date(mailbox: LoadedMailbox, start_date: Optional[str], end_date: Optional[str],
+                          positions: Optional[List[int]] = None) -> List[int]:
+    """Filter emails by date range using the mailbox's sorted date index.
+
+    Without ``positions`` the whole mailbox is filtered by bisecting the index
+    and the positions are returned newest first. With ``positions`` (e.g.
+    ranked text hits) only those emails are checked, in the order given.
+    """
+    start, end = parse_date_bounds(start_date, end_date)
     
-    if start_date:
-        try:
-            start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-            # Remove timezone info for comparison
-            start_dt = start_dt.replace(tzinfo=None)
-        except Exception as e:
-            logging.error(f"Error parsing start_date {start_date}: {str(e)}")
+    if positions is None:
+        _total, positions = date_ordered_page(mailbox, start, end)
+    elif start is not None or end is not None:
+        positions = [position for position in positions if mailbox.date_index.contains(position, start, end)]
     
-    if end_date:
-        try:
-            end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            # Remove timezone info for comparison
-            end_dt = end_dt.replace(tzinfo=None)
-        except Exception as e:
-            logging.error(f"Error parsing end_date {end_date}: {str(e)}")
+    logging.info(f"Filtered to {len(positions)} emails. Start: {start_date}, End: {end_date}")
+    return positions
+
+
+def _cursor_scope(mailboxes: List[LoadedMailbox], search_request: SearchRequest) -> str:
+    # A cursor is only valid for the mailboxes and filters that produced it
+    scope = json.dumps([
+        [[mailbox.mailbox_id, len(mailbox.emails)] for mailbox in mailboxes],
+        search_request.query, search_request.start_date, search_request.end_date,
+        search_request.collapse_threads, search_request.collapse_duplicates,
+    ])
+    return hashlib.sha1(scope.encode()).hexdigest()[:16]
+
+
+def encode_cursor(mailboxes: List[LoadedMailbox], search_request: SearchRequest, offset: int) -> str:
+    payload = json.dumps({"s": _cursor_scope(mailboxes, search_request), "o": offset})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(mailboxes: List[LoadedMailbox], search_request: SearchRequest) -> int:
+    """Offset encoded in the request's cursor (0 without one)"""
+    if not search_request.cursor:
+        return 0
+    try:
+        token = search_request.cursor
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        scope, offset = payload["s"], int(payload["o"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if scope != _cursor_scope(mailboxes, search_request) or offset < 0:
+        raise HTTPException(status_code=400, detail="Cursor does not match this search or the loaded emails changed. Please search again.")
+    return offset
+
+
+def email_fragment(store: MessageStore, position: int, projection: str) -> bytes:
+    """JSON of a stored email as search results show it, encoded on first use and cached"""
+    key = (store.key, position, projection)
+    fragment = json_fragments.get(key)
+    if fragment is None:
+        if projection == "full":
+            fragment = encode_json(store.row(position))
+        else:
+            fragment = encode_json(EmailSummary.fields_from_store(store, position))
+        json_fragments.put(key, fragment)
+    return fragment
+
+
+def email_fragments(page: List[tuple], projection: str) -> JSONFragments:
+    """Emails of a result page, given as (handle, store, position), ready to join into a response.
+
+    Summaries always carry a handle (null for a single mailbox), complete
+    emails only when several mailboxes were searched.
+    """
+    fragments = JSONFragments()
+    for handle, store, position in page:
+        fragment = email_fragment(store, position, projection)
+        if projection != "full" or handle is not None:
+            fragment = add_field(fragment, "handle", handle)
+        fragments.append(fragment)
+    return fragments
+
+
+def collapse_duplicates(mailboxes: List[LoadedMailbox], results: List[tuple]) -> List[tuple]:
+    """The first of the (mailbox number, position) results among each set of copies, in the order given.
+
+    Each kept result becomes (mailbox number, position, duplicate count), the
+    count being how many of the results are copies of it (itself included).
+    Copies within a mailbox come from its duplicate index; across mailboxes
+    the first result of each set is matched by its fingerprints.
+    """
+    indexes = [mailbox.duplicates().codes for mailbox in mailboxes]
+    across = DuplicateFilter() if len(mailboxes) > 1 else None
+    kept_by_group: Dict[tuple, int] = {}
+    collapsed = []
+    counts = []
+    for target, position in results:
+        group = (target, indexes[target][position])
+        kept = kept_by_group.get(group)
+        if kept is None and across is not None:
+            store = mailboxes[target].emails
+            fingerprint = (store.content_hashes[position], store.simhashes[position], store.sender_emails[position])
+            kept = across.find(*fingerprint)
+            if kept is None:
+                across.add(*fingerprint, len(collapsed))
+        if kept is None:
+            kept = len(collapsed)
+            collapsed.append((target, position))
+            counts.append(0)
+        kept_by_group[group] = kept
+        counts[kept] += 1
+    return [(target, position, count) for (target, position), count in zip(collapsed, counts)]
+
+
+def collapse_threads(mailboxes: List[LoadedMailbox], results: List[tuple]) -> List[tuple]:
+    """The first of the results in each conversation, in the order given.
+
+    Results are tuples starting with (mailbox number, position) and are kept
+    as they are. Thread ids derive from the messages themselves, so a
+    conversation spread over several mailboxes is collapsed to one result.
+    """
+    collapsed = []
+    if len(mailboxes) == 1:
+        threads = mailboxes[0].threads()
+        codes = threads.codes
+        seen = bytearray(len(threads))
+        for result in results:
+            code = codes[result[1]]
+            if not seen[code]:
+                seen[code] = 1
+                collapsed.append(result)
+        return collapsed
+    seen = set()
+    for result in results:
+        thread_id = mailboxes[result[0]].emails.thread_ids[result[1]]
+        if thread_id not in seen:
+            seen.add(thread_id)
+            collapsed.append(result)
+    return collapsed
+
+
+def collapse_results(mailboxes: List[LoadedMailbox], results: List[tuple], search_request: SearchRequest) -> List[tuple]:
+    """(mailbox number, position) results collapsed as the search asks: duplicates first, then conversations"""
+    if search_request.collapse_duplicates:
+        results = collapse_duplicates(mailboxes, results)
+    if search_request.collapse_threads:
+        results = collapse_threads(mailboxes, results)
+    return results
+
+
+def add_collapse_fields(fragments: JSONFragments, page: List[tuple], mailboxes: List[LoadedMailbox],
+                        search_request: SearchRequest) -> JSONFragments:
+    """Add to each email of a collapsed page its duplicate_count and/or thread_message_count"""
+    counted = JSONFragments()
+    for fragment, result in zip(fragments, page):
+        if search_request.collapse_duplicates:
+            fragment = add_field(fragment, "duplicate_count", result[2])
+        if search_request.collapse_threads:
+            thread_id = format(mailboxes[result[0]].emails.thread_ids[result[1]], "016x")
+            count = 0
+            for mailbox in mailboxes:
+                threads = mailbox.threads()
+                code = threads.code_of(thread_id)
+                if code is not None:
+                    count += threads.size(code)
+            fragment = add_field(fragment, "thread_message_count", count)
+        counted.append(fragment)
+    return counted
+
+
+def result_noun(search_request: SearchRequest) -> str:
+    if search_request.collapse_threads:
+        return "conversations"
+    return "distinct emails" if search_request.collapse_duplicates else "emails"
+
+
+def search_mailbox(mailbox: LoadedMailbox, search_request: SearchRequest) -> dict:
+    """Run a search and return one page of results.
+
+    Results are ranked by relevance for text queries and sorted newest first
+    otherwise (ties broken by parse position), so a cursor always resumes at
+    the same place. Only the emails on the page are projected and returned.
+    """
+    offset = decode_cursor([mailbox], search_request)
+    limit = search_request.page_size
+    collapsing = search_request.collapse_threads or search_request.collapse_duplicates
     
-    logging.info(f"Filtering {len(emails)} emails. Start: {start_dt}, End: {end_dt}")
+    if search_request.query and search_request.query.strip():
+        positions = filter_emails_by_date(
+            mailbox,
+            search_request.start_date,
+            search_request.end_date,
+            search_emails_by_text(mailbox, search_request.query)
+        )
+        total = len(positions)
+        page = positions[offset:offset + limit]
+    elif collapsing:
+        # Every match is visited to tell which results the page starts at
+        start, end = parse_date_bounds(search_request.start_date, search_request.end_date)
+        _count, positions = date_ordered_page(mailbox, start, end)
+    else:
+        start, end = parse_date_bounds(search_request.start_date, search_request.end_date)
+        total, page = date_ordered_page(mailbox, start, end, offset, limit)
     
-    for email in emails:
-        if not email.date:
-            continue
-        
+    if collapsing:
+        results = collapse_results([mailbox], [(0, position) for position in positions], search_request)
+        total = len(results)
+        results = results[offset:offset + limit]
+        page = [position for _target, position, *_counts in results]
+    
+    emails = email_fragments([(None, mailbox.emails, position) for position in page], search_request.projection)
+    if collapsing:
+        emails = add_collapse_fields(emails, results, [mailbox], search_request)
+    
+    end_offset = offset + len(page)
+    response = {
+        "success": True,
+        "message": f"Found {total} {result_noun(search_request)} matching criteria",
+        "email_count": total,
+        "page_size": limit,
+        "next_cursor": encode_cursor([mailbox], search_request, end_offset) if end_offset < total else None,
+        "emails": emails
+    }
+    if search_request.start_date or search_request.end_date:
+        # Undated emails can never match a date range - report them instead of dropping them silently
+        response["undated_email_count"] = len(mailbox.date_index.undated)
+    return response
+
+
+def matching_results(mailboxes: List[LoadedMailbox], search_request: SearchRequest,
+                     limit: Optional[int] = None) -> tuple:
+    """The total number of emails matching a search and an iterator over them, as (mailbox number, position).
+
+    Results from several mailboxes are merged: by relevance for text queries
+    (BM25 scores come from one index, so they compare across mailboxes) and
+    newest first otherwise. Without a query, ``limit`` bounds how many
+    results are read from each mailbox (the total still counts them all).
+    """
+    start, end = parse_date_bounds(search_request.start_date, search_request.end_date)
+    
+    if search_request.query and search_request.query.strip():
+        hits = []
+        for target, mailbox in enumerate(mailboxes):
+            for position, score in text_search_hits(mailbox, search_request.query):
+                if (start is None and end is None) or mailbox.date_index.contains(position, start, end):
+                    hits.append((score, target, position))
+        # Best score first; ties keep the mailbox order and each mailbox's own ranking
+        hits.sort(key=lambda hit: -hit[0])
+        return len(hits), ((target, position) for _score, target, position in hits)
+    
+    total = 0
+    streams = []
+    for target, mailbox in enumerate(mailboxes):
+        count, positions = date_ordered_page(mailbox, start, end, 0, limit)
+        total += count
+        # (epoch, mailbox number, position) items, read as the merge needs them
+        streams.append(zip(map(mailbox.date_index.epoch_of, positions), itertools.repeat(target), positions))
+    # Each stream is newest first with undated emails last; merge them the same way
+    merged = heapq.merge(*streams, key=lambda item: (item[0] is None, -(item[0] or 0)))
+    return total, ((target, position) for _epoch, target, position in merged)
+
+
+def search_mailboxes(targets: List[tuple], search_request: SearchRequest) -> dict:
+    """Run a search over one or several (handle, mailbox) pairs and return one page of results.
+
+    Results are merged as ``matching_results`` describes; each email on the
+    page carries its mailbox handle.
+    """
+    if len(targets) == 1:
+        handle, mailbox = targets[0]
+        response = search_mailbox(mailbox, search_request)
+        response["handle"] = handle
+        return response
+    
+    mailboxes = [mailbox for _handle, mailbox in targets]
+    offset = decode_cursor(mailboxes, search_request)
+    limit = search_request.page_size
+    collapsing = search_request.collapse_threads or search_request.collapse_duplicates
+    
+    # Collapsing needs every match to tell which results the page starts at
+    total, results = matching_results(mailboxes, search_request, None if collapsing else offset + limit)
+    if collapsing:
+        results = collapse_results(mailboxes, results, search_request)
+        total = len(results)
+        page = results[offset:offset + limit]
+    else:
+        page = list(itertools.islice(results, offset, offset + limit))
+    
+    emails = email_fragments(
+        [(targets[result[0]][0], targets[result[0]][1].emails, result[1]) for result in page],
+        search_request.projection,
+    )
+    if collapsing:
+        emails = add_collapse_fields(emails, page, mailboxes, search_request)
+    
+    end_offset = offset + len(page)
+    response = {
+        "success": True,
+        "message": f"Found {total} {result_noun(search_request)} matching criteria in {len(targets)} mailboxes",
+        "email_count": total,
+        "page_size": limit,
+        "next_cursor": encode_cursor(mailboxes, search_request, end_offset) if end_offset < total else None,
+        "handles": [handle for handle, _mailbox in targets],
+        "emails": emails
+    }
+    if search_request.start_date or search_request.end_date:
+        response["undated_email_count"] = sum(len(mailbox.date_index.undated) for mailbox in mailboxes)
+    return response
+
+
+def session_of(x_session_id: Optional[str]) -> str:
+    """The catalog session of a request (the X-Session-Id header)"""
+    return x_session_id.strip() if x_session_id and x_session_id.strip() else DEFAULT_SESSION
+
+
+def index_reloader(mailbox_id: int) -> Callable[[], LoadedMailbox]:
+    """Brings a mailbox back from the index after the catalog evicted it"""
+    return lambda: load_indexed_mailbox(mailbox_id)
+
+
+def register_mailbox(session: str, mailbox: LoadedMailbox, label: Optional[str]) -> CatalogEntry:
+    """Add a loaded mailbox to the catalog as the session's current mailbox"""
+    return mailbox_catalog.add(
+        session,
+        mailbox,
+        estimate_mailbox_bytes(mailbox),
+        label=label,
+        reload=index_reloader(mailbox.mailbox_id) if mailbox.mailbox_id is not None else None,
+        key=mailbox.mailbox_id,
+    )
+
+
+def get_catalog_mailbox(session: str, handle: str) -> LoadedMailbox:
+    """The mailbox of a handle, or 404"""
+    try:
+        return mailbox_catalog.get(session, handle)
+    except MailboxNotFound:
+        raise HTTPException(status_code=404, detail=f"Mailbox {handle} is not loaded. It may have been evicted - please load it again.")
+
+
+def get_loaded_mailbox(session: str = DEFAULT_SESSION) -> Optional[tuple]:
+    """The session's current (handle, mailbox).
+
+    Without sessions (no X-Session-Id) the last indexed mailbox is restored if
+    nothing is loaded, e.g. after a restart. Named sessions only see what they loaded.
+    """
+    entry = mailbox_catalog.current(session)
+    if entry is not None:
         try:
-            # Parse email date - try multiple formats
-            email_date = None
-            
-            # Try ISO format first
-            if 'T' in email.date:
-                email_date = datetime.fromisoformat(email.date.replace('Z', ''))
-            else:
-                # Try space-separated format
-                email_date = datetime.strptime(email.date.split('.')[0], '%Y-%m-%d %H:%M:%S')
-            
-            # Remove timezone info for comparison
-            if email_date.tzinfo:
-                email_date = email_date.replace(tzinfo=None)
-            
-            # Check date range
-            include_email = True
-            
-            if start_dt and email_date < start_dt:
-                include_email = False
-            
-            if end_dt and email_date > end_dt:
-                include_email = False
-            
-            if include_email:
-                filtered.append(email)
-                logging.debug(f"Including email: {email.subject[:50]} - Date: {email_date}")
-            else:
-                logging.debug(f"Excluding email: {email.subject[:50]} - Date: {email_date}")
-                
-        except Exception as e:
-            logging.error(f"Error parsing email date '{email.date}': {str(e)}")
-            continue
+            return entry.handle, mailbox_catalog.get(session, entry.handle)
+        except MailboxNotFound:
+            pass
     
-    logging.info(f"Filtered to {len(filtered)} emails")
-    return filtered
+    if session != DEFAULT_SESSION:
+        return None
+    mailbox = mail_index.latest_mailbox()
+    if not mailbox:
+        return None
+    logging.info(f"Restoring mailbox {mailbox['id']} ({mailbox['source_path']}) from index")
+    loaded = open_indexed_mailbox(mailbox['id'])
+    entry = register_mailbox(session, loaded, mailbox['source_path'])
+    return entry.handle, loaded
+
+
+def resolve_search_targets(session: str, handles: Optional[List[str]]) -> List[tuple]:
+    """(handle, mailbox) pairs a search runs over: the given handles, else the session's current mailbox"""
+    if handles:
+        # Keep the caller's order, without duplicates
+        return [(handle, get_catalog_mailbox(session, handle)) for handle in dict.fromkeys(handles)]
+    current = get_loaded_mailbox(session)
+    return [current] if current else []
+
+
+def search_emails_by_text(mailbox: LoadedMailbox, query: str) -> List[int]:
+    """Run a full-text query against a loaded mailbox, returning positions of the best matches first"""
+    return [position for position, _score in text_search_hits(mailbox, query)]
+
+
+def text_search_hits(mailbox: LoadedMailbox, query: str) -> List[tuple]:
+    """(position, score) of the emails matching a full-text query, best first"""
+    if mailbox.mailbox_id is None:
+        raise HTTPException(status_code=409, detail="Text search is not available: the loaded emails are not indexed")
+    
+    try:
+        parsed = parse_query(query)
+        hits = mail_index.search(mailbox.mailbox_id, parsed.match, has_attachment=parsed.has_attachment,
+                                 generation=mailbox.generation)
+    except MailboxChanged:
+        raise HTTPException(status_code=409, detail="The mailbox was updated while you were searching it. Please search again.")
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {str(e)}")
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {str(e)}")
+    
+    logging.info(f"Text query {query!r} matched {len(hits)} emails")
+    return [(position, score) for position, score in hits if position < len(mailbox.emails)]
 
 
 @api_router.get("/")
@@ -366,44 +1225,38 @@ async def root():
 
 
 @api_router.post("/upload-ost")
-async def upload_ost_file(file: UploadFile = File(...)):
+async def upload_ost_file(file: UploadFile = File(...), x_session_id: Optional[str] = Header(None)):
     """Upload and parse OST file"""
-    global parsed_emails_cache
-    
-    if not file.filename.lower().endswith('.ost'):
-        raise HTTPException(status_code=400, detail="Only OST files are supported")
-    
-    # Check if pypff is available
-    if not PYPFF_AVAILABLE:
-        raise HTTPException(
-            status_code=501, 
-            detail="OST parsing library (pypff) is not installed. Please use the 'Load Sample Data' button to test the application, or install pypff library to parse real OST files."
-        )
+    check_uploaded_ost_file(file)
     
     # Save uploaded file temporarily
     temp_file = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as temp:
-            temp_file = temp.name
-            shutil.copyfileobj(file.file, temp)
+        # File I/O and parsing run in the threadpool so they never block the event loop
+        temp_file = await run_in_threadpool(save_upload_to_temp, file)
         
-        # Parse the file
-        emails = parse_ost_file(temp_file)
+        # Parse the file, or load it from the index if this content was seen before.
+        # The temp copy gets a fresh mtime on every upload, so leave it out of the fingerprint.
+        fingerprint = await run_in_threadpool(file_fingerprint, temp_file, False)
+        mailbox = await run_in_threadpool(load_or_parse_ost_file, temp_file, fingerprint, file.filename)
         
-        if len(emails) == 0:
+        if len(mailbox.emails) == 0:
             raise HTTPException(
                 status_code=400,
                 detail="No emails found in the file. The file may be empty, corrupted, or encrypted."
             )
         
-        parsed_emails_cache = emails
+        entry = register_mailbox(session_of(x_session_id), mailbox, file.filename)
         
-        return {
-            "success": True,
-            "message": f"Successfully parsed {len(parsed_emails_cache)} emails from your file",
-            "email_count": len(parsed_emails_cache),
-            "emails": parsed_emails_cache
-        }
+        # Return the first page; the rest is fetched through /search-emails with next_cursor
+        response = search_mailbox(mailbox, SearchRequest())
+        response.update({
+            "message": describe_load(mailbox),
+            "from_index": mailbox.from_index,
+            "changes": mailbox.changes,
+            "handle": entry.handle,
+        })
+        return APIJSONResponse(response)
         
     except HTTPException:
         raise
@@ -413,21 +1266,54 @@ async def upload_ost_file(file: UploadFile = File(...)):
     
     finally:
         # Clean up temp file
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.unlink(temp_file)
-            except:
-                pass
+        remove_temp_file(temp_file)
         file.file.close()
 
 
-@api_router.post("/browse-file")
-async def browse_file(request: FilePathRequest):
-    """Parse OST file from local file path"""
-    global parsed_emails_cache
-    
-    file_path = request.file_path
+def check_uploaded_ost_file(file: UploadFile):
+    """Reject an upload that cannot be parsed as an OST file"""
+    if not file.filename.lower().endswith('.ost'):
+        raise HTTPException(status_code=400, detail="Only OST files are supported")
     
+    # Check if pypff is available
+    if not PYPFF_AVAILABLE:
+        raise HTTPException(
+            status_code=501, 
+            detail="OST parsing library (pypff) is not installed. Please use the 'Load Sample Data' button to test the application, or install pypff library to parse real OST files."
+        )
+
+
+def save_upload_to_temp(file: UploadFile) -> str:
+    """Copy an uploaded file to a temp file and return its path"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as temp:
+        shutil.copyfileobj(file.file, temp)
+        return temp.name
+
+
+def remove_temp_file(temp_file: Optional[str]):
+    if temp_file and os.path.exists(temp_file):
+        try:
+            os.unlink(temp_file)
+        except:
+            pass
+
+
+def resolve_metadata_only(metadata_only: Optional[bool]) -> bool:
+    """Whether to ingest without bodies: the request's choice, else OST_METADATA_ONLY"""
+    if metadata_only is None:
+        return os.environ.get('OST_METADATA_ONLY', '0').strip().lower() in ('1', 'true', 'yes')
+    return metadata_only
+
+
+def resolve_incremental(incremental: Optional[bool]) -> bool:
+    """Whether to re-ingest a changed file incrementally: the request's choice, else OST_INCREMENTAL"""
+    if incremental is None:
+        return os.environ.get('OST_INCREMENTAL', '1').strip().lower() in ('1', 'true', 'yes')
+    return incremental
+
+
+def check_local_ost_file(file_path: str):
+    """Reject a local path that cannot be parsed as an OST file"""
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found at specified path")
     
@@ -440,26 +1326,46 @@ async def browse_file(request: FilePathRequest):
             status_code=501, 
             detail="OST parsing library (pypff) is not installed. Please use the 'Load Sample Data' button to test the application, or install pypff library to parse real OST files."
         )
+
+
+@api_router.post("/browse-file")
+async def browse_file(request: FilePathRequest, x_session_id: Optional[str] = Header(None)):
+    """Parse OST file from local file path"""
+    file_path = request.file_path
+    check_local_ost_file(file_path)
     
     try:
-        # Parse the file
-        emails = parse_ost_file(file_path)
+        # Parse the file, or load it from the index if it has not changed.
+        # Run in the threadpool so parsing never blocks the event loop.
+        fingerprint = await run_in_threadpool(file_fingerprint, file_path)
+        progress = IngestProgress()
+        mailbox = await run_in_threadpool(
+            load_or_parse_ost_file, file_path, fingerprint,
+            progress=progress,
+            metadata_only=resolve_metadata_only(request.metadata_only),
+            incremental=resolve_incremental(request.incremental),
+        )
         
-        if len(emails) == 0:
+        if len(mailbox.emails) == 0:
             raise HTTPException(
                 status_code=400,
                 detail="No emails found in the file. The file may be empty, corrupted, or encrypted."
             )
         
-        parsed_emails_cache = emails
-        
-        return {
-            "success": True,
-            "message": f"Successfully parsed {len(parsed_emails_cache)} emails from your file",
-            "email_count": len(parsed_emails_cache),
-            "emails": parsed_emails_cache
-        }
+        entry = register_mailbox(session_of(x_session_id), mailbox, file_path)
         
+        # Return the first page; the rest is fetched through /search-emails with next_cursor
+        response = search_mailbox(mailbox, SearchRequest())
+        response.update({
+            "message": describe_load(mailbox),
+            "from_index": mailbox.from_index,
+            "changes": mailbox.changes,
+            "handle": entry.handle,
+        })
+        if request.profile:
+            response["profile"] = progress.profile()
+        return APIJSONResponse(response)
+
     except HTTPException:
         raise
     except Exception as e:
@@ -467,53 +1373,586 @@ async def browse_file(request: FilePathRequest):
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 
+def run_ingest_job(job, file_path: str, fingerprint: Optional[str] = None, source_path: Optional[str] = None,
+                   metadata_only: bool = False, session: str = DEFAULT_SESSION, incremental: bool = False,
+                   profile: bool = False) -> dict:
+    """Job body: parse (or load from the index) a mailbox and make it the session's current one"""
+    progress = IngestProgress()
+    job.progress = progress
+    if fingerprint is None:
+        fingerprint = file_fingerprint(file_path)
+    mailbox = load_or_parse_ost_file(file_path, fingerprint, source_path, progress, job.check_cancelled,
+                                     metadata_only, incremental)
+    
+    if not mailbox.emails:
+        raise Exception("No emails found in the file. The file may be empty, corrupted, or encrypted.")
+    job.check_cancelled()
+    
+    entry = register_mailbox(session, mailbox, source_path or file_path)
+    result = {
+        "message": describe_load(mailbox),
+        "email_count": len(mailbox.emails),
+        "from_index": mailbox.from_index,
+        "changes": mailbox.changes,
+        "handle": entry.handle,
+    }
+    if profile:
+        result["profile"] = progress.profile()
+    return result
+
+
+@api_router.post("/jobs/browse-file", status_code=202)
+async def start_browse_file_job(request: FilePathRequest, x_session_id: Optional[str] = Header(None)):
+    """Start parsing an OST file from a local path in the background"""
+    check_local_ost_file(request.file_path)
+    session = session_of(x_session_id)
+    
+    job = ingest_jobs.submit(
+        "browse-file",
+        request.file_path,
+        lambda job: run_ingest_job(
+            job, request.file_path, metadata_only=resolve_metadata_only(request.metadata_only), session=session,
+            incremental=resolve_incremental(request.incremental), profile=request.profile,
+        ),
+    )
+    return {"success": True, "job": job.to_dict()}
+
+
+@api_router.post("/jobs/upload-ost", status_code=202)
+async def start_upload_ost_job(file: UploadFile = File(...), x_session_id: Optional[str] = Header(None)):
+    """Upload an OST file and parse it in the background"""
+    check_uploaded_ost_file(file)
+    session = session_of(x_session_id)
+    
+    try:
+        temp_file = await run_in_threadpool(save_upload_to_temp, file)
+    finally:
+        file.file.close()
+    
+    # The temp copy gets a fresh mtime on every upload, so leave it out of the fingerprint
+    job = ingest_jobs.submit(
+        "upload-ost",
+        file.filename,
+        lambda job: run_ingest_job(
+            job, temp_file, file_fingerprint(temp_file, include_mtime=False), file.filename, session=session
+        ),
+        cleanup=lambda: remove_temp_file(temp_file),
+    )
+    return {"success": True, "job": job.to_dict()}
+
+
+@api_router.get("/jobs")
+async def list_jobs():
+    """All known ingest jobs, newest first"""
+    return {"success": True, "jobs": [job.to_dict() for job in ingest_jobs.list()]}
+
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """State, progress and result of an ingest job"""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, "job": job.to_dict()}
+
+
+@api_router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel an ingest job that is queued or running"""
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, "job": job.to_dict()}
+
+
+# Streaming ingest flushes a batch once it is this large or this old
+STREAM_BATCH_SIZE = 500
+STREAM_FLUSH_SECONDS = 0.5
+
+
+def _ndjson(event: dict) -> bytes:
+    return encode_json(event) + b"\n"
+
+
+def stream_ingest(file_path: str, fingerprint: str, metadata_only: bool = False,
+                  session: str = DEFAULT_SESSION, incremental: bool = False,
+                  profile: bool = False) -> Iterator[bytes]:
+    """Parse a mailbox, yielding NDJSON events as messages are produced.
+
+    Events are ``{"type": "emails", "emails": [...]}`` batches of summaries,
+    ``{"type": "progress", ...}`` counters, and finally either ``"done"``
+    (with the first page of results, like /browse-file) or ``"error"``.
+    The first parsed email is flushed immediately so the client sees results
+    right away; after that batches go out by size or age. A changed file
+    that is re-ingested incrementally sends no batches, only the "done" event
+    with the changes. With ``profile`` the done event includes the ingest's
+    profile report.
+    """
+    progress = IngestProgress()
+    try:
+        indexed = mail_index.find_mailbox(fingerprint)
+        previous = mail_index.find_source_mailbox(file_path) if incremental and not indexed else None
+        if indexed and (metadata_only or not indexed['metadata_only']):
+            mail_index.touch_mailbox(indexed['id'])
+            mailbox = open_indexed_mailbox(indexed['id'])
+            record_ingest(progress, "index")
+        elif previous and bool(previous['metadata_only']) == metadata_only:
+            mailbox = load_or_parse_ost_file(file_path, fingerprint, progress=progress, metadata_only=metadata_only,
+                                             incremental=True)
+        else:
+            with ingest_in_flight():
+                folder_scans = snapshot_ost_folders(file_path) if incremental else None
+                emails = new_message_store()
+                batch = []
+                last_flush = time.monotonic()
+                
+                for email in iter_ost_file(file_path, progress, include_body=not metadata_only):
+                    emails.append(email)
+                    batch.append(EmailSummary.from_email(email))
+                    now = time.monotonic()
+                    if len(emails) == 1 or len(batch) >= STREAM_BATCH_SIZE or now - last_flush >= STREAM_FLUSH_SECONDS:
+                        yield _ndjson({"type": "emails", "emails": batch})
+                        yield _ndjson(dict(progress.snapshot(), type="progress"))
+                        batch = []
+                        last_flush = now
+                
+                if batch:
+                    yield _ndjson({"type": "emails", "emails": batch})
+                yield _ndjson(dict(progress.snapshot(), type="progress"))
+                logging.info(f"Successfully parsed {len(emails)} emails from file")
+
+                mailbox_id = index_emails(fingerprint, file_path, emails, metadata_only, folder_scans, progress,
+                                          replace_source=True)
+            record_ingest(progress, "parse")
+            mailbox = LoadedMailbox(emails, mailbox_id, source_path=file_path)
+        
+        if not mailbox.emails:
+            yield _ndjson({
+                "type": "error",
+                "detail": "No emails found in the file. The file may be empty, corrupted, or encrypted."
+            })
+            return
+        
+        entry = register_mailbox(session, mailbox, file_path)
+        response = search_mailbox(mailbox, SearchRequest())
+        response.update({
+            "type": "done",
+            "message": describe_load(mailbox),
+            "from_index": mailbox.from_index,
+            "changes": mailbox.changes,
+            "handle": entry.handle,
+        })
+        if profile:
+            response["profile"] = progress.profile()
+        yield _ndjson(response)
+        
+    except Exception as e:
+        logging.error(f"Error streaming file: {str(e)}")
+        yield _ndjson({"type": "error", "detail": f"Error processing file: {str(e)}"})
+
+
+@api_router.post("/browse-file/stream")
+async def browse_file_stream(request: FilePathRequest, x_session_id: Optional[str] = Header(None)):
+    """Parse OST file from local file path, streaming emails and progress as NDJSON"""
+    check_local_ost_file(request.file_path)
+    fingerprint = await run_in_threadpool(file_fingerprint, request.file_path)
+    return StreamingResponse(
+        stream_ingest(request.file_path, fingerprint, resolve_metadata_only(request.metadata_only),
+                      session_of(x_session_id), resolve_incremental(request.incremental), request.profile),
+        media_type="application/x-ndjson"
+    )
+
+
 @api_router.post("/search-emails")
-async def search_emails(search_request: SearchRequest):
-    """Search emails with date filters"""
-    global parsed_emails_cache
+async def search_emails(search_request: SearchRequest, x_session_id: Optional[str] = Header(None)):
+    """Search emails with date filters and an optional full-text query, one page at a time"""
+    targets = await run_in_threadpool(resolve_search_targets, session_of(x_session_id), search_request.handles)
     
-    if not parsed_emails_cache:
+    if not any(mailbox.emails for _handle, mailbox in targets):
         return {
             "success": True,
             "message": "No emails loaded. Please upload or browse an OST file first.",
             "email_count": 0,
+            "page_size": search_request.page_size,
+            "next_cursor": None,
             "emails": []
         }
     
-    # Filter emails by date
-    filtered_emails = filter_emails_by_date(
-        parsed_emails_cache,
-        search_request.start_date,
-        search_request.end_date
+    # Text queries, hydration and collapsing can take a while on large mailboxes
+    return APIJSONResponse(await run_in_threadpool(search_mailboxes, targets, search_request))
+
+
+def export_results(targets: List[tuple], export_request: ExportRequest) -> Iterator[tuple]:
+    """Every result of a search, in search order, as (mailbox number, position, ...)"""
+    mailboxes = [mailbox for _handle, mailbox in targets]
+    _total, results = matching_results(mailboxes, export_request)
+    if export_request.collapse_threads or export_request.collapse_duplicates:
+        return iter(collapse_results(mailboxes, results, export_request))
+    return results
+
+
+def exported_emails_of(targets: List[tuple], results: Iterator[tuple], export_format: str) -> Iterator[dict]:
+    """The complete fields of each result, one email at a time, as the export writers take them"""
+    for result in results:
+        handle, mailbox = targets[result[0]]
+        position = result[1]
+        email = mailbox.emails.row(position)
+        if email["body"] is None:
+            try:
+                email["body"] = load_email_body(mailbox, position)
+            except HTTPException as e:
+                # The response has started - export the email without its body rather than failing
+                logging.warning(f"Exporting email {email['email_id']} without its body: {e.detail}")
+                email["body"] = ""
+        email["handle"] = handle
+        email["attachments"] = [
+            (name, attachment_store.path(digest))
+            for name, digest in zip(email["attachment_names"], email["attachment_digests"])
+            if digest and attachment_store is not None and attachment_store.exists(digest)
+        ]
+        exported_emails.inc(format=export_format)
+        yield email
+
+
+@api_router.post("/export")
+async def export_emails(export_request: ExportRequest, x_session_id: Optional[str] = Header(None)):
+    """Stream every email matching a search's filters as mbox, a zip of EML files, CSV or Parquet"""
+    if export_request.format == "parquet" and not PYARROW_AVAILABLE:
+        raise HTTPException(status_code=400, detail="Parquet export needs the pyarrow package (pip install pyarrow)")
+    targets = await run_in_threadpool(resolve_search_targets, session_of(x_session_id), export_request.handles)
+    if not any(mailbox.emails for _handle, mailbox in targets):
+        raise HTTPException(status_code=404, detail="No emails loaded. Please upload or browse an OST file first.")
+    
+    # Query errors are reported before the response starts
+    results = await run_in_threadpool(export_results, targets, export_request)
+    writer = EXPORT_FORMATS[export_request.format]
+    filename = f"emails-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{writer.extension}"
+    return StreamingResponse(
+        stream_export(exported_emails_of(targets, results, export_request.format), export_request.format),
+        media_type=writer.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def facet_mailboxes(targets: List[tuple], facet_request: FacetRequest) -> dict:
+    """Facet counts over one or several (handle, mailbox) pairs, merged by value"""
+    start, end = parse_date_bounds(facet_request.start_date, facet_request.end_date)
+    total = attachments = 0
+    senders, sender_names, domains, recipients, histogram = Counter(), {}, Counter(), Counter(), Counter()
+    
+    for _handle, mailbox in targets:
+        facets = mailbox.facets()
+        lo, hi = facets.bounds(start, end)
+        total += hi - lo
+        attachments += facets.attachment_count(lo, hi)
+        for code, count in facets.sender.counts(lo, hi).items():
+            address = facets.sender.labels[code]
+            senders[address] += count
+            sender_names.setdefault(address, facets.sender_names.get(code))
+            domains[facets.sender_domains[code]] += count
+        for code, count in facets.recipient.counts(lo, hi).items():
+            recipients[facets.recipient.labels[code]] += count
+        for bucket, count in facets.histogram(facet_request.interval, lo, hi):
+            histogram[bucket] += count
+    
+    limit = facet_request.limit
+    response = {
+        "success": True,
+        "message": f"Counted {total} emails in {len(targets)} mailboxes",
+        "email_count": total,
+        "handles": [handle for handle, _mailbox in targets],
+        "facets": {
+            "senders": [
+                {"value": address, "name": sender_names.get(address), "count": count}
+                for address, count in senders.most_common(limit)
+            ],
+            "sender_domains": [{"value": domain, "count": count} for domain, count in domains.most_common(limit)],
+            "recipients": [{"value": recipient, "count": count} for recipient, count in recipients.most_common(limit)],
+            "attachments": {"with": attachments, "without": total - attachments},
+            "histogram": {
+                "interval": facet_request.interval,
+                "buckets": [{"bucket": bucket, "count": histogram[bucket]} for bucket in sorted(histogram)],
+            },
+        },
+    }
+    if start is not None or end is not None:
+        # Like searches, a date range leaves undated emails out - report how many
+        response["undated_email_count"] = sum(len(mailbox.date_index.undated) for _handle, mailbox in targets)
+    return response
+
+
+@api_router.post("/facets")
+async def get_facets(facet_request: FacetRequest, x_session_id: Optional[str] = Header(None)):
+    """Email counts by sender, sender domain, recipient, date and attachment presence"""
+    targets = await run_in_threadpool(resolve_search_targets, session_of(x_session_id), facet_request.handles)
+    
+    if not any(mailbox.emails for _handle, mailbox in targets):
+        return {
+            "success": True,
+            "message": "No emails loaded. Please upload or browse an OST file first.",
+            "email_count": 0,
+            "facets": None
+        }
+    
+    # The first request for a mailbox builds its facet index
+    return await run_in_threadpool(facet_mailboxes, targets, facet_request)
+
+
+@api_router.get("/emails/{email_id}")
+async def get_email(email_id: str, handle: Optional[str] = None, x_session_id: Optional[str] = Header(None)):
+    """Full detail (body and attachment names) of one email"""
+    mailbox, position = await run_in_threadpool(find_email, session_of(x_session_id), email_id, handle)
+    email = mailbox.emails[position]
+    
+    if email.body is None:
+        # Ingested without bodies - decode this one from the OST file
+        body = await run_in_threadpool(load_email_body, mailbox, position)
+        email = email.model_copy(update={"body": body})
+    
+    return {
+        "success": True,
+        "email": email
+    }
+
+
+@api_router.get("/emails/{email_id}/body")
+async def get_email_body(email_id: str, handle: Optional[str] = None, x_session_id: Optional[str] = Header(None)):
+    """Body of one email, decoded on demand if it was not extracted at ingest"""
+    mailbox, position = await run_in_threadpool(find_email, session_of(x_session_id), email_id, handle)
+    body = mailbox.emails[position].body
+    if body is None:
+        body = await run_in_threadpool(load_email_body, mailbox, position)
+    
+    return {
+        "success": True,
+        "email_id": email_id,
+        "body": body
+    }
+
+
+def list_attachments(mailbox: "LoadedMailbox", position: int) -> List[dict]:
+    row = mailbox.emails.row(position, include_body=False)
+    digests = row["attachment_digests"]
+    attachments = []
+    for index, name in enumerate(row["attachment_names"]):
+        digest = digests[index] if index < len(digests) and digests[index] else None
+        blob = mail_index.attachment_blob(digest) if digest and attachment_store is not None else None
+        stored = blob is not None and attachment_store.exists(digest)
+        attachments.append({
+            "index": index,
+            "name": name,
+            "digest": digest if stored else None,
+            "size": attachment_store.path(digest).stat().st_size if stored else None,
+            "text_status": blob['text_status'] if stored else None,
+        })
+    return attachments
+
+
+@api_router.get("/emails/{email_id}/attachments")
+async def get_email_attachments(email_id: str, handle: Optional[str] = None, x_session_id: Optional[str] = Header(None)):
+    """Attachments of one email, with whether their data was stored and their text extracted"""
+    mailbox, position = await run_in_threadpool(find_email, session_of(x_session_id), email_id, handle)
+    attachments = await run_in_threadpool(list_attachments, mailbox, position)
+    return {
+        "success": True,
+        "email_id": email_id,
+        "attachments": attachments
+    }
+
+
+@api_router.get("/emails/{email_id}/attachments/{index}")
+async def download_attachment(email_id: str, index: int, handle: Optional[str] = None,
+                              x_session_id: Optional[str] = Header(None)):
+    """Data of one attachment, from the attachment store"""
+    mailbox, position = await run_in_threadpool(find_email, session_of(x_session_id), email_id, handle)
+    attachments = await run_in_threadpool(list_attachments, mailbox, position)
+    if not 0 <= index < len(attachments):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    attachment = attachments[index]
+    if attachment["digest"] is None:
+        raise HTTPException(status_code=404, detail="Attachment data was not stored. Enable OST_EXTRACT_ATTACHMENTS and reload the mailbox.")
+    return FileResponse(
+        attachment_store.path(attachment["digest"]),
+        filename=attachment["name"],
+        media_type="application/octet-stream",
     )
+
+
+@api_router.get("/threads/{thread_id}")
+async def get_thread(thread_id: str, handle: Optional[str] = None, projection: Literal["summary", "full"] = "summary",
+                     x_session_id: Optional[str] = Header(None)):
+    """Messages of one conversation, oldest first"""
+    response = await run_in_threadpool(thread_messages, session_of(x_session_id), thread_id, handle, projection)
+    return APIJSONResponse(response)
+
+
+def thread_messages(session: str, thread_id: str, handle: Optional[str], projection: str) -> dict:
+    """A conversation gathered from the given mailbox, or from all of the session's, or 404"""
+    messages = []
+    for candidate in candidate_handles(session, handle):
+        mailbox = get_catalog_mailbox(session, candidate)
+        epoch_of = mailbox.date_index.epoch_of
+        for position in mailbox.threads().thread(thread_id, epoch_of):
+            messages.append((epoch_of(position), candidate, mailbox.emails, position))
+    if not messages:
+        raise HTTPException(status_code=404, detail="Thread not found")
     
+    messages.sort(key=lambda message: (message[0] is None, message[0] or 0.0))
     return {
         "success": True,
-        "message": f"Found {len(filtered_emails)} emails matching criteria",
-        "email_count": len(filtered_emails),
-        "emails": filtered_emails
+        "thread_id": thread_id,
+        "email_count": len(messages),
+        "emails": email_fragments([(owner, store, position) for _epoch, owner, store, position in messages],
+                                  projection),
     }
 
 
+def candidate_handles(session: str, handle: Optional[str] = None) -> List[str]:
+    """The given handle, or the session's current mailbox followed by its others"""
+    if handle:
+        return [handle]
+    current = get_loaded_mailbox(session)
+    candidates = [current[0]] if current else []
+    candidates += [entry.handle for entry in mailbox_catalog.entries(session) if entry.handle not in candidates]
+    return candidates
+
+
+def find_email(session: str, email_id: str, handle: Optional[str] = None) -> tuple:
+    """The mailbox holding an email and its position there, or 404.
+
+    Without a handle the session's current mailbox is tried first, then its others.
+    """
+    for candidate in candidate_handles(session, handle):
+        mailbox = get_catalog_mailbox(session, candidate)
+        position = mailbox.position_of(email_id)
+        if position is not None:
+            return mailbox, position
+    raise HTTPException(status_code=404, detail="Email not found")
+
+
+# Open pypff handles for decoding bodies on demand, by file path. pypff
+# handles are not thread-safe, so all on-demand decoding is serialized.
+_body_pst_handles = {}
+_body_pst_lock = threading.Lock()
+
+
+def forget_body_source(source_path: Optional[str]):
+    """Drop the pypff handle and cached bodies of a file that has changed"""
+    with _body_pst_lock:
+        pst = _body_pst_handles.pop(source_path, None)
+        if pst is not None:
+            try:
+                pst.close()
+            except Exception:
+                pass
+    # Cache keys include the message's location, which may now hold another message
+    body_cache.clear()
+
+
+def load_email_body(mailbox: LoadedMailbox, position: int) -> str:
+    """Decode an email's body from its OST file, through the LRU body cache"""
+    email = mailbox.emails[position]
+    if email.folder_path is None or email.message_index is None or not mailbox.source_path:
+        raise HTTPException(status_code=409, detail="The body of this email was not stored and cannot be located in the file")
+    
+    key = (mailbox.source_path, email.folder_path, email.message_index)
+    body = body_cache.get(key)
+    if body is not None:
+        return body
+    
+    if not PYPFF_AVAILABLE or not os.path.exists(mailbox.source_path):
+        raise HTTPException(status_code=409, detail="The OST file of this email is no longer available. Reload it with bodies.")
+    
+    with _body_pst_lock:
+        try:
+            pst = _body_pst_handles.get(mailbox.source_path)
+            if pst is None:
+                pst = pypff.file()
+                pst.open(mailbox.source_path)
+                _body_pst_handles[mailbox.source_path] = pst
+            
+            folder = pst.get_root_folder()
+            for index in email.folder_path.split("/") if email.folder_path else []:
+                folder = folder.get_sub_folder(int(index))
+            message = folder.get_sub_message(email.message_index)
+        except Exception as e:
+            logging.error(f"Error locating message {email.email_id}: {str(e)}")
+            raise HTTPException(status_code=409, detail="This email could not be found in its OST file. The file may have changed - please reload it.")
+        
+        subject = message.subject if hasattr(message, 'subject') and message.subject else "(No Subject)"
+        if subject != email.subject:
+            raise HTTPException(status_code=409, detail="The OST file has changed since it was loaded. Please reload it.")
+        body = extract_body_text(message) or ""
+    
+    body_cache.put(key, body)
+    return body
+
+
 @api_router.get("/load-sample-data")
-async def load_sample_data():
+async def load_sample_data(x_session_id: Optional[str] = Header(None)):
     """Load sample email data for testing"""
-    global parsed_emails_cache
-    parsed_emails_cache = get_sample_emails()
+    emails = get_sample_emails()
+    
+    # Index the sample data too, so text search works on it
+    sample_rows = [email.model_dump() for email in emails]
+    fingerprint = "sample-" + hashlib.sha256(json.dumps(sample_rows, sort_keys=True).encode()).hexdigest()
+    store = new_message_store().extend(emails)
+    mailbox = mail_index.find_mailbox(fingerprint)
+    if mailbox:
+        mail_index.touch_mailbox(mailbox['id'])
+        mailbox_id = mailbox['id']
+    else:
+        mailbox_id = index_emails(fingerprint, None, store)
+    mailbox = LoadedMailbox(store, mailbox_id)
+    entry = register_mailbox(session_of(x_session_id), mailbox, "Sample data")
     
+    response = search_mailbox(mailbox, SearchRequest())
+    response["message"] = f"Loaded {len(emails)} sample emails"
+    response["handle"] = entry.handle
+    return APIJSONResponse(response)
+
+
+@api_router.get("/mailboxes")
+async def list_mailboxes(x_session_id: Optional[str] = Header(None)):
+    """The session's loaded mailboxes, most recently used first, and the catalog's memory use"""
+    session = session_of(x_session_id)
+    current = mailbox_catalog.current(session)
     return {
         "success": True,
-        "message": f"Loaded {len(parsed_emails_cache)} sample emails",
-        "email_count": len(parsed_emails_cache),
-        "emails": parsed_emails_cache
+        "current": current.handle if current else None,
+        "mailboxes": [entry.to_dict() for entry in mailbox_catalog.entries(session)],
+        "catalog": mailbox_catalog.stats(),
     }
 
 
+@api_router.delete("/mailboxes/{handle}")
+async def unload_mailbox(handle: str, x_session_id: Optional[str] = Header(None)):
+    """Drop a mailbox from memory (it stays in the index)"""
+    try:
+        entry = mailbox_catalog.remove(session_of(x_session_id), handle)
+    except MailboxNotFound:
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+    return {"success": True, "mailbox": entry.to_dict()}
+
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Ingest, cache, catalog and per-route request metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 
 
 # Include the router in the main app
 app.include_router(api_router)
 
+
+app.add_middleware(RequestMetricsMiddleware, registry=metrics)
+
+# Compress large JSON responses (gzip, or brotli when installed) for clients that accept it
+if os.environ.get('OST_COMPRESSION', '1').strip().lower() in ('1', 'true', 'yes'):
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get('OST_COMPRESS_MIN_BYTES', '1024')))
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
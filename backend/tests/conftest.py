@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+import fake_pypff
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Importing the server opens the mail index: point it at a scratch one
+os.environ["OST_INDEX_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ost-tests-"), "index.sqlite3")
+os.environ["OST_PARSE_WORKERS"] = "1"
+
+
+class FakeOstFile:
+    """An OST file on disk whose contents, as the server's pypff sees them, are ``root``"""
+
+    def __init__(self, path, root):
+        self.path = str(path)
+        self.root = root
+        self._mtime = 1_700_000_000
+        # The fingerprint reads the content: make it unique to the file
+        with open(self.path, "wb") as f:
+            f.write(self.path.encode().ljust(4096, b"\0"))
+        self.touch()
+
+    def touch(self):
+        """Make the file look changed (a new mtime, so a new fingerprint)"""
+        self._mtime += 60
+        os.utime(self.path, (self._mtime, self._mtime))
+
+
+@pytest.fixture
+def fake_ost(tmp_path, monkeypatch):
+    import ost_parser
+    import server
+
+    ost = FakeOstFile(tmp_path / "mailbox.ost", fake_pypff.make_tree(
+        [fake_pypff.FakeMessage(number, body=f"budget report {number}" if number % 2 else None)
+         for number in range(40)],
+        [fake_pypff.FakeMessage(number) for number in range(40, 50)],
+    ))
+    module = fake_pypff.module(ost.root)
+    for parser in (server, ost_parser):
+        monkeypatch.setattr(parser, "pypff", module)
+        monkeypatch.setattr(parser, "PYPFF_AVAILABLE", True)
+    yield ost
+    server.mailbox_catalog.clear()
@@ -0,0 +1,84 @@
+"""A stand-in for the pypff module: an OST file as a tree of folders and messages held in memory"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+
+class FakeAttachment:
+    def __init__(self, name: str, data: bytes):
+        self.name = self.long_filename = name
+        self.data = data
+        self._offset = 0
+
+    def get_size(self) -> int:
+        return len(self.data)
+
+    def read_buffer(self, size: int) -> bytes:
+        data = self.data[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def seek_offset(self, offset: int, whence: int = 0):
+        self._offset = offset
+
+
+class FakeMessage:
+    def __init__(self, number: int, subject: str = None, body: str = None, html_body: str = None,
+                 attachments=()):
+        self.identifier = 1000 + number
+        self.subject = subject or f"Message {number}"
+        self.conversation_topic = self.subject
+        self.conversation_index = None
+        self.sender_name = f"Sender {number % 3}"
+        self.sender_email_address = f"sender{number % 3}@example.com"
+        self.display_to = "Team"
+        self.client_submit_time = self.delivery_time = datetime(2024, 1, 1) + timedelta(hours=number)
+        self.transport_headers = f"Message-ID: <{number}@example.com>\r\n"
+        self.plain_text_body = None if html_body is not None else (body or f"Body of message {number}").encode()
+        self.html_body = html_body.encode() if html_body is not None else None
+        self.rtf_body = None
+        self._attachments = [FakeAttachment(name, data) for name, data in attachments]
+        self.number_of_attachments = len(self._attachments)
+
+    def get_attachment(self, index: int) -> FakeAttachment:
+        return self._attachments[index]
+
+
+class FakeFolder:
+    def __init__(self, name: str, identifier: int, messages=(), folders=()):
+        self.name = name
+        self.identifier = identifier
+        self.messages = list(messages)
+        self.folders = list(folders)
+
+    @property
+    def number_of_sub_folders(self) -> int:
+        return len(self.folders)
+
+    @property
+    def number_of_sub_messages(self) -> int:
+        return len(self.messages)
+
+    def get_sub_folder(self, index: int) -> "FakeFolder":
+        return self.folders[index]
+
+    def get_sub_message(self, index: int) -> FakeMessage:
+        return self.messages[index]
+
+    @property
+    def sub_folders(self):
+        return iter(self.folders)
+
+    @property
+    def sub_messages(self):
+        return iter(self.messages)
+
+
+def make_tree(inbox, archive=()) -> FakeFolder:
+    """A root folder holding an Inbox and an Archive folder with the given messages"""
+    return FakeFolder("Root", 1, folders=[FakeFolder("Inbox", 2, inbox), FakeFolder("Archive", 3, archive)])
+
+
+def module(root: FakeFolder) -> SimpleNamespace:
+    """An object to use in place of the pypff module, whose every file is ``root``"""
+    return SimpleNamespace(file=lambda: SimpleNamespace(open=lambda path: None, close=lambda: None,
+                                                        get_root_folder=lambda: root))
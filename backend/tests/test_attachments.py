@@ -0,0 +1,148 @@
+import io
+import threading
+import zipfile
+import zlib
+from concurrent.futures import Future
+
+from attachment_store import CHUNK_SIZE, AttachmentStore
+from attachment_text import AttachmentTextExtractor, extract_text
+
+
+class ChunkReader:
+    """``read(length)`` over bytes, as AttachmentStore.put takes it"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def __call__(self, length: int) -> bytes:
+        chunk = self.data[self.offset:self.offset + length]
+        self.offset += len(chunk)
+        return chunk
+
+    def rewind(self):
+        self.offset = 0
+
+
+def test_store_deduplicates(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    digest, size, written = store.put(ChunkReader(b"hello"), 5)
+    assert written and size == 5 and store.path(digest).read_bytes() == b"hello"
+    assert store.put(ChunkReader(b"hello"), 5) == (digest, 5, False)
+    assert store.put(ChunkReader(b"hello"), None) == (digest, 5, False)
+    store.remove(digest)
+    assert not store.exists(digest)
+    store.remove(digest)
+
+
+def test_store_large_blobs(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    data = bytes(range(256)) * (CHUNK_SIZE // 128)
+    first = ChunkReader(data)
+    digest, size, written = store.put(first, len(data), first.rewind)
+    assert written and size == len(data) and store.path(digest).read_bytes() == data
+
+    # Same size and first chunk: only hashed, not written again
+    again = ChunkReader(data)
+    assert store.put(again, len(data), again.rewind) == (digest, len(data), False)
+    # Same size and first chunk, other content: read again and stored
+    other_data = data[:-1] + b"!"
+    other = ChunkReader(other_data)
+    other_digest, _size, written = store.put(other, len(other_data), other.rewind)
+    assert written and other_digest != digest
+    assert store.path(other_digest).read_bytes() == other_data
+    assert not list((tmp_path / "tmp").iterdir())
+
+
+def docx(text: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("[Content_Types].xml", "<Types/>")
+        archive.writestr("word/document.xml",
+                         f"<w:document><w:body><w:p><w:r><w:t>{text}</w:t></w:r></w:p>"
+                         "<w:p><w:r><w:t xml:space=\"preserve\">second &amp; last</w:t></w:r></w:p></w:body></w:document>")
+    return buffer.getvalue()
+
+
+def pdf(text: str) -> bytes:
+    stream = zlib.compress(f"BT /F1 12 Tf 72 712 Td ({text}) Tj ET".encode())
+    return (b"%PDF-1.4\n1 0 obj\n<< /Length " + str(len(stream)).encode() + b" /Filter /FlateDecode >>\nstream\n"
+            + stream + b"\nendstream\nendobj\n%%EOF\n")
+
+
+def test_extract_text(tmp_path):
+    files = {
+        "notes.txt": b"plain   text\n",
+        "page.html": b"<p>Hello <b>world</b> &amp; more</p>",
+        "report.docx": docx("Quarterly report"),
+        "scan.pdf": pdf("Invoice 42"),
+        "photo.jpg": b"\xff\xd8\xff\xe0",
+        "broken.docx": b"PK\x03\x04 not really a zip",
+    }
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+
+    def extract(name):
+        return extract_text(str(tmp_path / name), name)
+
+    assert extract("notes.txt") == ("done", "plain text")
+    assert extract("page.html") == ("done", "Hello world & more")
+    assert extract("report.docx") == ("done", "Quarterly report\nsecond & last")
+    assert extract("photo.jpg") == ("unsupported", None)
+    assert extract("broken.docx") == ("failed", None)
+    status, text = extract("scan.pdf")
+    assert status == "done" and "Invoice 42" in text
+
+
+def test_extractor_reports_results(tmp_path):
+    (tmp_path / "a.txt").write_text("alpha")
+    (tmp_path / "b.jpg").write_bytes(b"\xff\xd8")
+    results = {}
+    done = threading.Event()
+
+    def on_result(digest, status, text):
+        results[digest] = (status, text)
+        if len(results) == 2:
+            done.set()
+
+    extractor = AttachmentTextExtractor(1, on_result)
+    try:
+        items = [("a", str(tmp_path / "a.txt"), "a.txt"), ("b", str(tmp_path / "b.jpg"), "b.jpg")]
+        assert extractor.submit(items) == 2
+        assert done.wait(60)
+    finally:
+        extractor.shutdown()
+    assert results == {"a": ("done", "alpha"), "b": ("unsupported", None)}
+
+
+def test_cancelled_extractions_stay_pending():
+    results = []
+    extractor = AttachmentTextExtractor(1, lambda *result: results.append(result))
+    extractor._pending.add("a")
+    future = Future()
+    future.cancel()
+    extractor._finish("a", future)
+    assert results == [] and extractor.queued == 0 and extractor.completed == 0
+
+    future = Future()
+    future.set_exception(RuntimeError("worker died"))
+    extractor._finish("b", future)
+    assert results == [("b", "failed", None)]
+
+
+def test_blobs_are_pruned_once_no_ingest_is_in_flight(tmp_path, monkeypatch):
+    import server
+
+    store = AttachmentStore(str(tmp_path))
+    digest, _size, _written = store.put(ChunkReader(b"orphan"), 6)
+    monkeypatch.setattr(server, "attachment_store", store)
+    monkeypatch.setattr(server.mail_index, "prune_attachment_blobs", lambda: [digest])
+    monkeypatch.setattr(server.mail_index, "pending_attachment_blobs", lambda: [])
+
+    with server.ingest_in_flight():
+        with server.ingest_in_flight():
+            # Another ingest may still be writing rows that refer to the blob
+            server.update_attachment_blobs()
+            assert store.exists(digest)
+        assert store.exists(digest)
+    assert not store.exists(digest)
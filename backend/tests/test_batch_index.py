@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import batch_index
+import ost_parser
+from batch_index import BatchIndexer, find_ost_files, iter_spooled_rows, parse_file
+
+
+def test_parse_workers_do_not_import_the_server(tmp_path):
+    # What a spawned worker does: import the module and call parse_file
+    index_path = tmp_path / "index.sqlite3"
+    script = ("import sys, batch_index\n"
+              "try:\n"
+              f"    batch_index.parse_file({str(tmp_path / 'missing.ost')!r}, True, {str(tmp_path)!r})\n"
+              "except Exception:\n"
+              "    pass\n"
+              "print(sorted(name for name in ('server', 'mail_index', 'attachment_text') if name in sys.modules))")
+    completed = subprocess.run([sys.executable, "-c", script], cwd=batch_index.__file__.rsplit(os.sep, 1)[0],
+                               env=dict(os.environ, OST_INDEX_PATH=str(index_path)),
+                               capture_output=True, text=True, check=True)
+    assert completed.stdout == "[]\n"
+    assert not index_path.exists()
+
+
+def test_find_ost_files(tmp_path):
+    for name in ("b/two.ost", "a/one.OST", "a/notes.txt", "three.ost"):
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"")
+    assert [os.path.relpath(path, tmp_path) for path in find_ost_files(str(tmp_path))] == \
+        ["three.ost", os.path.join("a", "one.OST"), os.path.join("b", "two.ost")]
+
+
+def test_parsed_rows_are_spooled_and_indexed(fake_ost, tmp_path, monkeypatch):
+    import server
+
+    monkeypatch.setattr(batch_index, "SPOOL_BATCH_SIZE", 7)
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    outcome = parse_file(fake_ost.path, False, str(spool_dir))
+    spool_path, count, counters, folder_scans, _seconds = outcome
+    assert count == 50 and counters["messages_parsed"] == 50 and folder_scans
+    parsed = server.parse_ost_file(fake_ost.path)
+    assert list(iter_spooled_rows(spool_path)) == list(parsed.iter_rows())
+
+    indexer = BatchIndexer(server, 1, spool_dir=str(spool_dir))
+    fingerprint = server.file_fingerprint(fake_ost.path)
+    result = indexer.store(fake_ost.path, fingerprint, outcome)
+    assert result["status"] == "indexed" and result["emails"] == 50
+    assert os.listdir(spool_dir) == []
+    mailbox = server.mail_index.find_mailbox(fingerprint)
+    assert mailbox["email_count"] == 50 and server.mail_index.folder_scans(mailbox["id"]).keys() == folder_scans.keys()
+    assert [row["email_id"] for row in server.mail_index.iter_emails(mailbox["id"])] == list(parsed.email_ids)
+
+    # Indexed files are not parsed again
+    indexer.run([fake_ost.path])
+    assert indexer.results[-1] == {"path": fake_ost.path, "status": "already indexed"}
+
+
+def test_failed_parse_removes_its_spool_file(fake_ost, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        yield from ()
+        raise RuntimeError("corrupt file")
+
+    monkeypatch.setattr(ost_parser, "iter_ost_file", fail)
+    with pytest.raises(RuntimeError):
+        parse_file(fake_ost.path, True, str(tmp_path))
+    assert os.listdir(tmp_path) == ["mailbox.ost"]
+
+
+def test_waiting_for_attachment_text_gives_up_at_the_deadline(capsys):
+    extractor = SimpleNamespace(queued=3)
+    server = SimpleNamespace(attachment_store=None, attachment_extractor=extractor,
+                             IngestProgress=ost_parser.IngestProgress)
+    indexer = BatchIndexer(server, 1)
+    assert indexer.wait_for_attachment_text(timeout=0.05, poll=0.01) is False
+    assert "3 attachments will be extracted after a later ingest" in capsys.readouterr().out
+    extractor.queued = 0
+    assert indexer.wait_for_attachment_text(timeout=0.05, poll=0.01) is True
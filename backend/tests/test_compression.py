@@ -0,0 +1,70 @@
+import gzip
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, negotiate_encoding
+
+BIG = {"items": ["repetitive text"] * 200}
+
+
+def make_client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    @app.get("/big")
+    def big():
+        return JSONResponse(BIG)
+
+    @app.get("/small")
+    def small():
+        return JSONResponse({"ok": True})
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(((b'{"n":%d}\n' % n) * 100 for n in range(3)), media_type="application/x-ndjson")
+
+    return TestClient(app)
+
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "BROTLI_AVAILABLE", False)
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("br") is None
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("*") == "gzip"
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("") is None
+    monkeypatch.setattr(compression, "BROTLI_AVAILABLE", True)
+    assert negotiate_encoding("gzip, br") == "br"
+    assert negotiate_encoding("gzip;q=1, br;q=0.5") == "gzip"
+    assert negotiate_encoding("br;q=bad, gzip") == "gzip"
+
+
+def test_large_json_is_compressed():
+    client = make_client()
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json() == BIG
+
+    raw = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers and raw.json() == BIG
+
+
+def test_small_and_streamed_responses_pass_through():
+    client = make_client()
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers and small.json() == {"ok": True}
+    stream = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in stream.headers
+    assert stream.content.count(b"\n") == 300
+
+
+def test_gzip_output_is_reproducible():
+    body = b"x" * 5000
+    assert compression.compress(body, "gzip") == compression.compress(body, "gzip")
+    assert gzip.decompress(compression.compress(body, "gzip")) == body
@@ -0,0 +1,54 @@
+import base64
+
+from conversations import (ThreadIndex, conversation_index_from_headers, normalize_subject, participant_names,
+                           thread_id_of)
+from message_store import MessageStore
+
+
+def test_normalize_subject():
+    assert normalize_subject("RE: Fw:  Budget   2024") == "budget 2024"
+    assert normalize_subject("Re[2]: AW: Budget") == "budget"
+    assert normalize_subject("Reply needed") == "reply needed"
+    assert normalize_subject(None) == ""
+
+
+def test_participant_names():
+    assert participant_names("Ann", "ann@example.com", "Bob; 'Carol' ;") == ["ann", "bob", "carol"]
+    assert participant_names(None, "ann@example.com", None) == ["ann@example.com"]
+
+
+def test_thread_id_of_topic_and_participants():
+    original = thread_id_of(subject="Budget", sender_name="Ann", recipients="Bob")
+    reply = thread_id_of(subject="RE: Budget", sender_name="Bob", recipients="Ann")
+    assert reply == original
+    assert thread_id_of(subject="Budget", sender_name="Ann", recipients="Dave") != original
+    assert thread_id_of(topic="Budget", subject="RE: something else", sender_name="Ann", recipients="Bob") == original
+
+
+def test_thread_id_of_conversation_index():
+    header = bytes(range(22))
+    first = thread_id_of(conversation_index=header, subject="Budget")
+    reply = thread_id_of(conversation_index=header + b"\x01\x02\x03\x04\x05", subject="Something else")
+    assert first == reply
+    # Too short to carry a header: threaded by topic
+    assert thread_id_of(conversation_index=b"\x01", subject="Budget") == thread_id_of(subject="Budget")
+
+    headers = "Thread-Index: " + base64.b64encode(header).decode() + "\r\n"
+    assert conversation_index_from_headers(headers) == header
+    assert conversation_index_from_headers("Thread-Index: not*base64") is None
+
+
+def test_thread_index():
+    a, b = "00000000000000aa", "00000000000000bb"
+    store = MessageStore()
+    for thread_id, epoch in ((a, 30.0), (b, 10.0), (a, 10.0), (None, 5.0), (a, None)):
+        store.append_fields(thread_id=thread_id, date_epoch=epoch)
+    threads = ThreadIndex(store)
+    assert len(threads) == 3
+    assert list(threads.codes) == [0, 1, 0, 2, 0]
+    assert threads.code_of(a) == 0 and threads.code_of("ff") is None and threads.code_of("zz") is None
+    assert threads.size(0) == 3 and threads.members(0) == [0, 2, 4]
+    assert threads.members(1) == [1]
+    # Oldest first, undated last
+    assert threads.thread(a, store.date_epoch) == [2, 0, 4]
+    assert threads.thread("ff", store.date_epoch) == []
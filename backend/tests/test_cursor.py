@@ -0,0 +1,77 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def make_mailbox(count, mailbox_id=None, prefix="id"):
+    store = server.new_message_store()
+    for number in range(count):
+        store.append_fields(email_id=f"{prefix}{number}", subject=f"Subject {number}",
+                            date=f"2024-01-{number + 1:02d}T00:00:00")
+    return server.LoadedMailbox(store, mailbox_id=mailbox_id)
+
+
+def page_ids(response):
+    return [email["email_id"] for email in json.loads(server.APIJSONResponse(response).body)["emails"]]
+
+
+def test_cursor_round_trip():
+    mailboxes = [make_mailbox(3, mailbox_id=1)]
+    request = server.SearchRequest(query="budget")
+    cursor = server.encode_cursor(mailboxes, request, 40)
+    assert server.decode_cursor(mailboxes, request.model_copy(update={"cursor": cursor})) == 40
+    # Paging fields are not part of the scope
+    assert server.decode_cursor(mailboxes, request.model_copy(update={"cursor": cursor, "page_size": 5})) == 40
+    assert server.decode_cursor(mailboxes, request) == 0
+
+
+@pytest.mark.parametrize("change", [
+    {"query": "forecast"},
+    {"start_date": "2024-01-01"},
+    {"collapse_threads": True},
+    {"collapse_duplicates": True},
+])
+def test_cursor_of_another_search_is_rejected(change):
+    mailboxes = [make_mailbox(3, mailbox_id=1)]
+    request = server.SearchRequest(query="budget")
+    cursor = server.encode_cursor(mailboxes, request, 10)
+    with pytest.raises(HTTPException) as raised:
+        server.decode_cursor(mailboxes, request.model_copy(update={"cursor": cursor, **change}))
+    assert raised.value.status_code == 400
+
+
+def test_cursor_of_changed_mailboxes_is_rejected():
+    request = server.SearchRequest()
+    cursor = server.encode_cursor([make_mailbox(3, mailbox_id=1)], request, 10)
+    request = request.model_copy(update={"cursor": cursor})
+    for mailboxes in ([make_mailbox(4, mailbox_id=1)], [make_mailbox(3, mailbox_id=2)]):
+        with pytest.raises(HTTPException) as raised:
+            server.decode_cursor(mailboxes, request)
+        assert raised.value.status_code == 400
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "e30", server.base64.urlsafe_b64encode(b"[1]").decode()])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as raised:
+        server.decode_cursor([make_mailbox(1)], server.SearchRequest(cursor=cursor))
+    assert raised.value.status_code == 400
+
+
+@pytest.mark.parametrize("mailbox_count", [1, 2])
+def test_paging_returns_every_email_once(mailbox_count):
+    targets = [(f"h{number}", make_mailbox(7, prefix=f"m{number}-")) for number in range(mailbox_count)]
+    seen, cursor = [], None
+    while True:
+        response = server.search_mailboxes(targets, server.SearchRequest(page_size=3, cursor=cursor))
+        assert response["email_count"] == 7 * mailbox_count
+        seen += page_ids(response)
+        cursor = response["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == 7 * mailbox_count
+    assert sorted(seen) == sorted(f"m{m}-{n}" for m in range(mailbox_count) for n in range(7))
+    # Newest first
+    assert seen[:mailbox_count] == [f"m{m}-6" for m in range(mailbox_count)]
@@ -0,0 +1,53 @@
+from date_index import DateIndex, parse_email_date
+
+
+def test_parse_email_date():
+    assert parse_email_date("1970-01-02T00:00:00") == 86400.0
+    assert parse_email_date("1970-01-02T00:00:00Z") == 86400.0
+    assert parse_email_date("1970-01-02 00:00:00.5") == 86400.5
+    # The wall-clock time, whatever the offset
+    assert parse_email_date("1970-01-02T00:00:00+02:00") == 86400.0
+    assert parse_email_date("not a date") is None
+    assert parse_email_date(None) is None
+
+
+def make_index():
+    # Positions 1 and 4 are undated
+    return DateIndex([30.0, None, 10.0, 20.0, None, 10.0])
+
+
+def test_range_is_oldest_first():
+    index = make_index()
+    assert len(index) == 6
+    assert index.undated == [1, 4]
+    assert index.range() == [2, 5, 3, 0]
+    assert index.range(10.0, 20.0) == [2, 5, 3]
+    assert index.range(11.0, 19.0) == []
+    assert index.range(start=25.0) == [0]
+
+
+def test_page():
+    index = make_index()
+    assert index.page() == [0, 3, 5, 2]
+    assert index.page(offset=1, limit=2) == [3, 5]
+    assert index.page(offset=3, limit=2) == [2]
+    assert index.page(offset=10, limit=2) == []
+    assert index.page(newest_first=False, offset=1, limit=2) == [5, 3]
+    assert index.page(end=15.0) == [5, 2]
+
+
+def test_count_and_lookups():
+    index = make_index()
+    assert index.count() == 4
+    assert index.count(10.0, 10.0) == 2
+    assert index.epoch_of(3) == 20.0
+    assert index.epoch_of(1) is None
+    assert index.contains(3, 15.0, 25.0)
+    assert not index.contains(0, 15.0, 25.0)
+    assert not index.contains(1)
+
+
+def test_from_dates():
+    index = DateIndex.from_dates(["1970-01-01T00:01:00", "garbage", "1970-01-01T00:00:30"])
+    assert index.range() == [2, 0]
+    assert index.undated == [1]
@@ -0,0 +1,108 @@
+import random
+
+from dedup import (DuplicateFilter, DuplicateIndex, NEAR_DUPLICATE_DISTANCE, SimHasher, content_hash, copy_id,
+                   email_identity, hamming_distance, message_id_from_headers, popcount)
+from message_store import MessageStore
+
+WORDS = ("budget forecast meeting quarter report review draft invoice travel project schedule team "
+         "client contract update summary agenda deadline offer office plan sales notes call").split()
+
+
+def body_of(seed: int, words: int = 80) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def test_popcount_and_hamming_distance():
+    assert popcount(0) == 0
+    assert popcount(0b1011) == 3
+    assert popcount((1 << 64) - 1) == 64
+    assert hamming_distance(0b1010, 0b0110) == 2
+
+
+def test_message_id_from_headers():
+    headers = "Subject: hi\r\nMessage-ID: <abc@example.com>\r\nX-Other: 1\r\n"
+    assert message_id_from_headers(headers) == "<abc@example.com>"
+    assert message_id_from_headers("Subject: hi") is None
+
+
+def test_identity_and_copy_ids():
+    by_id = email_identity("<a@b>", "Hi", "2024-01-01", "a@b", "Bob")
+    assert by_id == email_identity("<a@b>", "Other subject", None, None, None)
+    by_headers = email_identity(None, "Hi", "2024-01-01", "A@B", "Bob")
+    assert by_headers == email_identity(None, "Hi", "2024-01-01", "a@b", "Bob")
+    assert by_headers != email_identity(None, "Hi", "2024-01-02", "a@b", "Bob")
+
+    # Every copy of a message has an id of its own
+    assert copy_id(by_id, 1) != copy_id(by_id, 2)
+    assert copy_id(by_id, 1) == copy_id(by_id, 1)
+    assert copy_id(by_id, None) == by_id
+
+
+def test_sample_emails_get_copy_ids():
+    import server
+
+    emails = server.get_sample_emails()
+    assert len({email.email_id for email in emails}) == len(emails)
+    for email in emails:
+        identity = email_identity(None, email.subject, email.date, email.sender_email, email.recipients)
+        assert email.email_id == copy_id(identity, email.message_identifier) != identity
+        assert email.content_hash == format(content_hash(identity, email.body), "016x")
+
+
+def test_content_hash_ignores_whitespace():
+    identity = email_identity("<a@b>", None, None, None, None)
+    assert content_hash(identity, "hello  world\n") == content_hash(identity, "hello world")
+    assert content_hash(identity, "hello world") != content_hash(identity, "hello there")
+    assert content_hash(identity, None) != content_hash(identity, "")
+
+
+def test_simhash():
+    hasher = SimHasher()
+    body = body_of(1)
+    assert hasher.simhash("too short") == 0
+    assert hasher.simhash(body) == hasher.simhash(body.upper())
+    edited = body.split()
+    edited[40] = "changed"
+    assert hamming_distance(hasher.simhash(body), hasher.simhash(" ".join(edited))) <= NEAR_DUPLICATE_DISTANCE
+    assert hamming_distance(hasher.simhash(body), hasher.simhash(body_of(2))) > NEAR_DUPLICATE_DISTANCE
+
+
+def make_store(messages):
+    """A store of (sender, content hash, body) messages"""
+    hasher = SimHasher()
+    store = MessageStore()
+    for sender, digest, body in messages:
+        simhash = hasher.simhash(body)
+        store.append_fields(sender_email=sender, body=body, content_hash=format(digest, "x"),
+                            simhash=format(simhash, "x") if simhash else None)
+    return store
+
+
+def test_duplicate_index():
+    body, other = body_of(1), body_of(2)
+    near = body + " sent from my phone"
+    store = make_store([
+        ("ann@example.com", 1, body),
+        ("ann@example.com", 2, other),
+        ("ann@example.com", 1, body),       # exact copy of 0
+        ("ann@example.com", 3, near),       # near copy of 0
+        ("bob@example.com", 4, near),       # same text, another sender
+        ("bob@example.com", 5, "short"),    # no SimHash
+    ])
+    duplicates = DuplicateIndex(store)
+    assert len(duplicates) == 4
+    assert list(duplicates.codes) == [0, 1, 0, 0, 2, 3]
+    assert list(duplicates.first) == [0, 1, 4, 5]
+    assert list(duplicates.sizes) == [3, 1, 1, 1]
+
+
+def test_duplicate_filter():
+    hasher = SimHasher()
+    body = body_of(1)
+    seen = DuplicateFilter()
+    seen.add(1, hasher.simhash(body), "ann@example.com", "first")
+    assert seen.find(1, 0, None) == "first"
+    assert seen.find(2, hasher.simhash(body + " thanks"), "ann@example.com") == "first"
+    assert seen.find(2, hasher.simhash(body + " thanks"), "bob@example.com") is None
+    assert seen.find(2, hasher.simhash(body_of(2)), "ann@example.com") is None
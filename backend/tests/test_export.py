@@ -0,0 +1,114 @@
+import csv
+import email
+import email.policy
+import io
+import mailbox
+import zipfile
+
+import pytest
+
+import export
+from export import EXPORT_COLUMNS, email_to_mime, stream_export
+
+
+def make_email(number, **fields):
+    email_fields = {
+        "email_id": f"id{number}",
+        "handle": "h1",
+        "subject": f"Subject {number}",
+        "sender_name": "Ann Example",
+        "sender_email": "ann@example.com",
+        "recipients": "Bob; Carol",
+        "date": "2024-01-02T03:04:05",
+        "body": f"Hello {number}\nFrom the team\n",
+        "has_attachments": False,
+        "attachment_count": 0,
+        "attachment_names": [],
+        "thread_id": "00000000000000aa",
+        "content_hash": "0123456789abcdef",
+    }
+    email_fields.update(fields)
+    return email_fields
+
+
+def export_bytes(emails, export_format, chunk_bytes=export.EXPORT_CHUNK_BYTES):
+    return b"".join(stream_export(emails, export_format, chunk_bytes))
+
+
+def test_email_to_mime(tmp_path):
+    attachment = tmp_path / "report.pdf"
+    attachment.write_bytes(b"%PDF-1.4 data")
+    data = email_to_mime(make_email(1, subject="Grüße\nfrom Zürich", attachments=[("report.pdf", str(attachment))]))
+    message = email.message_from_bytes(data, policy=email.policy.default)
+    assert message["Subject"] == "Grüße from Zürich"
+    assert message["From"].addresses[0].addr_spec == "ann@example.com"
+    # Outlook keeps display names only, written as they are
+    assert b"\r\nTo: Bob; Carol\r\n" in data
+    assert message["Date"].datetime.isoformat() == "2024-01-02T03:04:05+00:00"
+    assert message["X-OST-Email-Id"] == "id1"
+    assert message.get_body().get_content() == "Hello 1\r\nFrom the team\r\n"
+    [part] = message.iter_attachments()
+    assert part.get_filename() == "report.pdf"
+    assert part.get_content_type() == "application/pdf"
+    assert part.get_content() == b"%PDF-1.4 data"
+
+
+def test_mbox(tmp_path):
+    path = tmp_path / "export.mbox"
+    path.write_bytes(export_bytes([make_email(number) for number in range(3)], "mbox"))
+    messages = list(mailbox.mbox(str(path)))
+    assert [message["X-OST-Email-Id"] for message in messages] == ["id0", "id1", "id2"]
+    assert messages[0].get_from().startswith("ann@example.com Tue Jan  2 03:04:05 2024")
+    # "From " lines of a body are quoted, so they do not start a message
+    assert b"\n>From the team" in path.read_bytes()
+
+
+def test_eml_zip():
+    emails = [make_email(number) for number in range(3)] + [make_email(3, subject="a/b: c?", date=None)]
+    archive = zipfile.ZipFile(io.BytesIO(export_bytes(emails, "eml")))
+    assert archive.testzip() is None
+    assert archive.namelist() == ["0000001 Subject 0.eml", "0000002 Subject 1.eml", "0000003 Subject 2.eml",
+                                  "0000004 a_b_ c_.eml"]
+    assert archive.getinfo("0000001 Subject 0.eml").date_time == (2024, 1, 2, 3, 4, 4)
+    message = email.message_from_bytes(archive.read("0000002 Subject 1.eml"))
+    assert message["Subject"] == "Subject 1"
+
+
+def test_eml_zip64(monkeypatch):
+    # Zip64 records are needed past 65535 entries
+    monkeypatch.setattr(export, "email_to_mime", lambda email_fields, linesep="\r\n": b"x")
+    emails = (make_email(number) for number in range(0x10000))
+    archive = zipfile.ZipFile(io.BytesIO(export_bytes(emails, "eml")))
+    assert len(archive.infolist()) == 0x10000
+    assert archive.read(archive.infolist()[-1]) == b"x"
+
+
+def test_csv():
+    emails = [make_email(0, has_attachments=True, attachment_count=2, attachment_names=["a.pdf", "b.txt"]),
+              make_email(1, body='quote " and, comma')]
+    rows = list(csv.reader(io.StringIO(export_bytes(emails, "csv").decode("utf-8"))))
+    assert tuple(rows[0]) == EXPORT_COLUMNS
+    first, second = (dict(zip(EXPORT_COLUMNS, row)) for row in rows[1:])
+    assert first["email_id"] == "id0" and first["attachment_names"] == "a.pdf; b.txt"
+    assert first["has_attachments"] == "True" and first["attachment_count"] == "2"
+    assert second["body"] == 'quote " and, comma'
+
+
+@pytest.mark.parametrize("export_format", ["mbox", "eml", "csv"])
+def test_stream_export_chunks(export_format):
+    emails = [make_email(number, body="word " * 200) for number in range(50)]
+    whole = export_bytes(emails, export_format, chunk_bytes=10 ** 9)
+    chunks = list(stream_export(emails, export_format, chunk_bytes=4096))
+    assert len(chunks) > 2
+    assert all(len(chunk) >= 4096 for chunk in chunks[:-1])
+    if export_format == "eml":
+        # Only the boundaries of the parts are random
+        assert len(b"".join(chunks)) == len(whole)
+    else:
+        assert b"".join(chunks) == whole
+
+
+def test_empty_exports():
+    assert export_bytes([], "mbox") == b""
+    assert zipfile.ZipFile(io.BytesIO(export_bytes([], "eml"))).namelist() == []
+    assert export_bytes([], "csv").decode().strip() == ",".join(EXPORT_COLUMNS)
@@ -0,0 +1,54 @@
+from date_index import DateIndex, parse_email_date
+from facet_index import FacetIndex
+from message_store import MessageStore
+
+MESSAGES = [
+    # sender, recipients, date, has attachments
+    ("ann@example.com", "Bob; Carol", "2024-01-30T09:00:00", True),
+    ("bob@example.org", "Ann", "2024-01-31T09:00:00", False),
+    ("ann@example.com", "Bob", "2024-02-01T09:00:00", False),
+    ("ann@example.com", "Carol", "2024-03-15T09:00:00", True),
+    ("carol@example.org", "Ann; Bob", None, True),
+]
+
+
+def make_facets():
+    store = MessageStore()
+    for sender, recipients, date, has_attachments in MESSAGES:
+        store.append_fields(sender_email=sender, sender_name=sender.split("@")[0].title(), recipients=recipients,
+                            date=date, has_attachments=has_attachments)
+    return store, FacetIndex(store, DateIndex(store.date_epochs))
+
+
+def labelled(field, counts):
+    return {field.labels[code]: count for code, count in counts.items()}
+
+
+def test_counts_over_everything():
+    store, facets = make_facets()
+    lo, hi = facets.bounds(None, None)
+    assert (lo, hi) == (0, 5)
+    assert labelled(facets.sender, facets.sender.counts(lo, hi)) == {
+        "ann@example.com": 3, "bob@example.org": 1, "carol@example.org": 1}
+    assert labelled(facets.recipient, facets.recipient.counts(lo, hi)) == {"Bob": 3, "Carol": 2, "Ann": 2}
+    assert facets.attachment_count(lo, hi) == 3
+    assert facets.sender_domains[store.sender_emails.codes[1]] == "example.org"
+    assert facets.sender_names[store.sender_emails.codes[0]] == "Ann"
+
+
+def test_counts_over_a_date_range():
+    _store, facets = make_facets()
+    lo, hi = facets.bounds(parse_email_date("2024-01-31"), parse_email_date("2024-02-29"))
+    assert hi - lo == 2
+    assert labelled(facets.sender, facets.sender.counts(lo, hi)) == {"ann@example.com": 1, "bob@example.org": 1}
+    assert labelled(facets.recipient, facets.recipient.counts(lo, hi)) == {"Ann": 1, "Bob": 1}
+    assert facets.attachment_count(lo, hi) == 0
+
+
+def test_histogram():
+    _store, facets = make_facets()
+    lo, hi = facets.bounds(None, None)
+    assert facets.histogram("month", lo, hi) == [("2024-01", 2), ("2024-02", 1), ("2024-03", 1)]
+    # 2024-01-29 is a Monday
+    assert facets.histogram("week", lo, hi) == [("2024-01-29", 3), ("2024-03-11", 1)]
+    assert facets.histogram("day", 1, 3) == [("2024-01-31", 1), ("2024-02-01", 1)]
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+from pydantic import BaseModel
+
+import fast_json
+from fast_json import FastJSONResponse, JSONFragments, add_field, dumps, encode_json
+
+
+class Point(BaseModel):
+    x: int
+    y: float
+
+
+@pytest.fixture(params=[True, False], ids=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param and not fast_json.ORJSON_AVAILABLE:
+        pytest.skip("orjson is not installed")
+    monkeypatch.setattr(fast_json, "ORJSON_AVAILABLE", request.param)
+    return request.param
+
+
+def test_both_encoders_agree(encoder):
+    value = {"name": "Zoë", "n": 3, "ratio": 0.5, "flags": (True, None), "tags": {"a"},
+             "point": Point(x=1, y=2.5), 7: "seven"}
+    assert dumps(value) == '{"name":"Zoë","n":3,"ratio":0.5,"flags":[true,null],"tags":["a"],' \
+                           '"point":{"x":1,"y":2.5},"7":"seven"}'.encode("utf-8")
+
+
+def test_non_finite_floats_become_null(encoder):
+    value = {"a": float("nan"), "b": [float("inf"), -float("inf"), 1.0], "c": Point(x=1, y=float("nan"))}
+    assert dumps(value) == b'{"a":null,"b":[null,null,1.0],"c":{"x":1,"y":null}}'
+
+
+def test_unknown_types_are_rejected(encoder):
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
+
+
+def test_add_field():
+    assert json.loads(add_field(b'{"a":1}', "b", [2])) == {"a": 1, "b": [2]}
+    assert json.loads(add_field(b"{}", "b", "x")) == {"b": "x"}
+
+
+def test_fragments_are_spliced_in():
+    fragments = JSONFragments([dumps({"id": 1}), dumps({"id": 2})])
+    assert encode_json(fragments) == b'[{"id":1},{"id":2}]'
+    page = encode_json({"total": 2, "emails": fragments, "next": None})
+    assert json.loads(page) == {"total": 2, "emails": [{"id": 1}, {"id": 2}], "next": None}
+    assert FastJSONResponse({"emails": fragments}).body == b'{"emails":[{"id":1},{"id":2}]}'
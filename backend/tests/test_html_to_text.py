@@ -0,0 +1,34 @@
+from html_to_text import BULLET, html_to_text
+
+
+def test_blocks_become_lines():
+    html = "<html><body><h1>Title</h1><p>First   paragraph\n spread over lines</p><div>Second<br/>third</div></body></html>"
+    assert html_to_text(html) == "Title\nFirst paragraph spread over lines\nSecond\nthird"
+
+
+def test_inline_markup_is_dropped():
+    assert html_to_text('Hello <b>bold</b> and <a href="x?a=1&amp;b=2">a link</a>!') == "Hello bold and a link!"
+
+
+def test_lists_and_tables():
+    html = "<ul><li>one</li><LI class='x'>two</LI></ul><table><tr><td>a</td><td>b</td></tr><tr><th>c</th></tr></table>"
+    assert html_to_text(html) == f"{BULLET}one\n{BULLET}two\na b\nc"
+
+
+def test_scripts_styles_titles_and_comments_are_removed():
+    html = ("<head><title>Newsletter</title><style>p { color: red; }</style>"
+            "<SCRIPT type='text/javascript'>if (a < b) { x = '<p>'; }</SCRIPT></head>"
+            "<body><!-- tracking <p>pixel</p> -->visible<!-- unterminated")
+    assert html_to_text(html) == "visible"
+
+
+def test_entities_are_decoded():
+    html = "R&amp;D &lt;beta&gt; &quot;q&quot; &mdash; &euro;5 &#169; &#x263A; &copy &nbsp;end &unknown;"
+    assert html_to_text(html) == 'R&D <beta> "q" — €5 © ☺ © end &unknown;'
+
+
+def test_text_is_not_treated_as_markup():
+    assert html_to_text("1 < 2 and 3 > 2, a<b") == "1 < 2 and 3 > 2, a<b"
+    assert html_to_text("keep\x00nul") == "keepnul"
+    assert html_to_text("") == ""
+    assert html_to_text(" <p> </p> &nbsp; ") == ""
@@ -0,0 +1,75 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import fake_pypff
+import server
+
+A = {"X-Session-Id": "a"}
+B = {"X-Session-Id": "b"}
+
+
+def search(client, headers, query):
+    response = client.post("/api/search-emails", json={"query": query, "projection": "full", "page_size": 500},
+                           headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["emails"]
+
+
+def browse(client, headers, path):
+    response = client.post("/api/browse-file", json={"file_path": path}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_refresh_adds_and_relocates(fake_ost):
+    client = TestClient(server.app)
+    assert browse(client, A, fake_ost.path)["email_count"] == 50
+
+    inbox, archive = fake_ost.root.folders
+    archive.messages.append(inbox.messages.pop(0))
+    inbox.messages.append(fake_pypff.FakeMessage(100, body="budget forecast"))
+    fake_ost.touch()
+    loaded = browse(client, A, fake_ost.path)
+    assert loaded["changes"]["added"] == 1 and loaded["changes"]["removed"] == 0
+    assert loaded["email_count"] == 51
+
+    hits = search(client, A, "forecast")
+    assert [email["subject"] for email in hits] == ["Message 100"]
+    moved = [email for email in search(client, A, '"Message 0"') if email["subject"] == "Message 0"]
+    assert [(email["folder_path"], email["message_index"]) for email in moved] == [("1", 10)]
+
+
+def test_refresh_with_removals_reloads_other_sessions(fake_ost):
+    client = TestClient(server.app)
+    browse(client, A, fake_ost.path)
+    browse(client, B, fake_ost.path)
+    before = search(client, B, "budget")
+    assert len(before) == 20
+
+    inbox = fake_ost.root.folders[0]
+    del inbox.messages[1:20:2]
+    fake_ost.touch()
+    loaded = browse(client, A, fake_ost.path)
+    assert loaded["changes"]["removed"] == 10
+
+    # Index positions were renumbered; B must not map them onto its old copy
+    hits_a = search(client, A, "budget")
+    hits_b = search(client, B, "budget")
+    assert len(hits_a) == 10
+    assert all("budget" in email["body"] for email in hits_b)
+    assert sorted(email["email_id"] for email in hits_b) == sorted(email["email_id"] for email in hits_a)
+
+
+def test_text_search_rejects_a_stale_copy(fake_ost):
+    stale = server.load_or_parse_ost_file(fake_ost.path, server.file_fingerprint(fake_ost.path), incremental=True)
+    del fake_ost.root.folders[0].messages[:5]
+    fake_ost.touch()
+    fresh = server.load_or_parse_ost_file(fake_ost.path, server.file_fingerprint(fake_ost.path), incremental=True)
+    assert fresh.changes["removed"] == 5
+    assert fresh.mailbox_id == stale.mailbox_id and fresh.generation != stale.generation
+
+    assert server.text_search_hits(fresh, "budget")
+    with pytest.raises(HTTPException) as raised:
+        server.text_search_hits(stale, "budget")
+    assert raised.value.status_code == 409
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from ingest_jobs import CANCELLED, COMPLETED, FAILED, JobManager
+
+
+def wait_for(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None:
+        assert time.monotonic() < deadline, f"job {job.id} did not finish"
+        time.sleep(0.01)
+    return job
+
+
+def test_jobs_complete_fail_and_clean_up():
+    manager = JobManager(max_workers=1)
+    cleaned = []
+    done = manager.submit("upload", "a.ost", lambda job: {"emails": 3}, cleanup=lambda: cleaned.append("a"))
+    failed = manager.submit("upload", "b.ost", lambda job: 1 / 0, cleanup=lambda: cleaned.append("b"))
+    assert wait_for(done).state == COMPLETED and done.result == {"emails": 3}
+    assert wait_for(failed).state == FAILED and "division" in failed.error
+    assert cleaned == ["a", "b"]
+    assert [job.id for job in manager.list()] == [failed.id, done.id]
+    manager.shutdown()
+
+
+def test_cancel_stops_a_running_job():
+    manager = JobManager(max_workers=1)
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    job = manager.submit("local", "c.ost", run)
+    started.wait(5)
+    manager.cancel(job.id)
+    assert wait_for(job).state == CANCELLED
+    manager.shutdown()
+
+
+def test_app_shutdown_stops_background_work(monkeypatch):
+    import server
+
+    stopped = []
+    monkeypatch.setattr(server.ingest_jobs, "shutdown", lambda: stopped.append("ingest jobs"))
+    monkeypatch.setattr(server.attachment_extractor, "shutdown", lambda: stopped.append("attachment extractor"))
+    with TestClient(server.app) as client:
+        assert client.get("/api/jobs").status_code == 200
+        assert stopped == []
+    assert stopped == ["ingest jobs", "attachment extractor"]
@@ -0,0 +1,169 @@
+import sqlite3
+
+import pytest
+
+from mail_index import SCHEMA_VERSION, MailboxChanged, MailIndex, file_fingerprint
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MailIndex(str(tmp_path / "index.sqlite3"))
+    yield index
+    index.close()
+
+
+def email(number, **fields):
+    row = {
+        "email_id": f"id{number}",
+        "subject": f"Subject {number}",
+        "sender_name": "Ann",
+        "sender_email": "ann@example.com",
+        "recipients": "Bob",
+        "date": f"2024-01-{number + 1:02d}T00:00:00",
+        "date_epoch": 1704067200.0 + 86400 * number,
+        "body": f"body {number}",
+        "folder_path": "0",
+        "message_index": number,
+        "message_identifier": 1000 + number,
+    }
+    row.update(fields)
+    return row
+
+
+def ids(index, mailbox_id):
+    return [row["email_id"] for row in index.iter_emails(mailbox_id)]
+
+
+def search(index, mailbox_id, match):
+    return sorted(position for position, _score in index.search(mailbox_id, match))
+
+
+def test_store_and_load(index):
+    mailbox_id = index.store_mailbox("fp1", "/data/a.ost", [email(0), email(1, attachment_names=["a.pdf"])],
+                                     folder_scans={"k": {"folder_path": "0", "message_count": 2,
+                                                         "last_identifier": 1001, "last_delivery_epoch": None}})
+    mailbox = index.find_mailbox("fp1")
+    assert mailbox["id"] == mailbox_id and mailbox["email_count"] == 2 and not mailbox["metadata_only"]
+    assert index.find_source_mailbox("/data/a.ost")["id"] == mailbox_id
+    rows = index.load_emails(mailbox_id)
+    assert [row["email_id"] for row in rows] == ["id0", "id1"]
+    assert rows[1]["attachment_names"] == ["a.pdf"] and rows[0]["has_attachments"] is False
+    assert index.folder_scans(mailbox_id)["k"]["message_count"] == 2
+    assert [row["email_id"] for row in index.folder_messages(mailbox_id, ["0"])] == ["id0", "id1"]
+
+
+def test_search(index):
+    mailbox_id = index.store_mailbox("fp1", None, [email(0, body="budget"), email(1, subject="Budget review"),
+                                                   email(2, has_attachments=True)])
+    hits = index.search(mailbox_id, '"budget"')
+    # A subject hit outranks a body hit
+    assert [position for position, _score in hits] == [1, 0]
+    assert [position for position, _score in index.search(mailbox_id, None)] == [2, 1, 0]
+    assert index.search(mailbox_id, None, has_attachment=True) == [(2, 0.0)]
+    with pytest.raises(sqlite3.OperationalError):
+        index.search(mailbox_id, "AND AND")
+
+
+def test_same_fingerprint_replaces_the_mailbox(index):
+    first = index.store_mailbox("fp1", "/data/a.ost", [email(0)])
+    second = index.store_mailbox("fp1", "/data/a.ost", [email(1)], metadata_only=True)
+    assert second == first
+    assert ids(index, second) == ["id1"] and index.find_mailbox("fp1")["metadata_only"]
+
+
+def test_replace_source_keeps_the_mailbox_id(index):
+    first = index.store_mailbox("fp1", "/data/a.ost", [email(0, body="old budget")])
+    assert index.replaced_mailbox_ids("fp2", "/data/a.ost") == [first]
+    generation = index.generation(first)
+
+    second = index.store_mailbox("fp2", "/data/a.ost", [email(1, body="new budget")], replace_source=True)
+    assert second == first
+    assert index.find_mailbox("fp1") is None and index.find_mailbox("fp2")["id"] == first
+    assert ids(index, first) == ["id1"]
+    assert index.search(first, '"old"') == [] and search(index, first, '"new"') == [0]
+    assert index.generation(first) == generation + 1
+
+
+def test_without_replace_source_copies_stay_apart(index):
+    first = index.store_mailbox("fp1", "upload.ost", [email(0)])
+    second = index.store_mailbox("fp2", "upload.ost", [email(1)])
+    assert second != first
+    assert ids(index, first) == ["id0"] and ids(index, second) == ["id1"]
+
+
+def test_update_mailbox(index):
+    mailbox_id = index.store_mailbox("fp1", None, [email(number, body=f"budget {number}") for number in range(4)])
+    rows = index.folder_messages(mailbox_id, ["0"])
+    generation = index.generation(mailbox_id)
+
+    count = index.update_mailbox(
+        mailbox_id, "fp2", [email(9, body="budget added")],
+        removed_ids=[rows[1]["id"]],
+        relocated=[(rows[3]["id"], "1", 0)],
+        folder_scans={"k": {"folder_path": "0", "message_count": 3, "last_identifier": 1009,
+                            "last_delivery_epoch": None}},
+    )
+    assert count == 4
+    assert ids(index, mailbox_id) == ["id0", "id2", "id3", "id9"]
+    moved = index.load_emails(mailbox_id)[2]
+    assert (moved["folder_path"], moved["message_index"]) == ("1", 0)
+    mailbox = index.get_mailbox(mailbox_id)
+    assert mailbox["fingerprint"] == "fp2" and mailbox["email_count"] == 4
+    assert mailbox["generation"] == generation + 1
+
+    # Positions were renumbered, in the full-text index too
+    assert search(index, mailbox_id, '"budget"') == [0, 1, 2, 3]
+    assert search(index, mailbox_id, '"added"') == [3]
+    assert index.search(mailbox_id, '"1"') == []
+
+
+def test_search_of_an_outdated_generation(index):
+    mailbox_id = index.store_mailbox("fp1", None, [email(0), email(1)])
+    generation = index.generation(mailbox_id)
+    assert index.search(mailbox_id, '"body"', generation=generation)
+    index.update_mailbox(mailbox_id, "fp2", [], [index.folder_messages(mailbox_id, ["0"])[0]["id"]], [], {})
+    with pytest.raises(MailboxChanged):
+        index.search(mailbox_id, '"body"', generation=generation)
+    hits = index.search(mailbox_id, '"body"', generation=index.generation(mailbox_id))
+    assert [position for position, _score in hits] == [0]
+
+
+def test_outdated_schema_is_rebuilt(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    index = MailIndex(path)
+    index.store_mailbox("fp1", None, [email(0)])
+    index._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION - 1}")
+    index._conn.commit()
+    index.close()
+    index = MailIndex(path)
+    assert index.find_mailbox("fp1") is None
+    index.close()
+
+
+def test_file_fingerprint(tmp_path):
+    path = tmp_path / "a.ost"
+    path.write_bytes(b"x" * 300_000)
+    fingerprint = file_fingerprint(str(path))
+    assert fingerprint == file_fingerprint(str(path))
+    with open(path, "r+b") as f:
+        f.seek(299_999)
+        f.write(b"y")
+    assert file_fingerprint(str(path)) != fingerprint
+
+
+def test_reparsed_file_replaces_its_earlier_copy(fake_ost):
+    import server
+
+    first = server.load_or_parse_ost_file(fake_ost.path, server.file_fingerprint(fake_ost.path))
+    server.register_mailbox("b", first, "mailbox.ost")
+    del fake_ost.root.folders[0].messages[:5]
+    fake_ost.touch()
+    second = server.load_or_parse_ost_file(fake_ost.path, server.file_fingerprint(fake_ost.path), incremental=False)
+
+    assert second.mailbox_id == first.mailbox_id
+    rows = server.mail_index._conn.execute("SELECT id FROM mailboxes WHERE source_path = ?", (fake_ost.path,))
+    assert [row["id"] for row in rows] == [first.mailbox_id]
+    # The other session's copy is reloaded from the new rows
+    entry = server.mailbox_catalog.current("b")
+    assert not entry.resident
+    assert len(server.mailbox_catalog.get("b", entry.handle).emails) == 45
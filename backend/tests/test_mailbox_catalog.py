@@ -0,0 +1,120 @@
+import pytest
+
+from mailbox_catalog import MailboxCatalog, MailboxNotFound
+
+
+class Mailbox:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+def make_catalog(max_bytes=100, spill=True):
+    return MailboxCatalog(max_bytes, spill=spill, size_of=lambda mailbox: mailbox.size)
+
+
+def reloader(name, size, calls=None):
+    def reload():
+        if calls is not None:
+            calls.append(name)
+        return Mailbox(name, size)
+    return reload
+
+
+def test_handles_belong_to_their_session():
+    catalog = make_catalog()
+    entry = catalog.add("a", Mailbox("one", 10), 10, label="one.ost")
+    assert catalog.current("a") is entry and catalog.current("b") is None
+    assert catalog.get("a", entry.handle).name == "one"
+    with pytest.raises(MailboxNotFound):
+        catalog.get("b", entry.handle)
+    assert catalog.remove("a", entry.handle) is entry
+    assert catalog.current("a") is None and catalog.resident_bytes == 0
+    with pytest.raises(MailboxNotFound):
+        catalog.get("a", entry.handle)
+
+
+def test_same_key_in_one_session_keeps_the_handle():
+    catalog = make_catalog()
+    first = catalog.add("a", Mailbox("old", 10), 10, key=1)
+    second = catalog.add("a", Mailbox("new", 20), 20, key=1)
+    assert second is first and catalog.get("a", first.handle).name == "new"
+    assert catalog.resident_bytes == 20 and len(catalog.entries("a")) == 1
+
+
+def test_least_recently_used_are_evicted_and_reloaded():
+    catalog = make_catalog(max_bytes=100)
+    calls = []
+    one = catalog.add("a", Mailbox("one", 40), 40, reload=reloader("one", 40, calls), key=1)
+    two = catalog.add("a", Mailbox("two", 40), 40, reload=reloader("two", 40, calls), key=2)
+    catalog.get("a", one.handle)
+    three = catalog.add("a", Mailbox("three", 40), 40, key=3)
+    # "two" was used least recently
+    assert not two.resident and one.resident and three.resident
+    assert catalog.resident_bytes == 80 and catalog.evictions == 1
+
+    assert catalog.get("a", two.handle).name == "two"
+    assert calls == ["two"] and catalog.reloads == 1
+    assert not one.resident and catalog.resident_bytes == 80
+
+
+def test_mailboxes_that_cannot_be_reloaded_are_dropped():
+    catalog = make_catalog(max_bytes=50)
+    one = catalog.add("a", Mailbox("one", 40), 40)
+    catalog.add("a", Mailbox("two", 40), 40)
+    with pytest.raises(MailboxNotFound):
+        catalog.get("a", one.handle)
+    catalog = make_catalog(max_bytes=50, spill=False)
+    one = catalog.add("a", Mailbox("one", 40), 40, reload=reloader("one", 40))
+    catalog.add("a", Mailbox("two", 40), 40)
+    with pytest.raises(MailboxNotFound):
+        catalog.get("a", one.handle)
+
+
+def test_reload_measures_the_mailbox_again():
+    catalog = make_catalog(max_bytes=100)
+    one = catalog.add("a", Mailbox("one", 40), 40, reload=reloader("one", 70), key=1)
+    catalog.add("a", Mailbox("two", 70), 70, key=2)
+    assert not one.resident
+    catalog.get("a", one.handle)
+    assert one.size_bytes == 70
+    # "two" made room for it
+    assert catalog.resident_bytes == 70
+
+
+def test_sessions_share_a_resident_copy():
+    catalog = make_catalog(max_bytes=100)
+    shared = Mailbox("shared", 60)
+    a = catalog.add("a", shared, 60, reload=reloader("shared", 60), key=1)
+    b = catalog.add("b", Mailbox("shared", 60), 60, reload=reloader("shared", 60), key=1)
+    # Counted once, and the newest copy is the one both sessions use
+    assert catalog.resident_bytes == 60 and catalog.stats()["resident_mailboxes"] == 1
+    assert catalog.get("a", a.handle) is catalog.get("b", b.handle)
+
+    # Evicting the copy frees it for both sessions
+    catalog.add("c", Mailbox("other", 50), 50, key=2)
+    assert not a.resident and not b.resident and catalog.resident_bytes == 50
+    calls = []
+    a.reload = b.reload = reloader("shared", 60, calls)
+    reloaded = catalog.get("a", a.handle)
+    assert catalog.get("b", b.handle) is reloaded and calls == ["shared"]
+
+
+def test_removing_one_sharer_keeps_the_copy():
+    catalog = make_catalog()
+    a = catalog.add("a", Mailbox("shared", 30), 30, key=1)
+    catalog.add("b", Mailbox("shared", 30), 30, key=1)
+    catalog.remove("a", a.handle)
+    assert catalog.resident_bytes == 30
+
+
+def test_rekey_drops_resident_copies():
+    catalog = make_catalog()
+    calls = []
+    a = catalog.add("a", Mailbox("old", 30), 30, reload=reloader("old", 30), key=1)
+    b = catalog.add("b", Mailbox("old", 30), 30, reload=reloader("old", 30), key=1)
+    catalog.rekey([1], 2, reloader("new", 35, calls))
+    assert not a.resident and not b.resident and catalog.resident_bytes == 0
+    assert a.key == b.key == 2
+    assert catalog.get("b", b.handle).name == "new" and catalog.get("a", a.handle).name == "new"
+    assert calls == ["new"] and catalog.resident_bytes == 35
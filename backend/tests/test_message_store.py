@@ -0,0 +1,101 @@
+import pytest
+
+from message_store import BODY_COMPRESS_MIN_BYTES, MessageStore
+
+
+def append(store, number, **fields):
+    fields.setdefault("body", f"body {number}")
+    return store.append_fields(
+        email_id=f"id{number}", subject=f"Subject {number}", sender_name="Ann", sender_email="ann@example.com",
+        recipients="Bob; Carol", date=f"2024-01-{number + 1:02d}T10:00:00", folder_path="Inbox",
+        message_index=number, message_identifier=1000 + number, thread_id="00000000000000ff",
+        content_hash="0123456789abcdef", **fields)
+
+
+def test_append_fields_round_trip():
+    store = MessageStore()
+    assert not store
+    position = append(store, 0, has_attachments=True, attachment_count=2, attachment_names=["a.pdf", "b.txt"],
+                      attachment_digests=["d1", ""])
+    assert position == 0 and len(store) == 1
+    row = store.row(0)
+    assert row["email_id"] == "id0"
+    assert row["subject"] == "Subject 0"
+    assert row["recipients"] == "Bob; Carol"
+    assert row["body"] == "body 0"
+    assert row["has_attachments"] and row["attachment_count"] == 2
+    assert row["attachment_names"] == ["a.pdf", "b.txt"]
+    assert row["attachment_digests"] == ["d1", ""]
+    assert row["folder_path"] == "Inbox" and row["message_index"] == 0
+    assert row["message_identifier"] == 1000
+    assert row["thread_id"] == "00000000000000ff"
+    assert row["content_hash"] == "0123456789abcdef"
+    assert row["simhash"] is None
+    assert store.date_epoch(0) == 1704103200.0
+    assert store.row(-1) == row
+    with pytest.raises(IndexError):
+        store.row(1)
+
+
+def test_missing_values():
+    store = MessageStore()
+    store.append_fields(subject="No date or body", date="garbage", body=None)
+    row = store.row(0)
+    assert row["body"] is None and not store.has_body(0)
+    assert row["message_index"] is None and row["message_identifier"] is None
+    assert row["thread_id"] is None and row["attachment_names"] == []
+    assert store.date_epoch(0) is None
+    assert store.body_preview(0, 10) == ""
+
+
+def test_long_bodies_are_compressed():
+    store = MessageStore()
+    body = "lorem ipsum dolor " * BODY_COMPRESS_MIN_BYTES
+    append(store, 0, body=body)
+    assert len(store.bodies.raw(0)) < len(body)
+    assert store.body(0) == body
+    assert store.body_preview(0, 11) == "lorem ipsum"
+    assert store.row(0, include_body=False)["body"] is None
+
+
+def test_date_epoch_can_be_given():
+    store = MessageStore()
+    store.append_fields(date="2024-01-01T00:00:00", date_epoch=None)
+    store.append_fields(date=None, date_epoch=5.0)
+    assert store.date_epoch(0) is None
+    assert store.date_epoch(1) == 5.0
+    assert [row["date_epoch"] for row in store.iter_rows()] == [None, 5.0]
+
+
+def test_relocate():
+    store = MessageStore()
+    for number in range(3):
+        append(store, number)
+    store.relocate(1, "Archive/2024", 7)
+    store.relocate(2, "Inbox", None)
+    assert (store.row(1)["folder_path"], store.row(1)["message_index"]) == ("Archive/2024", 7)
+    assert (store.row(2)["folder_path"], store.row(2)["message_index"]) == ("Inbox", None)
+    assert (store.row(0)["folder_path"], store.row(0)["message_index"]) == ("Inbox", 0)
+
+
+def test_copy_is_independent():
+    store = MessageStore()
+    for number in range(3):
+        append(store, number)
+    copy = store.copy()
+    assert copy.key != store.key
+    assert [copy.row(i) for i in range(3)] == [store.row(i) for i in range(3)]
+
+    copy.relocate(0, "Archive", 9)
+    append(copy, 3)
+    assert len(store) == 3 and len(copy) == 4
+    assert store.row(0)["folder_path"] == "Inbox" and store.row(0)["message_index"] == 0
+    assert copy.row(3)["email_id"] == "id3"
+
+
+def test_factory_materializes_messages():
+    store = MessageStore(factory=lambda **fields: (fields["email_id"], fields["subject"]))
+    append(store, 0)
+    append(store, 1)
+    assert store[1] == ("id1", "Subject 1")
+    assert list(store) == [("id0", "Subject 0"), ("id1", "Subject 1")]
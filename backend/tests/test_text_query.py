@@ -0,0 +1,59 @@
+import pytest
+
+from text_query import ParsedQuery, QueryError, parse_query
+
+
+def test_blank_query_matches_everything():
+    assert parse_query("") == ParsedQuery()
+    assert parse_query("   ") == ParsedQuery()
+    assert parse_query(None) == ParsedQuery()
+
+
+def test_words_are_all_required():
+    assert parse_query("budget forecast").match == '("budget" AND "forecast")'
+    assert parse_query("budget AND forecast").match == '("budget" AND "forecast")'
+
+
+def test_or_binds_tighter_than_and():
+    parsed = parse_query("budget OR forecast from:john")
+    assert parsed.match == '(("budget" OR "forecast") AND sender : "john")'
+
+
+def test_phrases_prefixes_and_fields():
+    assert parse_query('subject:"q4 report"').match == 'subject : "q4 report"'
+    assert parse_query("budg*").match == '"budg" *'
+    assert parse_query("attachment:invoice").match == '{attachments attachment_text} : "invoice"'
+    assert parse_query('say "hi"').match == '("say" AND "hi")'
+
+
+def test_unknown_field_is_searched_as_text():
+    assert parse_query("10:30").match == '"10:30"'
+
+
+def test_exclusions():
+    assert parse_query("budget -draft").match == '("budget" NOT "draft")'
+    assert parse_query("budget NOT draft").match == '("budget" NOT "draft")'
+
+
+def test_has_attachment_filter():
+    assert parse_query("has:attachment") == ParsedQuery(has_attachment=True)
+    assert parse_query("budget -has:attachment") == ParsedQuery(match='"budget"', has_attachment=False)
+
+
+@pytest.mark.parametrize("query", [
+    "-draft",
+    "budget OR -draft",
+    "(budget",
+    "budget)",
+    "budget OR",
+    "has:calendar",
+])
+def test_invalid_queries(query):
+    with pytest.raises(QueryError):
+        parse_query(query)
+
+
+@pytest.mark.parametrize("query", ["*", "AND", "()", "* AND *", '""'])
+def test_queries_without_search_terms_are_rejected(query):
+    with pytest.raises(QueryError):
+        parse_query(query)
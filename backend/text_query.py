@@ -0,0 +1,205 @@
+"""Parser for the free-text search syntax.
+
+Turns a user query such as
+
+    budget OR forecast from:john subject:"q4 report" has:attachment
+
+into an SQLite FTS5 MATCH expression over the columns of the mail index, plus
+the filters that are not text matches (``has:attachment``).
+
+Supported syntax:
+  - bare words, all required (implicit AND, or an explicit ``AND``)
+  - ``OR`` between terms (binding tighter than AND) and ``( ... )`` for grouping
+  - ``"quoted phrases"`` matched on consecutive token positions
+  - ``word*`` prefix matches
+  - ``-word`` / ``NOT word`` exclusions
+  - field scopes: ``from:``, ``to:``, ``subject:``, ``body:``,
+    ``attachment:`` (names and extracted text), ``filename:`` (names only)
+  - ``has:attachment`` (and ``-has:attachment``)
+"""
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+class QueryError(ValueError):
+    """Raised when a search query cannot be parsed"""
+
+
+# Query field name -> FTS5 column(s) it searches
+FIELD_COLUMNS = {
+    "from": "sender",
+    "sender": "sender",
+    "to": "recipients",
+    "recipient": "recipients",
+    "recipients": "recipients",
+    "subject": "subject",
+    "body": "body",
+    # Attachment names and the text extracted from them
+    "attachment": "{attachments attachment_text}",
+    "filename": "attachments",
+}
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|(-)?(?:([A-Za-z]+):)?(?:"([^"]*)"?|([^\s()"]+)))')
+
+
+@dataclass
+class ParsedQuery:
+    match: Optional[str] = None
+    has_attachment: Optional[bool] = None
+
+
+@dataclass
+class _Term:
+    text: str
+    column: Optional[str] = None
+    phrase: bool = False
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _term_to_fts(term: _Term) -> Optional[str]:
+    text = term.text.strip()
+    prefix = False
+    if not term.phrase and text.endswith("*"):
+        prefix = True
+        text = text.rstrip("*")
+    if not text:
+        return None
+
+    expr = _quote(text) + (" *" if prefix else "")
+    if term.column:
+        expr = f"{term.column} : {expr}"
+    return expr
+
+
+class _Parser:
+    def __init__(self, query: str):
+        self.tokens = self._tokenize(query)
+        self.pos = 0
+        self.has_attachment = None
+
+    @staticmethod
+    def _tokenize(query: str) -> list:
+        tokens = []
+        pos = 0
+        query = query.strip()
+        while pos < len(query):
+            m = _TOKEN_RE.match(query, pos)
+            if not m or m.end() == pos:
+                raise QueryError(f"Cannot parse query near: {query[pos:pos + 20]!r}")
+            pos = m.end()
+            lparen, rparen, minus, field, phrase, word = m.groups()
+            if lparen:
+                tokens.append(("(", None))
+            elif rparen:
+                tokens.append((")", None))
+            elif phrase is None and field is None and not minus and word in ("AND", "OR", "NOT"):
+                tokens.append((word, None))
+            else:
+                tokens.append(("TERM", (minus, field, phrase, word)))
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> Optional[str]:
+        expr = self._and_expr()
+        if self.pos != len(self.tokens):
+            raise QueryError("Unbalanced parentheses in query")
+        return expr
+
+    def _and_expr(self) -> Optional[str]:
+        positive: List[str] = []
+        negative: List[str] = []
+        while self._peek() not in (None, ")"):
+            if self._peek() == "AND":
+                self.pos += 1
+                continue
+            expr, negated = self._or_expr()
+            if expr:
+                (negative if negated else positive).append(expr)
+
+        if negative and not positive:
+            raise QueryError("A query cannot consist only of excluded terms")
+        if not positive:
+            return None
+        expr = positive[0] if len(positive) == 1 else "(" + " AND ".join(positive) + ")"
+        for neg in negative:
+            expr = f"({expr} NOT {neg})"
+        return expr
+
+    def _or_expr(self):
+        # OR binds tighter than the implicit AND, as in mail clients:
+        # 'budget OR forecast from:john' means '(budget OR forecast) AND from:john'
+        items = [self._negatable()]
+        while self._peek() == "OR":
+            self.pos += 1
+            items.append(self._negatable())
+        items = [item for item in items if item[0]]
+        if not items:
+            return None, False
+        if len(items) == 1:
+            return items[0]
+        if any(negated for _expr, negated in items):
+            raise QueryError("Excluded terms cannot be combined with OR")
+        return "(" + " OR ".join(expr for expr, _negated in items) + ")", False
+
+    def _negatable(self):
+        negate = False
+        if self._peek() == "NOT":
+            self.pos += 1
+            negate = True
+        expr, negated = self._unary()
+        return expr, negate != negated
+
+    def _unary(self):
+        kind = self._peek()
+        if kind == "(":
+            self.pos += 1
+            expr = self._and_expr()
+            if self._peek() != ")":
+                raise QueryError("Unbalanced parentheses in query")
+            self.pos += 1
+            return expr, False
+        if kind is None:
+            raise QueryError("Query ends unexpectedly")
+        if kind != "TERM":
+            raise QueryError(f"Unexpected {kind!r} in query")
+
+        minus, field, phrase, word = self.tokens[self.pos][1]
+        self.pos += 1
+        negated = bool(minus)
+
+        if field:
+            field = field.lower()
+            if field == "has":
+                value = (phrase if phrase is not None else word or "").lower()
+                if value not in ("attachment", "attachments"):
+                    raise QueryError(f"Unsupported filter has:{value}")
+                self.has_attachment = not negated
+                return None, False
+            if field not in FIELD_COLUMNS:
+                # Not a known field (e.g. a time like 10:30) - search the text as written
+                word = f"{field}:{word}" if word is not None else field
+                phrase = f"{field} {phrase}" if phrase is not None else None
+                field = None
+
+        term = _Term(
+            text=phrase if phrase is not None else word,
+            column=FIELD_COLUMNS.get(field) if field else None,
+            phrase=phrase is not None,
+        )
+        return _term_to_fts(term), negated
+
+
+def parse_query(query: str) -> ParsedQuery:
+    """Parse a user search query into an FTS5 expression and filters"""
+    parser = _Parser(query or "")
+    match = parser.parse()
+    if parser.tokens and match is None and parser.has_attachment is None:
+        # e.g. '*', 'AND' or '""' - not a request for every email
+        raise QueryError("Query has no search terms")
+    return ParsedQuery(match=match, has_attachment=parser.has_attachment)
@@ -15,16 +15,125 @@ import EmailViewer from "./EmailViewer";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8000';
 const API = `${BACKEND_URL}/api`;
+// Emails shown while a mailbox is still being parsed
+const STREAM_PREVIEW_LIMIT = 50;
+const JOB_POLL_INTERVAL_MS = 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Identifies this tab to the backend, so mailboxes loaded by other users of the
+// same server do not replace ours. Kept for the tab's lifetime, across reloads.
+const getSessionId = () => {
+  let sessionId = window.sessionStorage.getItem("ostSessionId");
+  if (!sessionId) {
+    sessionId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    window.sessionStorage.setItem("ostSessionId", sessionId);
+  }
+  return sessionId;
+};
+const SESSION_ID = getSessionId();
+axios.defaults.headers.common["X-Session-Id"] = SESSION_ID;
 
 const OSTExplorer = () => {
-  const [emails, setEmails] = useState([]);
+  // The backend returns one page of email summaries at a time
+  const [totalEmails, setTotalEmails] = useState(0);
   const [filteredEmails, setFilteredEmails] = useState([]);
+  const [filteredCount, setFilteredCount] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [lastSearch, setLastSearch] = useState({});
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedEmail, setSelectedEmail] = useState(null);
   const [loading, setLoading] = useState(false);
   const [dateRange, setDateRange] = useState({ start: null, end: null });
+  const [textQuery, setTextQuery] = useState("");
   const [localFilePath, setLocalFilePath] = useState("");
   const [uploadProgress, setUploadProgress] = useState(0);
   const [showEmails, setShowEmails] = useState(true);
+  const [ingestProgress, setIngestProgress] = useState(null);
+  const [activeJobId, setActiveJobId] = useState(null);
+
+  // Show the first page returned by a load (upload, browse or sample data)
+  const applyLoadedEmails = (data) => {
+    setTotalEmails(data.email_count);
+    setFilteredEmails(data.emails);
+    setFilteredCount(data.email_count);
+    setNextCursor(data.next_cursor);
+    setLastSearch({});
+    setSelectedEmail(null);
+    setShowEmails(false);
+  };
+
+  // Fetch the first page of a search
+  const runSearch = async (params) => {
+    const response = await axios.post(`${API}/search-emails`, params);
+    setFilteredEmails(response.data.emails);
+    setFilteredCount(response.data.email_count);
+    setNextCursor(response.data.next_cursor);
+    setLastSearch(params);
+    setSelectedEmail(null);
+    return response.data;
+  };
+
+  // Append the next page of the current search
+  const loadMoreEmails = async () => {
+    if (!nextCursor) return;
+
+    setLoadingMore(true);
+
+    try {
+      const response = await axios.post(`${API}/search-emails`, { ...lastSearch, cursor: nextCursor });
+      setFilteredEmails((current) => [...current, ...response.data.emails]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Load more error:', error);
+      toast.error(error.response?.data?.detail || "Failed to load more emails");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Poll a background ingest job until it finishes, showing its progress
+  const waitForJob = async (jobId) => {
+    setActiveJobId(jobId);
+    try {
+      while (true) {
+        const response = await axios.get(`${API}/jobs/${jobId}`);
+        const job = response.data.job;
+        if (job.progress) setIngestProgress(job.progress);
+
+        if (job.state === "completed") return job;
+        if (job.state === "failed") throw { response: { status: 500, data: { detail: job.error } } };
+        if (job.state === "cancelled") throw { response: { status: 499, data: { detail: "Parsing cancelled" } } };
+        await sleep(JOB_POLL_INTERVAL_MS);
+      }
+    } finally {
+      setActiveJobId(null);
+      setIngestProgress(null);
+    }
+  };
+
+  const cancelActiveJob = async () => {
+    if (!activeJobId) return;
+    try {
+      await axios.delete(`${API}/jobs/${activeJobId}`);
+    } catch (error) {
+      console.error('Cancel error:', error);
+      toast.error("Failed to cancel parsing");
+    }
+  };
+
+  // Fetch the full email (body and attachments) when it is opened
+  const openEmail = async (email) => {
+    try {
+      const response = await axios.get(`${API}/emails/${encodeURIComponent(email.email_id)}`, {
+        params: email.handle ? { handle: email.handle } : undefined,
+      });
+      setSelectedEmail(response.data.email);
+    } catch (error) {
+      console.error('Email detail error:', error);
+      toast.error(error.response?.data?.detail || "Failed to open email");
+    }
+  };
 
   const handleFileUpload = async (event) => {
     const file = event.target.files[0];
@@ -42,7 +151,8 @@ const OSTExplorer = () => {
     formData.append('file', file);
 
     try {
-      const response = await axios.post(`${API}/upload-ost`, formData, {
+      // Upload, then let the server parse in the background while we poll the job
+      const response = await axios.post(`${API}/jobs/upload-ost`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
         },
@@ -52,10 +162,11 @@ const OSTExplorer = () => {
         },
       });
 
-      setEmails(response.data.emails);
-      setFilteredEmails(response.data.emails);
-      setShowEmails(false);
-      toast.success(`Successfully loaded ${response.data.email_count} emails. Click the eye icon to view.`);
+      setUploadProgress(0);
+      await waitForJob(response.data.job.job_id);
+      const firstPage = await axios.post(`${API}/search-emails`, {});
+      applyLoadedEmails(firstPage.data);
+      toast.success(`Successfully loaded ${firstPage.data.email_count} emails. Click the eye icon to view.`);
     } catch (error) {
       console.error('Upload error:', error);
       const errorMessage = error.response?.data?.detail || "Failed to upload file";
@@ -80,16 +191,59 @@ const OSTExplorer = () => {
     }
 
     setLoading(true);
+    setIngestProgress(null);
 
     try {
-      const response = await axios.post(`${API}/browse-file`, {
-        file_path: localFilePath,
+      // Stream the parse: emails and progress arrive as NDJSON lines while the mailbox is read
+      const response = await fetch(`${API}/browse-file/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Session-Id': SESSION_ID },
+        body: JSON.stringify({ file_path: localFilePath }),
       });
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw { response: { status: response.status, data } };
+      }
 
-      setEmails(response.data.emails);
-      setFilteredEmails(response.data.emails);
-      setShowEmails(false);
-      toast.success(`Successfully loaded ${response.data.email_count} emails. Click the eye icon to view.`);
+      setFilteredEmails([]);
+      setSelectedEmail(null);
+      setShowEmails(true);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let result = null;
+
+      while (!result) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          if (event.type === "emails") {
+            setFilteredEmails((current) =>
+              current.length >= STREAM_PREVIEW_LIMIT ? current : [...current, ...event.emails].slice(0, STREAM_PREVIEW_LIMIT)
+            );
+          } else if (event.type === "progress") {
+            setIngestProgress(event);
+            setFilteredCount(event.messages_parsed);
+          } else if (event.type === "error") {
+            throw { response: { status: 500, data: { detail: event.detail } } };
+          } else if (event.type === "done") {
+            result = event;
+          }
+        }
+      }
+
+      if (!result) {
+        throw new Error("Connection closed before the file was fully parsed");
+      }
+      applyLoadedEmails(result);
+      toast.success(`Successfully loaded ${result.email_count} emails. Click the eye icon to view.`);
     } catch (error) {
       console.error('Browse error:', error);
       const errorMessage = error.response?.data?.detail || "Failed to load file";
@@ -102,12 +256,13 @@ const OSTExplorer = () => {
       }
     } finally {
       setLoading(false);
+      setIngestProgress(null);
     }
   };
 
   // Handle search with date filters
   const handleSearch = async () => {
-    if (emails.length === 0) {
+    if (totalEmails === 0) {
       toast.error("Please load emails first");
       return;
     }
@@ -115,17 +270,17 @@ const OSTExplorer = () => {
     setLoading(true);
 
     try {
-      const response = await axios.post(`${API}/search-emails`, {
+      const data = await runSearch({
         start_date: dateRange.start ? dateRange.start.toISOString() : null,
         end_date: dateRange.end ? dateRange.end.toISOString() : null,
+        query: textQuery.trim() || null,
       });
 
-      setFilteredEmails(response.data.emails);
       setShowEmails(true);
-      toast.success(`Found ${response.data.email_count} emails`);
+      toast.success(`Found ${data.email_count} emails`);
     } catch (error) {
       console.error('Search error:', error);
-      toast.error("Failed to search emails");
+      toast.error(error.response?.data?.detail || "Failed to search emails");
     } finally {
       setLoading(false);
     }
@@ -137,9 +292,7 @@ const OSTExplorer = () => {
 
     try {
       const response = await axios.get(`${API}/load-sample-data`);
-      setEmails(response.data.emails);
-      setFilteredEmails(response.data.emails);
-      setShowEmails(false);
+      applyLoadedEmails(response.data);
       toast.success(`Loaded ${response.data.email_count} sample emails. Click the eye icon to view.`);
     } catch (error) {
       console.error('Sample data error:', error);
@@ -150,24 +303,36 @@ const OSTExplorer = () => {
   };
 
   // Reset filters
-  const resetFilters = () => {
+  const resetFilters = async () => {
     setDateRange({ start: null, end: null });
-    setFilteredEmails(emails);
-    if (emails.length > 0) {
-      setShowEmails(true);
+    setTextQuery("");
+    if (totalEmails > 0) {
+      try {
+        await runSearch({});
+        setShowEmails(true);
+      } catch (error) {
+        console.error('Reset error:', error);
+        toast.error("Failed to reload emails");
+        return;
+      }
     }
     toast.info("Filters reset");
   };
 
   // Toggle email visibility
-  const toggleEmailVisibility = () => {
+  const toggleEmailVisibility = async () => {
     if (showEmails) {
       // Hide emails
       setShowEmails(false);
     } else {
       // Show emails - show all emails, not just filtered
-      setFilteredEmails(emails);
-      setShowEmails(true);
+      try {
+        await runSearch({});
+        setShowEmails(true);
+      } catch (error) {
+        console.error('Show emails error:', error);
+        toast.error("Failed to load emails");
+      }
     }
   };
 
@@ -259,6 +424,25 @@ const OSTExplorer = () => {
                         />
                       </div>
                     )}
+                    {activeJobId && (
+                      <div className="flex items-center justify-between gap-2">
+                        <p className="text-gray-400 text-xs" data-testid="job-progress">
+                          {ingestProgress
+                            ? `${ingestProgress.messages_parsed} emails parsed (${ingestProgress.messages_per_second}/s)`
+                            : "Waiting to start parsing..."}
+                        </p>
+                        <Button
+                          data-testid="cancel-job-btn"
+                          onClick={cancelActiveJob}
+                          variant="outline"
+                          size="sm"
+                          className="border-gray-700 hover:bg-gray-800 text-gray-300"
+                        >
+                          <X className="w-3 h-3 mr-1" />
+                          Cancel
+                        </Button>
+                      </div>
+                    )}
                   </TabsContent>
 
                   <TabsContent value="browse" className="space-y-4 mt-4">
@@ -289,6 +473,13 @@ const OSTExplorer = () => {
                         <FolderOpen className="w-4 h-4 mr-2" />
                         {loading ? "Loading..." : "Load OST File"}
                       </Button>
+                      {ingestProgress && (
+                        <p className="text-gray-400 text-xs" data-testid="ingest-progress">
+                          {ingestProgress.messages_parsed} emails parsed ({ingestProgress.messages_per_second}/s) in{" "}
+                          {ingestProgress.folders_visited} folders
+                          {ingestProgress.messages_skipped > 0 && `, ${ingestProgress.messages_skipped} skipped`}
+                        </p>
+                      )}
                     </div>
                   </TabsContent>
                 </Tabs>
@@ -303,17 +494,32 @@ const OSTExplorer = () => {
                   Date Filter
                 </CardTitle>
                 <CardDescription className="text-gray-400">
-                  Filter emails by date range
+                  Filter emails by text and date range
                 </CardDescription>
               </CardHeader>
               <CardContent className="space-y-4">
+                <div className="space-y-2">
+                  <Label htmlFor="text-query" className="text-gray-300 font-medium">
+                    Search Text
+                  </Label>
+                  <Input
+                    id="text-query"
+                    data-testid="text-query-input"
+                    placeholder='budget OR forecast from:john subject:"q4 report" has:attachment'
+                    value={textQuery}
+                    onChange={(e) => setTextQuery(e.target.value)}
+                    onKeyDown={(e) => e.key === 'Enter' && handleSearch()}
+                    className="bg-gray-800 border-gray-700 text-gray-200 placeholder:text-gray-500 text-sm"
+                  />
+                </div>
+
                 <DateRangePicker dateRange={dateRange} setDateRange={setDateRange} />
 
                 <div className="flex space-x-2">
                   <Button
                     data-testid="search-btn"
                     onClick={handleSearch}
-                    disabled={loading || emails.length === 0}
+                    disabled={loading || totalEmails === 0}
                     className="flex-1 bg-gradient-to-r from-blue-600 to-purple-600 hover:from-blue-700 hover:to-purple-700"
                   >
                     <Search className="w-4 h-4 mr-2" />
@@ -332,11 +538,11 @@ const OSTExplorer = () => {
                 <div className="pt-4 border-t border-gray-800">
                   <div className="flex justify-between text-sm">
                     <span className="text-gray-400">Total Emails:</span>
-                    <span className="text-white font-semibold">{emails.length}</span>
+                    <span className="text-white font-semibold">{totalEmails}</span>
                   </div>
                   <div className="flex justify-between text-sm mt-2">
                     <span className="text-gray-400">Filtered Results:</span>
-                    <span className="text-blue-400 font-semibold">{filteredEmails.length}</span>
+                    <span className="text-blue-400 font-semibold">{filteredCount}</span>
                   </div>
                 </div>
               </CardContent>
@@ -353,14 +559,14 @@ const OSTExplorer = () => {
                       Email Results
                     </CardTitle>
                     <CardDescription className="text-gray-400 mt-1">
-                      {emails.length === 0
+                      {totalEmails === 0
                         ? "No emails loaded. Upload an OST file or load sample data."
                         : showEmails
-                        ? `Showing ${filteredEmails.length} email${filteredEmails.length !== 1 ? 's' : ''}`
-                        : `${emails.length} email${emails.length !== 1 ? 's' : ''} loaded (hidden)`}
+                        ? `Showing ${filteredEmails.length} of ${filteredCount} email${filteredCount !== 1 ? 's' : ''}`
+                        : `${totalEmails} email${totalEmails !== 1 ? 's' : ''} loaded (hidden)`}
                     </CardDescription>
                   </div>
-                  {emails.length > 0 && (
+                  {totalEmails > 0 && (
                     <Button
                       data-testid="toggle-visibility-btn"
                       onClick={toggleEmailVisibility}
@@ -384,7 +590,7 @@ const OSTExplorer = () => {
                 </div>
               </CardHeader>
               <CardContent>
-                {emails.length === 0 ? (
+                {totalEmails === 0 ? (
                   <div className="flex flex-col items-center justify-center py-20 text-center">
                     <div className="p-6 bg-gray-800/50 rounded-full mb-4">
                       <Mail className="w-16 h-16 text-gray-600" />
@@ -401,7 +607,7 @@ const OSTExplorer = () => {
                     </div>
                     <h3 className="text-xl font-semibold text-gray-300 mb-2">Emails Hidden</h3>
                     <p className="text-gray-500 max-w-md mb-4">
-                      {emails.length} email{emails.length !== 1 ? 's are' : ' is'} loaded but hidden.
+                      {totalEmails} email{totalEmails !== 1 ? 's are' : ' is'} loaded but hidden.
                     </p>
                     <Button
                       data-testid="show-emails-btn"
@@ -429,9 +635,9 @@ const OSTExplorer = () => {
                     <div className="space-y-3">
                       {filteredEmails.map((email, index) => (
                         <div
-                          key={index}
+                          key={email.email_id ? `${email.handle || ''}:${email.email_id}` : index}
                           data-testid={`email-item-${index}`}
-                          onClick={() => setSelectedEmail(email)}
+                          onClick={() => openEmail(email)}
                           className="p-4 bg-gray-800/50 border border-gray-700 rounded-lg hover:bg-gray-800 hover:border-blue-500 cursor-pointer transition-all group"
                         >
                           <div className="flex items-start justify-between">
@@ -452,7 +658,7 @@ const OSTExplorer = () => {
                                 {email.subject || "(No Subject)"}
                               </h4>
                               <p className="text-sm text-gray-400 line-clamp-2">
-                                {email.body ? email.body.substring(0, 150) + (email.body.length > 150 ? "..." : "") : "No content"}
+                                {email.preview ? email.preview.substring(0, 150) + (email.preview.length > 150 ? "..." : "") : "No content"}
                               </p>
                             </div>
                             <div className="flex flex-col items-end space-y-2 ml-4">
@@ -464,6 +670,17 @@ const OSTExplorer = () => {
                           </div>
                         </div>
                       ))}
+                      {nextCursor && (
+                        <Button
+                          data-testid="load-more-btn"
+                          onClick={loadMoreEmails}
+                          disabled={loadingMore}
+                          variant="outline"
+                          className="w-full border-gray-700 hover:bg-gray-800 text-gray-300"
+                        >
+                          {loadingMore ? "Loading..." : `Load more (${filteredCount - filteredEmails.length} remaining)`}
+                        </Button>
+                      )}
                     </div>
                   </ScrollArea>
                 )}